@@ -0,0 +1,226 @@
+"""
+Several API calls in one round trip, for clients on slow mobile links.
+
+POST batch/ with an ordered list of sub-requests:
+
+    {"atomic": false, "requests": [
+        {"name": "loan", "path": "group/12/?fields=id,members", "method": "GET"},
+        {"path": "group/{{loan.id}}/payments/", "method": "POST", "body": {...}},
+    ]}
+
+Each one is dispatched to the view `apis.urls` maps its path to (relative
+to the API root), in order, as the batch's own user: the credentials are
+checked once, for the batch. `{{name.key.0.key}}` in a path, header or
+body string is replaced by that part of an earlier named sub-request's
+response body; a string that is nothing but a reference takes the value
+with its JSON type. A sub-request whose reference cannot be resolved is
+not run and gets a 424.
+
+With "atomic": true the whole batch runs in one transaction (on each
+database, when loans are sharded) and stops at the first sub-request that
+fails; its writes are then rolled back and the sub-requests after it are
+reported as not run. Otherwise every sub-request runs and commits on its
+own, as separate calls would.
+
+Only JSON bodies, and only DRF views: file uploads and the event stream
+still need their own requests.
+"""
+import io
+import json
+import logging
+import re
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, QueryDict, StreamingHttpResponse
+from django.urls import Resolver404, resolve
+from rest_framework import serializers, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+
+from mifi import sharding
+
+logger = logging.getLogger(__name__)
+
+METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+REFERENCE = re.compile(r'\{\{\s*(\w+)((?:\.[\w-]+)*)\s*\}\}')
+# Set by the sub-view's renderer, which never runs inside a batch
+SKIPPED_HEADERS = {'content-type', 'content-length', 'vary', 'allow'}
+
+
+def _setting(name, default):
+    return getattr(settings, 'BATCH', {}).get(name, default)
+
+
+class SubRequestSerializer(serializers.Serializer):
+    name = serializers.RegexField(r'^\w+$', max_length=50, required=False)
+    method = serializers.ChoiceField(choices=METHODS, default='GET')
+    path = serializers.CharField(max_length=2000)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    atomic = serializers.BooleanField(default=False)
+    requests = SubRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, requests):
+        limit = _setting('MAX_REQUESTS', 20)
+        if len(requests) > limit:
+            raise serializers.ValidationError(f"At most {limit} sub-requests per batch.")
+        names = [sub['name'] for sub in requests if 'name' in sub]
+        if len(names) != len(set(names)):
+            raise serializers.ValidationError("Sub-request names must be unique.")
+        return requests
+
+
+class UnresolvedReference(Exception):
+    pass
+
+
+class RolledBack(Exception):
+    pass
+
+
+def _lookup(results, name, path):
+    if name not in results:
+        raise UnresolvedReference(f"No earlier sub-request named '{name}'.")
+    result = results[name]
+    if result['status'] >= 400:
+        raise UnresolvedReference(f"Sub-request '{name}' failed.")
+    value = result['body']
+    for key in path.split('.')[1:]:
+        try:
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        except (IndexError, KeyError, TypeError, ValueError):
+            raise UnresolvedReference(f"'{name}{path}' is not in the response.")
+    return value
+
+
+def substitute(value, results):
+    """`value` with every {{name.path}} replaced from the named results."""
+    if isinstance(value, dict):
+        return {key: substitute(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+    whole = REFERENCE.fullmatch(value.strip())
+    if whole:
+        return _lookup(results, whole.group(1), whole.group(2))
+    return REFERENCE.sub(lambda match: str(_lookup(results, match.group(1), match.group(2))), value)
+
+
+def _error(code, detail):
+    return {'status': code, 'headers': {}, 'body': {'detail': detail}}
+
+
+class BatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        atomic = serializer.validated_data['atomic']
+        subs = serializer.validated_data['requests']
+
+        responses = []
+        try:
+            if atomic:
+                with sharding.atomic(sharding.shards()):
+                    self.run(request, subs, responses, stop_on_failure=True)
+            else:
+                self.run(request, subs, responses, stop_on_failure=False)
+            committed = True
+        except RolledBack:
+            committed = False
+            responses += [
+                {'name': sub.get('name'), **_error(status.HTTP_424_FAILED_DEPENDENCY, "Not run: the batch was rolled back.")}
+                for sub in subs[len(responses):]
+            ]
+
+        data = {'responses': responses}
+        if atomic:
+            data['committed'] = committed
+        return Response(data)
+
+    def run(self, request, subs, responses, stop_on_failure):
+        results = {}
+        for sub in subs:
+            try:
+                path = substitute(sub['path'], results)
+                headers = {name: str(value) for name, value in substitute(sub.get('headers', {}), results).items()}
+                body = substitute(sub.get('body'), results)
+            except UnresolvedReference as exc:
+                result = _error(status.HTTP_424_FAILED_DEPENDENCY, str(exc))
+            else:
+                result = self.dispatch_sub_request(request, sub['method'], str(path), headers, body)
+
+            if 'name' in sub:
+                results[sub['name']] = result
+            responses.append({'name': sub.get('name'), **result})
+            if stop_on_failure and result['status'] >= 400:
+                raise RolledBack()
+
+    def api_root(self, request):
+        return request.path[:-len('batch/')]
+
+    def dispatch_sub_request(self, request, method, path, headers, body):
+        root = self.api_root(request)
+        url = urlsplit(path)
+        path = url.path[len(root):] if url.path.startswith(root) else url.path.lstrip('/')
+        try:
+            match = resolve('/' + path, urlconf='apis.urls')
+        except Resolver404:
+            return _error(status.HTTP_404_NOT_FOUND, f"No endpoint at '{path}'.")
+        view_class = getattr(match.func, 'cls', None)
+        if view_class is None or view_class is BatchView or iscoroutinefunction(match.func):
+            return _error(status.HTTP_400_BAD_REQUEST, f"'{path}' cannot be called from a batch.")
+
+        sub = self.build_request(request, method, root + path, url.query, headers, body)
+        sub.resolver_match = match
+        try:
+            response = match.func(sub, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception("Batch sub-request %s %s failed", method, path)
+            return _error(status.HTTP_500_INTERNAL_SERVER_ERROR, "Server error.")
+        return self.result(response)
+
+    def build_request(self, request, method, path, query, headers, body):
+        outer = request._request
+        content = b'' if body is None else json.dumps(body, cls=JSONEncoder).encode()
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = path
+        sub.META = {
+            **outer.META,
+            **{'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()},
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+        }
+        sub.GET = QueryDict(query)
+        sub.COOKIES = outer.COOKIES
+        sub._stream = io.BytesIO(content)
+        sub._read_started = False
+        # The batch's credentials were checked once; the sub-views reuse them
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+        return sub
+
+    def result(self, response):
+        if isinstance(response, StreamingHttpResponse):
+            return _error(status.HTTP_400_BAD_REQUEST, "Streaming responses cannot be batched.")
+        if isinstance(response, Response):
+            body = response.data
+        elif response.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(response.content or 'null')
+        else:
+            body = response.content.decode(response.charset, errors='replace')
+        headers = {name: value for name, value in response.items() if name.lower() not in SKIPPED_HEADERS}
+        return {'status': response.status_code, 'headers': headers, 'body': body}
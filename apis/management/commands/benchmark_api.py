@@ -0,0 +1,292 @@
+import gc
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from io import StringIO
+from statistics import quantiles
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apis import urls
+from core.models import (
+    Collateral,
+    GroupLoan,
+    GroupLoanPayment,
+    GroupMemberStatus,
+    IndividualLoan,
+    IndividualLoanPayment,
+)
+from jobs import queue
+from jobs.models import Job
+from reports.models import ActiveGroupsReport, ActiveLoansReport, AmountLoanedReport, PaymentsCollectedReport
+from users.models import User
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'benchmark_baseline.json')
+PREFIX = '/api/test/v1/'
+ROLES = ['superuser', 'manager', 'region_manager', 'loan_officer', 'clients']
+
+# Views that are not model viewsets, or whose queryset is built per request
+PK_MODELS = {
+    'reports/jobs/<int:pk>/': Job,
+}
+QUERY_PARAMS = {
+    'search/': {'q': 'mw'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every GET route in apis/urls.py as each role against a freshly seeded test database, "
+        "recording p50/p95/p99 latency, SQL query count and response size, and fail on regressions "
+        "against apis/benchmark_baseline.json. Latency budgets are relative, so refresh the baseline "
+        "with --update-baseline when moving to different hardware."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--clients', type=int, default=40, help="Dataset size passed to generate_portfolio")
+        parser.add_argument('--iterations', type=int, default=10, help="Timed requests per route and role")
+        parser.add_argument('--route', action='append', help="Only benchmark routes starting with this (repeatable)")
+        parser.add_argument('--baseline', default=BASELINE)
+        parser.add_argument('--update-baseline', action='store_true', help="Write the results as the new baseline")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+        parser.add_argument('--max-slowdown', type=float, default=2.0,
+                            help="Allowed p50 and p95 latency ratio over baseline")
+        parser.add_argument('--min-delta-ms', type=float, default=20.0,
+                            help="Ignore latency changes smaller than this, which are noise at this scale")
+        parser.add_argument('--max-extra-queries', type=int, default=0, help="Allowed extra SQL queries per request")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError("--iterations must be at least 2")
+        self.options = options
+
+        baseline = None if options['update_baseline'] else self.load_baseline()
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # 4xx/5xx responses and slow requests are expected here and would drown the table
+        loggers = [logging.getLogger(name) for name in ('django.request', 'mifi.slow_requests')]
+        try:
+            for logger in loggers:
+                logger.disabled = True
+            with override_settings(DEBUG=False, METRICS={'ENABLED': False}, THROTTLING={'ENABLED': False}):
+                self.seed()
+                results = self.run_routes(baseline or {})
+        finally:
+            for logger in loggers:
+                logger.disabled = False
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'dataset': self.dataset(),
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        if options['output']:
+            self.write_json(options['output'], report)
+        if options['update_baseline']:
+            self.write_json(options['baseline'], report)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}"))
+            return
+
+        regressions = self.compare(baseline, results)
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(line))
+            raise CommandError(f"{len(regressions)} benchmark regression(s)")
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
+
+    def dataset(self):
+        return {'seed': self.options['seed'], 'clients': self.options['clients']}
+
+    def load_baseline(self):
+        path = self.options['baseline']
+        if not os.path.exists(path):
+            raise CommandError(f"No baseline at {path}; run with --update-baseline first")
+        with open(path) as fh:
+            baseline = json.load(fh)
+        if baseline['dataset'] != self.dataset():
+            raise CommandError(f"Baseline was recorded for {baseline['dataset']}, not {self.dataset()}")
+        return baseline['results']
+
+    def write_json(self, path, data):
+        with open(path, 'w') as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+
+    def seed(self):
+        options = self.options
+        call_command(
+            'generate_portfolio', seed=options['seed'], clients=options['clients'], regions=3, officers=6,
+            chunk_size=options['clients'], stdout=StringIO(),
+        )
+        call_command('backfill_ledger', stdout=StringIO())
+
+        # The first officer carries the most loans in their region; they and one of their borrowers make the sample
+        officer = User.objects.filter(role='loan_officer').order_by('id').first()
+        loan = IndividualLoan.objects.filter(loan_officer=officer).exclude(payments=None).order_by('id').first()
+        group_loan = GroupLoan.objects.filter(loan_officer=officer).order_by('id').first()
+        self.users = {
+            'superuser': User.objects.create_superuser(
+                email='bench.superuser@example.com', password=None, nrc_number='BENCH-SU',
+            ),
+            'manager': User.objects.create_user(
+                email='bench.manager@example.com', nrc_number='BENCH-MG', role='manager', is_staff=True,
+            ),
+            'region_manager': User.objects.get(role='region_manager', region=officer.region),
+            'loan_officer': officer,
+            'clients': loan.recipient,
+        }
+
+        today = timezone.localdate()
+        for name, payload in [
+            ('reports.payments_collected', {
+                'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat(),
+            }),
+            ('reports.active_groups', {}),
+            ('reports.amount_loaned', {}),
+            ('reports.active_loans', {}),
+        ]:
+            queue.get_task(name)(**payload)
+        queue.enqueue('reports.active_groups')
+
+        self.loans = {'individual': loan, 'group': group_loan}
+        self.samples = {
+            IndividualLoan: loan.pk,
+            GroupLoan: group_loan.pk if group_loan else None,
+            IndividualLoanPayment: loan.payments.order_by('id').values_list('id', flat=True).first(),
+            GroupLoanPayment: GroupLoanPayment.objects.filter(loan=group_loan).values_list('id', flat=True).first(),
+            GroupMemberStatus: GroupMemberStatus.objects.filter(group_loan=group_loan).values_list('id', flat=True).first(),
+            Collateral: Collateral.objects.filter(
+                content_type=ContentType.objects.get_for_model(IndividualLoan), object_id=loan.pk
+            ).values_list('id', flat=True).first(),
+            User: loan.recipient_id,
+        }
+        for model in (PaymentsCollectedReport, ActiveGroupsReport, AmountLoanedReport, ActiveLoansReport, Job):
+            self.samples[model] = model.objects.values_list('id', flat=True).first()
+
+    def routes(self):
+        """GET routes from apis/urls.py, once each (the module repeats some)."""
+        seen = set()
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue
+            route = str(pattern.pattern)
+            actions = getattr(pattern.callback, 'actions', None) or {}
+            if 'get' not in actions or route in seen:
+                continue
+            if self.options['route'] and not any(route.startswith(prefix) for prefix in self.options['route']):
+                continue
+            seen.add(route)
+            yield route, pattern
+
+    def url_for(self, route, pattern):
+        kwargs = {}
+        for name in pattern.pattern.converters:
+            if name == 'loan_id':
+                loan = self.loans.get(route.split('/')[0])
+                kwargs[name] = loan.pk if loan else None
+            elif name == 'pk':
+                cls = pattern.callback.cls
+                model = PK_MODELS.get(route)
+                if model is None:
+                    model = cls.queryset.model if getattr(cls, 'queryset', None) is not None else cls.serializer_class.Meta.model
+                kwargs[name] = self.samples.get(model)
+            if kwargs[name] is None:
+                return None
+
+        path = route
+        for name, value in kwargs.items():
+            path = path.replace(f'<int:{name}>', str(value))
+        return PREFIX + path
+
+    def run_routes(self, baseline):
+        results = {}
+        for route, pattern in self.routes():
+            url = self.url_for(route, pattern)
+            if url is None:
+                self.stdout.write(self.style.WARNING(f"GET {route}: no sample row in the dataset, skipped"))
+                continue
+            for role in ROLES:
+                key = f"GET {route} as {role}"
+                result = self.measure(url, self.users[role])
+                if key in baseline and self.slower(baseline[key], result):
+                    # A single noisy run on a shared machine should not fail a release
+                    retry = self.measure(url, self.users[role])
+                    result = min(result, retry, key=lambda r: r['p95_ms'])
+                results[key] = result
+                self.stdout.write(
+                    f"GET {route:45} {role:15} {result['status']}  p50 {result['p50_ms']:8.1f}ms  "
+                    f"p95 {result['p95_ms']:8.1f}ms  p99 {result['p99_ms']:8.1f}ms  "
+                    f"{result['queries']:4} queries  {result['bytes']:9} bytes"
+                )
+        return results
+
+    def measure(self, url, user):
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(user)
+        params = QUERY_PARAMS.get(url[len(PREFIX):], {})
+
+        client.get(url, params)  # warm caches and lazy imports before timing
+        timings = []
+        # Like timeit, keep collector pauses out of the numbers
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(self.options['iterations']):
+                queries = []
+                with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                    started = time.perf_counter()
+                    response = client.get(url, params)
+                    timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            gc.enable()
+
+        cuts = quantiles(timings, n=100, method='inclusive')
+        return {
+            'status': response.status_code,
+            'p50_ms': round(cuts[49], 2),
+            'p95_ms': round(cuts[94], 2),
+            'p99_ms': round(cuts[98], 2),
+            'queries': len(queries),
+            'bytes': len(response.content),
+        }
+
+    def slower(self, expected, result):
+        """Latency percentiles that moved past both the ratio and the absolute noise floor."""
+        options = self.options
+        return [
+            percentile for percentile in ('p50_ms', 'p95_ms')
+            if result[percentile] > max(
+                expected[percentile] * options['max_slowdown'], expected[percentile] + options['min_delta_ms']
+            )
+        ]
+
+    def compare(self, baseline, results):
+        regressions = []
+        for key, result in results.items():
+            expected = baseline.get(key)
+            if expected is None:
+                self.stdout.write(self.style.WARNING(f"{key}: not in baseline"))
+                continue
+            if result['status'] != expected['status']:
+                regressions.append(f"{key}: status {expected['status']} -> {result['status']}")
+            if result['queries'] > expected['queries'] + self.options['max_extra_queries']:
+                regressions.append(f"{key}: {expected['queries']} -> {result['queries']} queries")
+            for percentile in self.slower(expected, result):
+                before, after = expected[percentile], result[percentile]
+                regressions.append(
+                    f"{key}: {percentile[:3]} {before:.1f}ms -> {after:.1f}ms ({after / max(before, 0.001):.1f}x)"
+                )
+        return regressions
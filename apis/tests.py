@@ -1,3 +1,137 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from core.models import IndividualLoan
+from core.tests import API, make_individual_loan, make_user
+from ledger.models import JournalEntry
+from .management.commands import benchmark_api
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class BatchTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.loan = make_individual_loan(self.officer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.officer)
+
+    def batch(self, requests, atomic=False):
+        response = self.client.post(API + 'batch/', {'atomic': atomic, 'requests': requests}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def pay(self, amount, loan='{{loan.id}}'):
+        return {
+            'method': 'POST', 'path': f'individual/payments/{loan}/',
+            'body': {'loan': loan, 'amount': amount, 'payment_type': 'NORMAL'},
+        }
+
+    def reload(self):
+        return IndividualLoan.objects.using(self.loan._state.db).get(pk=self.loan.pk)
+
+    def test_references_take_values_from_earlier_responses(self):
+        data = self.batch([
+            {'name': 'loan', 'path': f'individual/{self.loan.pk}/?fields=id,total_due'},
+            self.pay('100.00'),
+            {'path': 'individual/{{loan.id}}/?fields=id,total_paid'},
+        ])
+        self.assertEqual([response['status'] for response in data['responses']], [200, 201, 200])
+        # A whole-string reference keeps its JSON type; one inside a string is formatted into it
+        self.assertEqual(data['responses'][1]['body']['loan'], self.loan.pk)
+        self.assertEqual(data['responses'][2]['body'], {'id': self.loan.pk, 'total_paid': '100.00'})
+        self.assertEqual(self.reload().total_paid, Decimal('100.00'))
+
+    def test_unresolved_references_fail_their_sub_request_only(self):
+        data = self.batch([
+            {'name': 'loan', 'path': 'individual/999999999/'},
+            self.pay('100.00'),
+            {'name': 'mine', 'path': f'individual/{self.loan.pk}/'},
+            {'path': 'individual/{{mine.no_such_field}}/'},
+            {'path': 'individual/{{later.id}}/'},
+            {'name': 'later', 'path': f'individual/{self.loan.pk}/'},
+        ])
+        self.assertEqual([response['status'] for response in data['responses']], [404, 424, 200, 424, 424, 200])
+        self.assertEqual(
+            [data['responses'][index]['body']['detail'] for index in (1, 3, 4)],
+            ["Sub-request 'loan' failed.", "'mine.no_such_field' is not in the response.", "No earlier sub-request named 'later'."]
+        )
+        self.assertNotIn('committed', data)
+        self.assertEqual(self.reload().payment_count, 0)
+
+    def test_atomic_batch_rolls_back_at_the_first_failure(self):
+        entries = JournalEntry.objects.count()
+        data = self.batch([
+            {'name': 'loan', 'path': f'individual/{self.loan.pk}/'},
+            self.pay('100.00'),
+            # More than is left to pay
+            self.pay('950.00'),
+            self.pay('1.00'),
+        ], atomic=True)
+        self.assertFalse(data['committed'])
+        self.assertEqual([response['status'] for response in data['responses']], [200, 201, 400, 424])
+        self.assertEqual(data['responses'][3]['body']['detail'], "Not run: the batch was rolled back.")
+
+        loan = self.reload()
+        self.assertEqual((loan.total_paid, loan.payment_count), (Decimal('0.00'), 0))
+        self.assertEqual(JournalEntry.objects.count(), entries)
+
+        data = self.batch([self.pay('100.00', self.loan.pk), self.pay('1.00', self.loan.pk)], atomic=True)
+        self.assertTrue(data['committed'])
+        self.assertEqual(self.reload().total_paid, Decimal('101.00'))
+
+
+class BenchmarkTests(SimpleTestCase):
+    def setUp(self):
+        self.command = benchmark_api.Command(stdout=StringIO())
+        self.command.options = {'max_slowdown': 2.0, 'min_delta_ms': 20.0, 'max_extra_queries': 0, 'route': None}
+
+    def result(self, status=200, p50=10.0, p95=20.0, queries=5):
+        return {'status': status, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p95, 'queries': queries, 'bytes': 100}
+
+    def test_regressions_need_more_than_noise(self):
+        baseline = {'GET a/ as manager': self.result(), 'GET b/ as manager': self.result()}
+        regressions = self.command.compare(baseline, {
+            # Three times slower, but by less than the noise floor
+            'GET a/ as manager': self.result(p50=30.0, p95=39.0),
+            'GET b/ as manager': self.result(status=500, p50=31.0, queries=7),
+            'GET c/ as manager': self.result(),
+        })
+        self.assertEqual(regressions, [
+            'GET b/ as manager: status 200 -> 500',
+            'GET b/ as manager: 5 -> 7 queries',
+            'GET b/ as manager: p50 10.0ms -> 31.0ms (3.1x)',
+        ])
+        self.assertIn('GET c/ as manager: not in baseline', self.command.stdout.getvalue())
+
+        self.command.options['max_extra_queries'] = 2
+        self.assertEqual(len(self.command.compare(baseline, {'GET b/ as manager': self.result(queries=7)})), 0)
+
+    def test_routes_are_each_get_route_once(self):
+        routes = [route for route, _ in self.command.routes()]
+        self.assertEqual(len(routes), len(set(routes)))
+        self.assertIn('individual/<int:pk>/', routes)
+        self.assertNotIn('batch/', routes)
+
+        self.command.options['route'] = ['group/']
+        self.assertTrue(all(route.startswith('group/') for route, _ in self.command.routes()))
+
+    def test_baseline_must_match_the_dataset(self):
+        with self.assertRaisesMessage(CommandError, "--iterations must be at least 2"):
+            call_command('benchmark_api', iterations=1, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            with self.assertRaisesMessage(CommandError, "run with --update-baseline first"):
+                call_command('benchmark_api', baseline=path, stdout=StringIO())
+            with open(path, 'w') as fh:
+                json.dump({'dataset': {'seed': 7, 'clients': 40}, 'results': {}}, fh)
+            with self.assertRaisesMessage(CommandError, "Baseline was recorded for"):
+                call_command('benchmark_api', baseline=path, clients=80, stdout=StringIO())
@@ -1,11 +1,15 @@
 from django.contrib import admin
 from django.urls import path
-from core.views import CollateralTypeViewSet, CollateralViewSet, GroupLoanPaymentViewSet, IndividualLoanPaymentViewSet, IndividualLoanViewSet, GroupLoanViewSet, GroupMemberStatusViewSet, LoanTypeViewSet
+from core.views import CollateralTypeViewSet, CollateralViewSet, GroupCollectionSheetViewSet, GroupLoanPaymentViewSet, IndividualLoanPaymentViewSet, IndividualLoanViewSet, GroupLoanViewSet, GroupMemberStatusViewSet, LoanTypeViewSet, OfficerDashboardViewSet, OnboardingImportViewSet
 from core.views import GroupLoanPaymentViewSet, IndividualLoanPaymentViewSet, IndividualLoanViewSet, GroupLoanViewSet, GroupMemberStatusViewSet
-from users.views import UserViewSet
-from reports.views import PaymentsCollectedViewSet,ActiveGroupsViewSet,AmountLoanedViewSet,ActiveLoansViewSet
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from users.serializers import CustomTokenObtainPairSerializer
+from users.views import TokenObtainView, UserViewSet
+from core.models import GroupLoan, IndividualLoan
+from search.views import SearchViewSet
+from ledger.views import LoanLedgerViewSet
+from live.views import StreamTicketView, payment_feed
+from reports.views import PaymentsCollectedViewSet,ActiveGroupsViewSet,AmountLoanedViewSet,ActiveLoansViewSet,ReportGenerationViewSet
+from rest_framework_simplejwt.views import TokenRefreshView
+from .batch import BatchView
 
 
 
@@ -69,6 +73,25 @@ urlpatterns = [
         'delete': 'destroy'
     }), name='group-loan-payment-detail'),
 
+    path('group/<int:loan_id>/collection-sheet/', GroupCollectionSheetViewSet.as_view({
+        'get': 'list',
+        'post': 'create'
+    }), name='group-collection-sheet'),
+
+    # Ledger
+    path('individual/<int:loan_id>/ledger/', LoanLedgerViewSet.as_view({
+        'get': 'list'
+    }, loan_model=IndividualLoan), name='individual-loan-ledger'),
+    path('individual/<int:loan_id>/balance/', LoanLedgerViewSet.as_view({
+        'get': 'balance'
+    }, loan_model=IndividualLoan), name='individual-loan-balance'),
+    path('group/<int:loan_id>/ledger/', LoanLedgerViewSet.as_view({
+        'get': 'list'
+    }, loan_model=GroupLoan), name='group-loan-ledger'),
+    path('group/<int:loan_id>/balance/', LoanLedgerViewSet.as_view({
+        'get': 'balance'
+    }, loan_model=GroupLoan), name='group-loan-balance'),
+
     path('group-members/', GroupMemberStatusViewSet.as_view({
         'get': 'list',
         'post': 'create'
@@ -79,9 +102,22 @@ urlpatterns = [
         'delete': 'destroy'
     }), name='group-member-detail'),
 
+    path('live/payments/', payment_feed, name='live-payments'),
+    path('live/ticket/', StreamTicketView.as_view(), name='live-ticket'),
+
+    path('dashboard/', OfficerDashboardViewSet.as_view({
+        'get': 'list'
+    }), name='officer-dashboard'),
+
+    path('imports/onboarding/', OnboardingImportViewSet.as_view({
+        'post': 'create'
+    }), name='onboarding-import'),
+
+    path('batch/', BatchView.as_view(), name='batch'),
+
     #users
     path('admin/', admin.site.urls),
-    path('token/', TokenObtainPairView.as_view(serializer_class=CustomTokenObtainPairSerializer), name='token_obtain_pair'),
+    path('token/', TokenObtainView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('users/', UserViewSet.as_view({
         'get': 'list',
@@ -134,6 +170,18 @@ urlpatterns = [
         'delete': 'destroy'
     }), name='active-loans-detail'),
 
+    path('reports/generate/', ReportGenerationViewSet.as_view({
+        'post': 'create'
+    }), name='report-generate'),
+    path('reports/jobs/<int:pk>/', ReportGenerationViewSet.as_view({
+        'get': 'retrieve'
+    }), name='report-job-detail'),
+
+    # Search
+    path('search/', SearchViewSet.as_view({
+        'get': 'list'
+    }), name='search'),
+
     # Collaterals
     path('collaterals/', CollateralViewSet.as_view({
         'get': 'list',
@@ -144,6 +192,12 @@ urlpatterns = [
         'patch': 'partial_update',
         'delete': 'destroy'
     }), name='collateral-detail'),
+    path('collaterals/review-queue/', CollateralViewSet.as_view({
+        'get': 'review_queue'
+    }), name='collateral-review-queue'),
+    path('collaterals/bulk-verify/', CollateralViewSet.as_view({
+        'post': 'bulk_verify'
+    }), name='collateral-bulk-verify'),
     path('collaterals/loan-types/', LoanTypeViewSet.as_view({
         'get': 'list'
     }), name='loan-types-list'),
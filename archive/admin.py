@@ -0,0 +1,34 @@
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+
+from .models import ArchivedLoan
+from .store import restore_loans
+
+
+@admin.register(ArchivedLoan)
+class ArchivedLoanAdmin(admin.ModelAdmin):
+    list_display = ('object_id', 'content_type', 'loan_officer', 'amount', 'completed_at', 'archived_at')
+    list_filter = ('content_type',)
+    list_select_related = ('content_type', 'loan_officer')
+    search_fields = ('=object_id',)
+    raw_id_fields = ('loan_officer', 'recipient')
+    readonly_fields = ('content_type', 'object_id', 'loan_officer', 'recipient', 'amount', 'completed_at',
+                       'archived_at', 'data')
+    actions = ['restore']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Restore selected loans to the live tables")
+    def restore(self, request, queryset):
+        ids = {}
+        for content_type_id, object_id in queryset.values_list('content_type_id', 'object_id'):
+            ids.setdefault(content_type_id, []).append(object_id)
+        restored = sum(
+            restore_loans(ContentType.objects.get_for_id(content_type_id).model_class(), object_ids)
+            for content_type_id, object_ids in ids.items()
+        )
+        self.message_user(request, f"{restored} loans restored.")
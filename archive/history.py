@@ -0,0 +1,59 @@
+"""
+Reading archived loans as if they were still in the hot tables: the loan
+views, payment views and ledger fall back to these when a loan is not
+found, and serialize what they get back like any other instance.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import prefetch_related_objects
+
+from users.models import User
+from .models import ArchivedLoan, ArchivedPayment
+from .store import PAYMENT_MODELS, rebuild, visible_to
+
+
+def _attach(instance, name, model, objects):
+    """Make instance.<name>.all() return `objects` without a query, as prefetch_related would."""
+    queryset = model.objects.all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache = {**getattr(instance, '_prefetched_objects_cache', {}), name: queryset}
+
+
+def _payments(model, archived_loan):
+    payment_model = PAYMENT_MODELS[model]
+    payments = [
+        rebuild(payment_model, archived_payment.data)
+        for archived_payment in ArchivedPayment.objects.filter(archived_loan=archived_loan).order_by('-payment_date')
+    ]
+    prefetch_related_objects(payments, *[
+        field.name for field in payment_model._meta.concrete_fields
+        if field.is_relation and field.related_model is User
+    ])
+    return payments
+
+
+def find_loan(model, pk, user=None):
+    """
+    The archived loan as an unsaved `model` instance with its payments (and
+    members) attached, or None if it is not archived or `user` may not see it.
+    """
+    archived = visible_to(user, model) if user is not None else ArchivedLoan.objects.filter(
+        content_type=ContentType.objects.get_for_model(model)
+    )
+    archived_loan = archived.filter(object_id=pk).first()
+    if archived_loan is None:
+        return None
+    loan = rebuild(model, archived_loan.data)
+    loan.loan_officer_id = archived_loan.loan_officer_id
+    _attach(loan, 'payments', PAYMENT_MODELS[model], _payments(model, archived_loan))
+    if 'members' in [field.name for field in model._meta.many_to_many]:
+        _attach(loan, 'members', User, User.objects.filter(archived_memberships__archived_loan=archived_loan))
+    return loan
+
+
+def find_payments(model, loan_id):
+    """The archived loan's payments, newest first, or None if the loan is not archived."""
+    archived_loan = ArchivedLoan.objects.filter(
+        content_type=ContentType.objects.get_for_model(model), object_id=loan_id
+    ).first()
+    return _payments(model, archived_loan) if archived_loan else None
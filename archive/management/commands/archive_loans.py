@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from archive.store import archive_completed
+
+
+class Command(BaseCommand):
+    help = (
+        "Move loans completed more than --months months ago (default ARCHIVE['AFTER_MONTHS']), with their "
+        "payments, group memberships and collateral rows, into the archive tables, a chunk of loans per "
+        "transaction. Safe to stop and re-run. Bring loans back with restore_loans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int)
+        parser.add_argument('--chunk-size', type=int, help="Loans per transaction (default ARCHIVE['CHUNK_SIZE'])")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the loans that would move")
+
+    def handle(self, *args, **options):
+        if options['months'] is not None and options['months'] < 0:
+            raise CommandError("--months cannot be negative")
+
+        moved = archive_completed(
+            months=options['months'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+            progress=lambda label, done: self.stdout.write(f"{label}: {done} archived"),
+        )
+        verb = "would be archived" if options['dry_run'] else "archived"
+        for label, count in moved.items():
+            self.stdout.write(f"{label}: {count} loans {verb}")
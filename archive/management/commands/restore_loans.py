@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from archive.store import LOAN_MODELS, restore_loans
+
+LOAN_KINDS = {model._meta.model_name.replace('loan', ''): model for model in LOAN_MODELS}
+
+
+class Command(BaseCommand):
+    help = (
+        "Put archived loans back in the hot tables under their old ids, with their payments, memberships "
+        "and collateral rows. Loans are given as individual:<id> or group:<id>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('loans', nargs='+', help="e.g. individual:42 group:7")
+
+    def handle(self, *args, **options):
+        ids = {model: [] for model in LOAN_MODELS}
+        for loan in options['loans']:
+            kind, _, loan_id = loan.partition(':')
+            if kind not in LOAN_KINDS or not loan_id.isdigit():
+                raise CommandError(f"{loan!r} is not individual:<id> or group:<id>")
+            ids[LOAN_KINDS[kind]].append(int(loan_id))
+
+        for model, loan_ids in ids.items():
+            if not loan_ids:
+                continue
+            restored = restore_loans(model, loan_ids)
+            self.stdout.write(f"{model._meta.label}: {restored} of {len(loan_ids)} loans restored")
+            if restored < len(loan_ids):
+                self.stderr.write("The others are not in the archive.")
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedloan',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='archivedpayment',
+            name='payment_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
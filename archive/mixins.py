@@ -0,0 +1,49 @@
+from django.http import Http404
+
+from . import history
+
+
+class ArchivedLoanMixin:
+    """Loan viewsets: retrieving a loan that has been archived reads it from the archive."""
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+            loan = history.find_loan(self.queryset.model, self.kwargs.get('pk'), self.request.user)
+            if loan is None:
+                raise
+            return loan
+
+
+class ArchivedPaymentsMixin:
+    """
+    Payment viewsets mapped under a loan_id: listing or retrieving the
+    payments of an archived loan reads them from the archive. Only a loan
+    with no payments in the hot table pays for the extra lookup.
+    """
+
+    def get_loan_model(self):
+        return self.get_serializer_class().Meta.model._meta.get_field('loan').related_model
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not response.data:
+            payments = history.find_payments(self.get_loan_model(), self.kwargs.get('loan_id'))
+            if payments:
+                response.data = self.get_serializer(payments, many=True).data
+        return response
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+            payments = history.find_payments(self.get_loan_model(), self.kwargs.get('loan_id')) or []
+            for payment in payments:
+                if str(payment.pk) == str(self.kwargs.get('pk')):
+                    return payment
+            raise
@@ -0,0 +1,68 @@
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+
+class ArchivedLoan(models.Model):
+    """
+    A completed loan moved out of the hot tables. `data` holds every column
+    of the original row, so it can be read back as a loan or restored with
+    the same id; the other columns are what history lookups and reports need.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.PROTECT)
+    object_id = models.PositiveBigIntegerField()
+    loan = GenericForeignKey('content_type', 'object_id')
+    loan_officer = models.ForeignKey(
+        'users.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='archived_loans'
+    )
+    recipient = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='archived_loans_as_recipient'
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    completed_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='archived_loan_unique'),
+        ]
+
+    def __str__(self):
+        return f"Archived {self.content_type.model} {self.object_id}"
+
+
+class ArchivedPayment(models.Model):
+    archived_loan = models.ForeignKey(ArchivedLoan, on_delete=models.CASCADE, related_name='payments')
+    payment_id = models.PositiveBigIntegerField()
+    member = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='archived_payments'
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    payment_date = models.DateTimeField(db_index=True)
+    data = models.JSONField()
+
+
+class ArchivedMembership(models.Model):
+    archived_loan = models.ForeignKey(ArchivedLoan, on_delete=models.CASCADE, related_name='memberships')
+    member = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        related_name='archived_memberships'
+    )
+    data = models.JSONField()
+
+
+class ArchivedCollateral(models.Model):
+    """Only the row: the uploaded file stays where it is."""
+    archived_loan = models.ForeignKey(ArchivedLoan, on_delete=models.CASCADE, related_name='collaterals')
+    data = models.JSONField()
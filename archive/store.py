@@ -0,0 +1,271 @@
+"""
+Moving completed loans between the hot tables and the archive.
+
+A loan goes with its payments, group memberships and collateral rows, a
+chunk of loans per transaction, so the hot tables never lose a loan
+without the archive gaining it and no transaction holds locks for long.
+Archived rows keep every column as JSON: reading one back gives an
+ordinary (unsaved) loan or payment instance, and restoring inserts the
+rows again under their old ids. Journal entries stay where they are;
+they refer to loans by id and need no move.
+
+The archive is on 'default'. Loans are archived shard by shard, and
+restored to the shard of their loan officer's region.
+"""
+import calendar
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from core.models import Collateral, GroupLoan, GroupLoanPayment, GroupMemberStatus, IndividualLoan, IndividualLoanPayment
+from mifi import sharding
+from users.models import User
+from .models import ArchivedCollateral, ArchivedLoan, ArchivedMembership, ArchivedPayment
+
+LOAN_MODELS = (IndividualLoan, GroupLoan)
+PAYMENT_MODELS = {IndividualLoan: IndividualLoanPayment, GroupLoan: GroupLoanPayment}
+MANAGER_ROLES = ['superuser', 'manager', 'region_manager']
+
+
+def _setting(name, default):
+    return getattr(settings, 'ARCHIVE', {}).get(name, default)
+
+
+def _value(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, FieldFile):
+        return value.name
+    return value
+
+
+def row(instance):
+    """Every column of `instance`, as JSON-safe values keyed by attname."""
+    return {field.attname: _value(field.value_from_object(instance)) for field in instance._meta.concrete_fields}
+
+
+def rebuild(model, data):
+    """A `model` instance, as if loaded from the database, from a row() dict."""
+    fields = model._meta.concrete_fields
+    values = [
+        field.to_python(data[field.attname]) if field.attname in data else field.get_default()
+        for field in fields
+    ]
+    return model.from_db(DEFAULT_DB_ALIAS, [field.attname for field in fields], values)
+
+
+def cutoff(months=None):
+    """Loans completed before this moment are due for the archive."""
+    months = _setting('AFTER_MONTHS', 12) if months is None else months
+    today = timezone.localdate()
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    # The same day of the month, or the month's last day when it is shorter
+    day = min(today.day, calendar.monthrange(year, month + 1)[1])
+    first_kept = datetime.date(year, month + 1, day)
+    return timezone.make_aware(datetime.datetime.combine(first_kept, datetime.time.min))
+
+
+def _due(model, before):
+    return model.objects.filter(status='completed', updated_at__lt=before)
+
+
+def archive_loans(model, ids, before):
+    """
+    Move the given loans on the pinned shard, if they are still completed
+    before `before`. Returns how many moved.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    payment_model = PAYMENT_MODELS[model]
+    with sharding.atomic():
+        loans = list(_due(model, before).select_for_update().filter(id__in=ids))
+        if not loans:
+            return 0
+        ids = [loan.pk for loan in loans]
+        archived = {
+            archived_loan.object_id: archived_loan
+            for archived_loan in ArchivedLoan.objects.bulk_create([
+                ArchivedLoan(
+                    content_type=content_type,
+                    object_id=loan.pk,
+                    loan_officer_id=loan.loan_officer_id,
+                    recipient_id=getattr(loan, 'recipient_id', None),
+                    amount=loan.amount,
+                    completed_at=loan.updated_at,
+                    data=row(loan),
+                )
+                for loan in loans
+            ])
+        }
+
+        payments = payment_model.objects.filter(loan_id__in=ids)
+        ArchivedPayment.objects.bulk_create([
+            ArchivedPayment(
+                archived_loan=archived[payment.loan_id],
+                payment_id=payment.pk,
+                member_id=getattr(payment, 'member_id', None),
+                amount=payment.amount,
+                payment_date=payment.payment_date,
+                data=row(payment),
+            )
+            for payment in payments.iterator()
+        ], batch_size=1000)
+
+        if model is GroupLoan:
+            memberships = GroupMemberStatus.objects.filter(group_loan_id__in=ids)
+            ArchivedMembership.objects.bulk_create([
+                ArchivedMembership(
+                    archived_loan=archived[membership.group_loan_id],
+                    member_id=membership.member_id,
+                    data=row(membership),
+                )
+                for membership in memberships.iterator()
+            ], batch_size=1000)
+            memberships.delete()
+
+        collaterals = Collateral.objects.filter(content_type=content_type, object_id__in=ids)
+        ArchivedCollateral.objects.bulk_create([
+            ArchivedCollateral(archived_loan=archived[collateral.object_id], data=row(collateral))
+            for collateral in collaterals.iterator()
+        ], batch_size=1000)
+
+        collaterals.delete()
+        payments.delete()
+        model.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_completed(months=None, chunk_size=None, dry_run=False, progress=None):
+    """
+    Archive every loan completed more than `months` months ago, `chunk_size`
+    loans per transaction. Returns {model label: loans archived} (or due,
+    on a dry run).
+    """
+    before = cutoff(months)
+    chunk_size = chunk_size or _setting('CHUNK_SIZE', 200)
+    moved = {}
+    for model in LOAN_MODELS:
+        label = model._meta.label
+        moved[label] = 0
+        for alias in sharding.each_shard():
+            if dry_run:
+                moved[label] += _due(model, before).count()
+                continue
+            last_id = 0
+            while True:
+                ids = list(
+                    _due(model, before).filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+                )
+                if not ids:
+                    break
+                moved[label] += archive_loans(model, ids, before)
+                last_id = ids[-1]
+                if progress:
+                    progress(label, moved[label])
+    return moved
+
+
+def _existing_users(instances):
+    """
+    Point foreign keys to since-deleted users at nobody, as SET_NULL would
+    have done; rows whose user would have been CASCADE-deleted are dropped.
+    """
+    if not instances:
+        return instances
+    fields = [
+        field for field in instances[0]._meta.concrete_fields
+        if field.is_relation and field.related_model is User
+    ]
+    ids = {getattr(instance, field.attname) for instance in instances for field in fields} - {None}
+    existing = set(User.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    kept = []
+    for instance in instances:
+        missing = [field for field in fields if getattr(instance, field.attname) not in existing | {None}]
+        if any(not field.null for field in missing):
+            continue
+        for field in missing:
+            setattr(instance, field.attname, None)
+        kept.append(instance)
+    return kept
+
+
+def _insert(instances):
+    """
+    INSERT the rows exactly as they were, the way loaddata does: a raw save
+    keeps auto_now timestamps and tells post_save receivers (the ledger's
+    disbursement) that this is not a new loan.
+    """
+    for instance in instances:
+        instance._state.adding = True
+        instance.save_base(raw=True, force_insert=True)
+
+
+def _restore(model, archived):
+    loans = []
+    for archived_loan in archived:
+        loan = rebuild(model, archived_loan.data)
+        loan.loan_officer_id = archived_loan.loan_officer_id
+        loans.append(loan)
+    _insert(_existing_users(loans))
+    if model is GroupLoan:
+        _insert(_existing_users([
+            rebuild(GroupMemberStatus, membership.data)
+            for archived_loan in archived for membership in archived_loan.memberships.all()
+        ]))
+    _insert(_existing_users([
+        rebuild(PAYMENT_MODELS[model], payment.data)
+        for archived_loan in archived for payment in archived_loan.payments.all()
+    ]))
+    _insert(_existing_users([
+        rebuild(Collateral, collateral.data)
+        for archived_loan in archived for collateral in archived_loan.collaterals.all()
+    ]))
+
+
+def restore_loans(model, ids):
+    """
+    Put archived loans back in the hot tables under their old ids, each on
+    its loan officer's shard. Returns how many were restored.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    with sharding.atomic(sharding.shards()):
+        archived = list(
+            ArchivedLoan.objects.select_for_update().filter(content_type=content_type, object_id__in=ids)
+            .prefetch_related('payments', 'memberships', 'collaterals')
+        )
+        if not archived:
+            return 0
+
+        regions = dict(
+            User.objects.filter(pk__in={archived_loan.loan_officer_id for archived_loan in archived})
+            .values_list('pk', 'region')
+        )
+        by_shard = defaultdict(list)
+        for archived_loan in archived:
+            by_shard[sharding.shard_for_region(regions.get(archived_loan.loan_officer_id))].append(archived_loan)
+        for alias, group in by_shard.items():
+            with sharding.pinned(alias):
+                _restore(model, group)
+
+        ArchivedLoan.objects.filter(pk__in=[archived_loan.pk for archived_loan in archived]).delete()
+    return len(archived)
+
+
+def visible_to(user, model):
+    """Archived loans of `model` the user may read, with the same rules as the hot loan views."""
+    archived = ArchivedLoan.objects.filter(content_type=ContentType.objects.get_for_model(model))
+    if user.role in MANAGER_ROLES:
+        return archived
+    if user.role == 'loan_officer':
+        return archived.filter(loan_officer=user)
+    if model is IndividualLoan:
+        return archived.filter(Q(loan_officer=user) | Q(recipient=user))
+    return archived.filter(memberships__member=user).distinct()
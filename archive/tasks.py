@@ -0,0 +1,7 @@
+from jobs.queue import task
+from .store import archive_completed
+
+
+@task('archive.loans')
+def archive_loans(months=None):
+    return archive_completed(months=months)
@@ -0,0 +1,109 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import Collateral, GroupLoan, GroupLoanPayment, GroupMemberStatus, IndividualLoan, IndividualLoanPayment
+from core.tests import API, make_group_loan, make_individual_loan, make_user
+from .models import ArchivedCollateral, ArchivedLoan, ArchivedMembership, ArchivedPayment
+from .store import archive_completed, restore_loans
+
+
+# Each test reads a fresh dashboard
+@override_settings(THROTTLING={'ENABLED': False}, DASHBOARD={'CACHE_SECONDS': 0})
+class ArchiveTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.members = [make_user(), make_user()]
+        self.loan = make_individual_loan(self.officer, recipient=self.members[0])
+        self.group = make_group_loan(self.officer, self.members)
+        self.db = self.loan._state.db
+
+        self.payment = self.loan.make_normal_payment(Decimal('100.00'), self.officer)
+        self.group_payments = [
+            self.group.make_normal_payment(Decimal('50.00'), self.officer, member) for member in self.members
+        ]
+        self.collateral = Collateral.objects.using(self.db).create(
+            content_type=ContentType.objects.get_for_model(GroupLoan), object_id=self.group.pk,
+            collateral_type='PHOTO', file='collateral.jpg', uploaded_by=self.officer
+        )
+        long_ago = timezone.now() - timedelta(days=400)
+        for model in (IndividualLoan, GroupLoan):
+            model.objects.using(self.db).update(status='completed', updated_at=long_ago)
+        self.moved = archive_completed(months=12)
+        self.client = APIClient()
+
+    def get(self, user, path):
+        self.client.force_authenticate(user)
+        return self.client.get(API + path)
+
+    def test_archive_takes_every_row_of_the_loan(self):
+        self.assertEqual(self.moved, {'core.IndividualLoan': 1, 'core.GroupLoan': 1})
+        self.assertEqual(ArchivedLoan.objects.count(), 2)
+        self.assertEqual(ArchivedPayment.objects.count(), 3)
+        self.assertEqual(ArchivedMembership.objects.count(), 2)
+        self.assertEqual(ArchivedCollateral.objects.count(), 1)
+        for model in (IndividualLoan, IndividualLoanPayment, GroupLoan, GroupLoanPayment, GroupMemberStatus, Collateral):
+            self.assertFalse(model.objects.using(self.db).exists(), model)
+
+        # Not due yet: a loan completed within the months kept hot stays
+        recent = make_individual_loan(self.officer, status='completed')
+        self.assertEqual(archive_completed(months=12)['core.IndividualLoan'], 0)
+        self.assertTrue(IndividualLoan.objects.using(self.db).filter(pk=recent.pk).exists())
+
+    def test_archived_loans_read_through_the_api(self):
+        loan = self.get(self.officer, f'individual/{self.loan.pk}/')
+        self.assertEqual(loan.status_code, 200)
+        self.assertEqual((loan.json()['id'], loan.json()['status']), (self.loan.pk, 'completed'))
+        payments = self.get(self.officer, f'individual/payments/{self.loan.pk}/').json()
+        self.assertEqual([payment['id'] for payment in payments], [self.payment.pk])
+        payment = self.get(self.officer, f'individual/{self.loan.pk}/payments/{self.payment.pk}/')
+        self.assertEqual((payment.status_code, payment.json()['amount']), (200, '100.00'))
+
+        group = self.get(self.members[1], f'group/{self.group.pk}/')
+        self.assertEqual(group.status_code, 200)
+        self.assertEqual(
+            sorted(member['id'] for member in group.json()['members']), sorted(member.pk for member in self.members)
+        )
+        payments = self.get(self.officer, f'group/{self.group.pk}/payments/').json()
+        self.assertEqual({payment['id'] for payment in payments}, {payment.pk for payment in self.group_payments})
+
+        # The archive keeps the loan views' rules on who may read a loan
+        stranger = make_user()
+        self.assertEqual(self.get(stranger, f'individual/{self.loan.pk}/').status_code, 404)
+        self.assertEqual(self.get(stranger, f'group/{self.group.pk}/').status_code, 404)
+        self.assertEqual(self.get(make_user('loan_officer'), f'individual/{self.loan.pk}/').status_code, 404)
+
+    def test_dashboard_counts_archived_loans_as_completed(self):
+        make_individual_loan(self.officer)
+        loans = self.get(self.officer, 'dashboard/').json()['loans']
+        self.assertEqual((loans['individual']['completed'], loans['individual']['active']), (1, 1))
+        self.assertEqual(loans['group']['completed'], 1)
+
+    def test_restore_puts_the_rows_back_under_their_ids(self):
+        self.assertEqual(restore_loans(GroupLoan, [self.group.pk]), 1)
+        self.assertEqual(restore_loans(IndividualLoan, [self.loan.pk]), 1)
+        self.assertFalse(ArchivedLoan.objects.exists())
+        self.assertFalse(ArchivedPayment.objects.exists())
+
+        loan = IndividualLoan.objects.using(self.db).get(pk=self.loan.pk)
+        self.assertEqual((loan.status, loan.total_paid, loan.recipient_id), ('completed', Decimal('100.00'), self.members[0].pk))
+        self.assertEqual(list(loan.payments.values_list('pk', flat=True)), [self.payment.pk])
+        group = GroupLoan.objects.using(self.db).get(pk=self.group.pk)
+        self.assertEqual(
+            set(group.payments.values_list('pk', 'member_id')),
+            {(payment.pk, payment.member_id) for payment in self.group_payments}
+        )
+        self.assertEqual(
+            set(GroupMemberStatus.objects.using(self.db).filter(group_loan=group).values_list('member_id', flat=True)),
+            {member.pk for member in self.members}
+        )
+        self.assertEqual(
+            list(Collateral.objects.using(self.db).values_list('pk', 'object_id')), [(self.collateral.pk, self.group.pk)]
+        )
+        self.assertEqual(self.get(self.officer, 'dashboard/').json()['loans']['individual']['completed'], 1)
@@ -1,26 +1,77 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.db.models import F
+from django.utils import timezone
+
+from live import feed
+from outbox import events
+from mifi import sharding
+from mifi.large_admin import THIS_MODEL, LargeTableAdmin, PaginatedInlineFormSet
+from users.models import User
 from .models import (
     IndividualLoan,
     GroupLoan,
     GroupMemberStatus,
     IndividualLoanPayment,
-    GroupLoanPayment
+    GroupLoanPayment,
+    bump_counters,
 )
 
+class PaginatedTabularInline(admin.TabularInline):
+    formset = PaginatedInlineFormSet
+    template = 'admin/core/edit_inline/paginated_tabular.html'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_param = f'{self.opts.model_name}_page'
+        formset.page = request.GET.get(formset.page_param, 1)
+        formset.query = request.GET
+        return formset
+
+
+def set_loan_status(status):
+    def action(modeladmin, request, queryset):
+        loans = list(queryset.exclude(status=status).values_list('id', 'loan_officer_id'))
+        updated = queryset.update(status=status, updated_at=timezone.now(), version=F('version') + 1)
+        feed.statuses_changed(queryset.model, loans, status)
+        modeladmin.message_user(request, f"{updated} loans marked {status}.")
+    action.__name__ = f'mark_{status}'
+    return admin.action(description=f"Mark selected loans {status}")(action)
+
+
+LOAN_ACTIONS = [set_loan_status('active'), set_loan_status('overdue')]
+
+
+def count_blocked(memberships, sign):
+    """Move blocked_member_count for [(group_loan_id, member_id)] that were all just (un)blocked."""
+    for group_loan_id, blocked in Counter(group_loan_id for group_loan_id, _ in memberships).items():
+        bump_counters(GroupLoan, group_loan_id, blocked_member_count=sign * blocked)
+
+
 # Define the inline class first
-class GroupMemberStatusInline(admin.TabularInline):
+class GroupMemberStatusInline(PaginatedTabularInline):
     model = GroupMemberStatus
     extra = 1
-    raw_id_fields = ('member', 'blocked_by')
+    autocomplete_fields = ('member', 'blocked_by')
     readonly_fields = ('blocked_at',)
 
+    def get_queryset(self, request):
+        # Each existing row is labelled with its member
+        if sharding.crosses(GroupMemberStatus, User):
+            return super().get_queryset(request).prefetch_related('member')
+        return super().get_queryset(request).select_related('member')
+
 @admin.register(IndividualLoan)
-class IndividualLoanAdmin(admin.ModelAdmin):
+class IndividualLoanAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'recipient', 'amount', 'loan_type', 
                     'start_date', 'end_date', 'total_due', 'total_paid', 'loan_officer')
     list_filter = ('loan_type', 'start_date', 'end_date')
-    search_fields = ('first_name', 'last_name', 'recipient__email')
-    raw_id_fields = ('recipient', 'loan_officer')
+    list_select_related = ('recipient', 'loan_officer')
+    search_fields = ('^first_name', '^last_name', '^recipient__email')
+    search_index = (THIS_MODEL, 'recipient')
+    autocomplete_fields = ('recipient', 'loan_officer')
+    actions = LOAN_ACTIONS
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at', 'updated_at', 'total_due', 'total_paid')
     
@@ -41,12 +92,15 @@ class IndividualLoanAdmin(admin.ModelAdmin):
     )
 
 @admin.register(GroupLoan)
-class GroupLoanAdmin(admin.ModelAdmin):
+class GroupLoanAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('group_name', 'frequency_letter', 'amount', 'loan_type', 
-                    'start_date', 'end_date', 'total_due', 'total_paid', 'loan_officer')
+                    'start_date', 'end_date', 'total_due', 'total_paid', 'member_count', 'loan_officer')
     list_filter = ('frequency_letter', 'start_date', 'end_date', 'loan_given')
-    search_fields = ('group_name', 'loan_officer__email')
-    raw_id_fields = ('loan_officer',)
+    list_select_related = ('loan_officer',)
+    search_fields = ('^group_name', '^loan_officer__email')
+    search_index = (THIS_MODEL, 'loan_officer')
+    autocomplete_fields = ('loan_officer',)
+    actions = LOAN_ACTIONS
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at', 'updated_at', 'total_due', 'total_paid')
     inlines = [GroupMemberStatusInline]  # Now properly defined
@@ -72,11 +126,14 @@ class GroupLoanAdmin(admin.ModelAdmin):
     )
 
 @admin.register(GroupMemberStatus)
-class GroupMemberStatusAdmin(admin.ModelAdmin):
+class GroupMemberStatusAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('member', 'group_loan', 'frequency_letter', 'is_blocked', 'blocked_at')
     list_filter = ('frequency_letter', 'is_blocked')
-    search_fields = ('member__email', 'group_loan__group_name')
-    raw_id_fields = ('member', 'group_loan', 'blocked_by')
+    list_select_related = ('member', 'group_loan')
+    search_fields = ('^member__email', '^group_loan__group_name')
+    search_index = ('member', 'group_loan')
+    autocomplete_fields = ('member', 'group_loan', 'blocked_by')
+    actions = ['block_members', 'unblock_members']
     
     fieldsets = (
         (None, {
@@ -88,12 +145,46 @@ class GroupMemberStatusAdmin(admin.ModelAdmin):
         }),
     )
 
+    @admin.action(description="Block selected members")
+    def block_members(self, request, queryset):
+        with sharding.atomic():
+            memberships = list(queryset.filter(is_blocked=False).values_list('group_loan_id', 'member_id'))
+            updated = queryset.update(
+                is_blocked=True, blocked_at=timezone.now(), blocked_by=request.user, version=F('version') + 1
+            )
+            count_blocked(memberships, 1)
+            events.members_blocked(memberships, True, request.user)
+        self.message_user(request, f"{updated} members blocked.")
+
+    @admin.action(description="Unblock selected members")
+    def unblock_members(self, request, queryset):
+        with sharding.atomic():
+            memberships = list(queryset.filter(is_blocked=True).values_list('group_loan_id', 'member_id'))
+            updated = queryset.update(is_blocked=False, blocked_at=None, blocked_by=None, version=F('version') + 1)
+            count_blocked(memberships, -1)
+            events.members_blocked(memberships, False, request.user)
+        self.message_user(request, f"{updated} members unblocked.")
+
+class PaymentAdmin(LargeTableAdmin, admin.ModelAdmin):
+    """Deletes go through Payment.delete(), which reverses the payment's journal entry."""
+
+    def delete_model(self, request, obj):
+        obj.delete(deleted_by=request.user)
+
+    def delete_queryset(self, request, queryset):
+        with sharding.atomic():
+            for payment in queryset.select_related('loan'):
+                payment.delete(deleted_by=request.user)
+
+
 @admin.register(IndividualLoanPayment)
-class IndividualLoanPaymentAdmin(admin.ModelAdmin):
+class IndividualLoanPaymentAdmin(PaymentAdmin):
     list_display = ('loan', 'amount', 'payment_date', 'recorded_by')
     list_filter = ('payment_date',)
-    search_fields = ('loan__first_name', 'loan__last_name', 'recorded_by__email')
-    raw_id_fields = ('loan', 'recorded_by')
+    list_select_related = ('loan', 'recorded_by')
+    search_fields = ('^loan__first_name', '^loan__last_name', '^recorded_by__email')
+    search_index = ('loan', 'recorded_by')
+    autocomplete_fields = ('loan', 'recorded_by')
     date_hierarchy = 'payment_date'
     
     fieldsets = (
@@ -107,11 +198,13 @@ class IndividualLoanPaymentAdmin(admin.ModelAdmin):
     )
 
 @admin.register(GroupLoanPayment)
-class GroupLoanPaymentAdmin(admin.ModelAdmin):
+class GroupLoanPaymentAdmin(PaymentAdmin):
     list_display = ('loan', 'member', 'amount', 'payment_date', 'recorded_by')
     list_filter = ('payment_date', 'loan__frequency_letter')
-    search_fields = ('loan__group_name', 'member__email', 'recorded_by__email')
-    raw_id_fields = ('loan', 'member', 'recorded_by')
+    list_select_related = ('loan', 'member', 'recorded_by')
+    search_fields = ('^loan__group_name', '^member__email', '^recorded_by__email')
+    search_index = ('loan', 'member', 'recorded_by')
+    autocomplete_fields = ('loan', 'member', 'recorded_by')
     date_hierarchy = 'payment_date'
     
     fieldsets = (
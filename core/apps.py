@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from mifi.sharding import start_ids
+
+        # Migrating a shard (re)starts its loan tables' ids at its FIRST_ID
+        post_migrate.connect(start_ids, sender=self, dispatch_uid='core_shard_ids')
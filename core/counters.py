@@ -0,0 +1,64 @@
+"""
+Recounting the loan counter columns from the rows they count. The write
+paths keep them current as they go; this is for rows written outside the
+ORM (generate_portfolio, manual SQL) and for repairing drift. Each chunk
+of loans is recounted by one UPDATE with correlated subqueries.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from mifi import sharding
+
+from .models import COLLATERAL_COUNTERS, Collateral, GroupLoan, GroupLoanPayment, GroupMemberStatus, IndividualLoan, IndividualLoanPayment
+
+LOAN_TABLES = ((IndividualLoan, IndividualLoanPayment), (GroupLoan, GroupLoanPayment))
+
+
+def _count(queryset, field):
+    counted = queryset.order_by().values(field).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def recounted(model, payment_model):
+    """Counter column -> expression recounting it for the row being updated."""
+    content_type = ContentType.objects.get_for_model(model)
+    payments = payment_model.objects.filter(loan=OuterRef('pk'))
+    collaterals = Collateral.objects.filter(content_type=content_type, object_id=OuterRef('pk'))
+    counters = {
+        'payment_count': _count(payments, 'loan'),
+        'last_payment_at': Subquery(
+            payments.order_by().values('loan').annotate(last=Max('payment_date')).values('last')
+        ),
+        **{
+            field: _count(collaterals.filter(collateral_type=collateral_type), 'object_id')
+            for collateral_type, field in COLLATERAL_COUNTERS.items()
+        },
+    }
+    if model is GroupLoan:
+        memberships = GroupMemberStatus.objects.filter(group_loan=OuterRef('pk'))
+        counters['member_count'] = _count(memberships, 'group_loan')
+        counters['blocked_member_count'] = _count(memberships.filter(is_blocked=True), 'group_loan')
+    return counters
+
+
+def rebuild(chunk_size=5000, progress=None):
+    """Recount every loan's counters, `chunk_size` loans per transaction. Returns {model label: loans}."""
+    done = {}
+    for model, payment_model in LOAN_TABLES:
+        counters = recounted(model, payment_model)
+        label = model._meta.label
+        done[label] = 0
+        # A loan's payments, memberships and collateral are on its own shard
+        for alias in sharding.each_shard():
+            last_id = 0
+            while True:
+                ids = list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+                if not ids:
+                    break
+                with transaction.atomic(using=alias):
+                    done[label] += model.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(**counters)
+                last_id = ids[-1]
+                if progress:
+                    progress(label, done[label])
+    return done
@@ -0,0 +1,99 @@
+"""
+The loan officer's home screen in one response.
+
+Counts and exposure come from a GROUP BY status over each loan table (and
+one over the archive for completed loans moved out of them), the day's
+collections from one aggregate over each payment table and blocked
+members from the groups' counter columns, so the cost follows the number of tables rather
+than the number of loans. What falls due today and this week needs each
+open loan's schedule, which is worked out in Python from one narrow query
+per loan table.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from archive.models import ArchivedLoan
+from ledger.journal import ZERO, money
+from .models import GroupLoan, GroupLoanPayment, IndividualLoan, IndividualLoanPayment
+
+OPEN_STATUSES = ('active', 'overdue')
+SCHEDULE_FIELDS = ('total_due', 'total_paid', 'start_date', 'end_date', 'repayment_frequency')
+LOAN_TABLES = (
+    ('individual', IndividualLoan, IndividualLoanPayment),
+    ('group', GroupLoan, GroupLoanPayment),
+)
+
+
+def _setting(name, default):
+    return getattr(settings, 'DASHBOARD', {}).get(name, default)
+
+
+def due_by(loan, day):
+    """What the loan's schedule asks for up to `day` that has not been paid yet."""
+    scheduled = sum((amount for due_date, amount in loan.get_payment_schedule() if due_date <= day), ZERO)
+    return min(max(scheduled - loan.total_paid, ZERO), loan.total_due)
+
+
+def officer_summary(officer, today=None):
+    today = today or timezone.localdate()
+    week_end = today + timedelta(days=6 - today.weekday())
+    day_start = timezone.make_aware(datetime.combine(today, time.min))
+
+    summary = {
+        'officer_id': officer.pk,
+        'date': today.isoformat(),
+        'loans': {},
+        'due_today': ZERO,
+        'due_this_week': ZERO,
+        'collected_today': ZERO,
+        'payments_today': 0,
+        'overdue_exposure': ZERO,
+    }
+    archived = dict(
+        ArchivedLoan.objects.filter(loan_officer=officer).values_list('content_type').annotate(Count('id')).order_by()
+    )
+    for kind, model, payment_model in LOAN_TABLES:
+        loans = model.objects.filter(loan_officer=officer)
+        by_status = dict.fromkeys((status for status, _ in model.LOAN_STATUSES), 0)
+        by_status['completed'] = archived.get(ContentType.objects.get_for_model(model).pk, 0)
+        for row in loans.values('status').annotate(loans=Count('id'), due=Sum('total_due')).order_by():
+            by_status[row['status']] += row['loans']
+            if row['status'] == 'overdue':
+                summary['overdue_exposure'] += money(row['due'])
+        summary['loans'][kind] = by_status
+
+        for fields in loans.filter(status__in=OPEN_STATUSES).values_list(*SCHEDULE_FIELDS):
+            loan = model(**dict(zip(SCHEDULE_FIELDS, fields)))
+            summary['due_today'] += due_by(loan, today)
+            summary['due_this_week'] += due_by(loan, week_end)
+
+        collected = payment_model.objects.filter(
+            loan__loan_officer=officer,
+            payment_date__gte=day_start,
+            payment_date__lt=day_start + timedelta(days=1),
+        ).aggregate(total=Sum('amount'), payments=Count('id'))
+        summary['collected_today'] += money(collected['total'] or ZERO)
+        summary['payments_today'] += collected['payments']
+
+    summary['blocked_members'] = GroupLoan.objects.filter(
+        loan_officer=officer,
+        status__in=OPEN_STATUSES,
+    ).aggregate(blocked=Sum('blocked_member_count'))['blocked'] or 0
+    for key in ('due_today', 'due_this_week', 'collected_today', 'overdue_exposure'):
+        summary[key] = str(summary[key])
+    return summary
+
+
+def cached_summary(officer):
+    """officer_summary, kept for DASHBOARD['CACHE_SECONDS'] so app refreshes don't recompute it."""
+    today = timezone.localdate()
+    return caches[_setting('CACHE', 'default')].get_or_set(
+        f'officer_dashboard:{officer.pk}:{today.isoformat()}',
+        lambda: officer_summary(officer, today),
+        _setting('CACHE_SECONDS', 60),
+    )
@@ -0,0 +1,272 @@
+"""
+Onboarding import: clients, individual loans and group loans from a branch
+spreadsheet exported as CSV.
+
+The file is read as a stream in batches. Each batch is validated row by row
+with OnboardingRowSerializer, then checked against the database with a few
+set-based queries: existing clients, loan officers. Its clients and
+individual loans are inserted with bulk_create. Group rows only record
+(member, share) until the end of the file, since a group's members may be
+spread over many batches. The groups, their memberships and every
+disbursement are then written in bulk too. Loans go to the shard of their
+loan officer's region, with a transaction open on every shard.
+
+The import is all or nothing. Every row is validated and every error is
+reported, but if any row fails, or on a dry run, the transaction is rolled
+back.
+"""
+import csv
+import secrets
+from collections import defaultdict
+from itertools import islice
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, UNUSABLE_PASSWORD_SUFFIX_LENGTH
+from django.db import transaction
+from rest_framework import serializers
+
+from ledger import journal
+from mifi import sharding
+from outbox import events
+from users.models import User
+from .models import GroupLoan, GroupMemberStatus, IndividualLoan
+from .serializers import OnboardingRowSerializer
+
+REQUIRED_COLUMNS = {'email', 'first_name', 'last_name', 'nrc_number', 'date_of_birth'}
+USER_FIELDS = ('email', 'first_name', 'last_name', 'nrc_number', 'date_of_birth', 'phone_number', 'address', 'region')
+GROUP_TERMS = ('end_date', 'repayment_frequency', 'interest_rate', 'penalty', 'frequency_letter')
+
+
+class OnboardingImport:
+    def __init__(self, passwords='unusable', batch_size=1000, progress=None):
+        self.passwords = passwords
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rows = 0
+        self.errors = []
+        self.created = {'clients': 0, 'individual_loans': 0, 'group_loans': 0, 'memberships': 0}
+        self.existing_clients = set()
+        self.officers = {}
+        self.officer_shards = {}
+        self.groups = {}
+        # One instance validates every row, as ListSerializer does; building
+        # the fields per row costs more than the validation itself
+        self.serializer = OnboardingRowSerializer()
+
+    def run(self, lines, dry_run=False):
+        """Import CSV text lines (a file opened with newline='') and return a summary."""
+        reader = csv.DictReader(lines)
+        missing = REQUIRED_COLUMNS - {name.strip() for name in reader.fieldnames or []}
+        if missing:
+            self.errors.append({'row': 1, 'errors': {'columns': [f"Missing columns: {', '.join(sorted(missing))}"]}})
+            return self.summary(dry_run)
+
+        rows = enumerate(reader, start=2)  # row 1 is the header
+        with sharding.atomic(sharding.shards()):
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch)
+                if self.progress:
+                    self.progress(self)
+            self.create_groups()
+            if dry_run or self.errors:
+                for alias in sharding.shards():
+                    transaction.set_rollback(True, using=alias)
+        return self.summary(dry_run)
+
+    def summary(self, dry_run):
+        return {
+            'dry_run': dry_run,
+            'imported': not dry_run and not self.errors,
+            'rows': self.rows,
+            'created': self.created,
+            'existing_clients': len(self.existing_clients),
+            'errors': self.errors,
+        }
+
+    def error(self, row_number, errors):
+        self.errors.append({'row': row_number, 'errors': errors})
+
+    def validate(self, batch):
+        valid = []
+        for row_number, row in batch:
+            self.rows += 1
+            data = {
+                name.strip(): value.strip()
+                for name, value in row.items()
+                if name and isinstance(value, str) and value.strip()
+            }
+            try:
+                valid.append((row_number, self.serializer.run_validation(data)))
+            except serializers.ValidationError as e:
+                self.error(row_number, e.detail)
+        return valid
+
+    def resolve_officers(self, rows):
+        emails = {data['loan_officer'] for _, data in rows if data.get('loan_type')} - set(self.officers)
+        if emails:
+            found = {
+                email: (officer_id, region)
+                for email, officer_id, region in User.objects.filter(
+                    email__in=emails, role='loan_officer'
+                ).values_list('email', 'id', 'region')
+            }
+            for email in emails:
+                officer_id, region = found.get(email, (None, None))
+                self.officers[email] = officer_id
+                self.officer_shards[officer_id] = sharding.shard_for_region(region)
+
+    def bulk_create(self, model, loans):
+        """Insert `loans` on their loan officers' shards."""
+        by_shard = defaultdict(list)
+        for loan in loans:
+            by_shard[self.officer_shards[loan.loan_officer_id]].append(loan)
+        for alias, shard_loans in by_shard.items():
+            model.objects.using(alias).bulk_create(shard_loans)
+
+    def import_batch(self, batch):
+        rows = self.validate(batch)
+        self.resolve_officers(rows)
+
+        nrcs = {data['nrc_number'] for _, data in rows}
+        emails = {User.objects.normalize_email(data['email']) for _, data in rows}
+        by_nrc, by_email = {}, {}
+        for user_id, email, nrc_number in User.objects.filter(
+            nrc_number__in=nrcs
+        ).values_list('id', 'email', 'nrc_number').union(
+            User.objects.filter(email__in=emails).values_list('id', 'email', 'nrc_number')
+        ):
+            by_nrc[nrc_number] = (user_id, email)
+            by_email[email] = nrc_number
+
+        new_users, new_emails = {}, set()
+        accepted = []
+        for row_number, data in rows:
+            email = User.objects.normalize_email(data['email'])
+            nrc_number = data['nrc_number']
+            if data.get('loan_type') and self.officers.get(data['loan_officer']) is None:
+                self.error(row_number, {'loan_officer': ["No loan officer with this email."]})
+                continue
+
+            if nrc_number in by_nrc:
+                user_id, known_email = by_nrc[nrc_number]
+                if known_email != email:
+                    self.error(row_number, {'nrc_number': ["Already registered to a different email."]})
+                    continue
+                self.existing_clients.add(user_id)
+            elif email in by_email:
+                self.error(row_number, {'email': ["Already registered to a different NRC number."]})
+                continue
+            elif nrc_number in new_users:
+                if new_users[nrc_number].email != email:
+                    self.error(row_number, {'nrc_number': ["Appears earlier in the file with a different email."]})
+                    continue
+            elif email in new_emails:
+                self.error(row_number, {'email': ["Appears earlier in the file with a different NRC number."]})
+                continue
+            else:
+                new_users[nrc_number] = self.build_user(email, data)
+                new_emails.add(email)
+            accepted.append((row_number, data))
+
+        User.objects.bulk_create(new_users.values())
+        events.users_created(new_users.values())
+        self.created['clients'] += len(new_users)
+        user_ids = {nrc_number: user_id for nrc_number, (user_id, _) in by_nrc.items()}
+        user_ids.update({nrc_number: user.pk for nrc_number, user in new_users.items()})
+
+        loans = []
+        for row_number, data in accepted:
+            if data.get('loan_type') == 'individual':
+                loans.append(self.build_individual_loan(data, user_ids[data['nrc_number']]))
+            elif data.get('loan_type') == 'group':
+                self.add_to_group(row_number, data, user_ids[data['nrc_number']])
+        self.bulk_create(IndividualLoan, loans)
+        events.loans_created(loans)
+        journal.post_disbursements(IndividualLoan, [
+            (loan.pk, loan.amount, loan.start_date, loan.loan_officer_id) for loan in loans
+        ], memo="Imported")
+        self.created['individual_loans'] += len(loans)
+
+    def build_user(self, email, data):
+        user = User(role='clients', **{field: data.get(field) for field in USER_FIELDS})
+        user.email = email
+        if self.passwords == 'hash' and data.get('password'):
+            user.set_password(data['password'])
+        else:
+            # What set_unusable_password() stores, minus get_random_string's
+            # per-character secrets.choice calls, which add up over a branch
+            user.password = UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(UNUSABLE_PASSWORD_SUFFIX_LENGTH // 2)
+        return user
+
+    def build_individual_loan(self, data, user_id):
+        return IndividualLoan(
+            loan_type='individual',
+            amount=data['amount'],
+            total_due=data['amount'],
+            interest_rate=data['interest_rate'],
+            penalty=data['penalty'],
+            repayment_frequency=data['repayment_frequency'],
+            start_date=data['start_date'],
+            end_date=data['end_date'],
+            loan_officer_id=self.officers[data['loan_officer']],
+            status='active',
+            first_name=data['first_name'],
+            last_name=data['last_name'],
+            recipient_id=user_id,
+        )
+
+    def add_to_group(self, row_number, data, user_id):
+        key = (data['group_name'], data['start_date'], self.officers[data['loan_officer']])
+        group = self.groups.setdefault(key, {
+            'terms': {field: data[field] for field in GROUP_TERMS},
+            'due_date': data.get('due_date') or data['end_date'],
+            'members': {},
+        })
+        conflicts = [field for field in GROUP_TERMS if data[field] != group['terms'][field]]
+        if conflicts:
+            self.error(row_number, {
+                field: ["Differs from the group's earlier rows."] for field in conflicts
+            })
+        elif user_id in group['members']:
+            self.error(row_number, {'nrc_number': ["Already a member of this group."]})
+        else:
+            group['members'][user_id] = data['amount']
+
+    def create_groups(self):
+        keys = list(self.groups)
+        for start in range(0, len(keys), self.batch_size):
+            batch = [(key, self.groups[key]) for key in keys[start:start + self.batch_size]]
+            loans = []
+            for (group_name, start_date, officer_id), group in batch:
+                total = sum(group['members'].values())
+                loans.append(GroupLoan(
+                    loan_type='group',
+                    group_name=group_name,
+                    amount=total,
+                    total_group_loan=total,
+                    total_due=total,
+                    start_date=start_date,
+                    due_date=group['due_date'],
+                    loan_officer_id=officer_id,
+                    status='active',
+                    loan_given=True,
+                    member_count=len(group['members']),
+                    **group['terms'],
+                ))
+            self.bulk_create(GroupLoan, loans)
+            events.loans_created(loans)
+            memberships = defaultdict(list)
+            for loan, (_, group) in zip(loans, batch):
+                memberships[loan._state.db] += [
+                    GroupMemberStatus(group_loan=loan, member_id=member_id, frequency_letter=loan.frequency_letter)
+                    for member_id in group['members']
+                ]
+            for alias, shard_memberships in memberships.items():
+                GroupMemberStatus.objects.using(alias).bulk_create(shard_memberships)
+            journal.post_disbursements(GroupLoan, [
+                (loan.pk, loan.amount, loan.start_date, loan.loan_officer_id) for loan in loans
+            ], memo="Imported")
+            self.created['group_loans'] += len(loans)
+            self.created['memberships'] += sum(len(shard_memberships) for shard_memberships in memberships.values())
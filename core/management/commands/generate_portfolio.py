@@ -0,0 +1,414 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from core import counters
+from core.models import (
+    Collateral,
+    GroupLoan,
+    GroupLoanPayment,
+    GroupMemberStatus,
+    IndividualLoan,
+    IndividualLoanPayment,
+)
+from mifi import sharding
+from users.models import User
+
+FIRST_NAMES = [
+    'Mwila', 'Chanda', 'Bwalya', 'Mulenga', 'Musonda', 'Natasha', 'Mutale', 'Kabwe', 'Chilufya', 'Lombe',
+    'Joseph', 'Grace', 'Esther', 'Peter', 'Mary', 'Daniel', 'Ruth', 'John', 'Agnes', 'Moses',
+    'Thandiwe', 'Chipo', 'Mapalo', 'Luyando', 'Mwansa', 'Kondwani', 'Temwani', 'Nkandu', 'Chisomo', 'Bupe',
+]
+LAST_NAMES = [
+    'Banda', 'Phiri', 'Mwale', 'Tembo', 'Zulu', 'Mumba', 'Lungu', 'Daka', 'Ngoma', 'Sakala',
+    'Mwanza', 'Chileshe', 'Kunda', 'Bwalya', 'Kasonde', 'Mulenga', 'Nkonde', 'Chirwa', 'Mbewe', 'Sichone',
+]
+GROUP_KINDS = ['Women', 'Farmers', 'Traders', 'Youth', 'Savings']
+REGIONS = [
+    'Lusaka', 'Copperbelt', 'Southern', 'Eastern', 'Central', 'Northern', 'Luapula', 'North-Western',
+    'Western', 'Muchinga',
+]
+FREQUENCIES = ['weekly', 'daily', 'monthly']
+FREQUENCY_WEIGHTS = [0.7, 0.15, 0.15]
+PERIODS = {'daily': 1, 'weekly': 7, 'monthly': 28}
+AMOUNTS = [Decimal(a) for a in (500, 750, 1000, 1500, 2000, 3000, 5000, 10000)]
+INTEREST_RATE = Decimal('40.00')
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+USER_FIELDS = [
+    'email', 'nrc_number', 'first_name', 'last_name', 'phone_number', 'region', 'role', 'date_of_birth',
+    'password', 'date_joined', 'is_staff', 'is_superuser', 'is_active',
+]
+LOAN_FIELDS = [
+    'loan_type', 'amount', 'penalty', 'interest_rate', 'repayment_frequency', 'loan_officer',
+    'total_due', 'total_paid', 'start_date', 'end_date', 'status', 'created_at', 'updated_at',
+]
+INDIVIDUAL_LOAN_FIELDS = LOAN_FIELDS + ['first_name', 'last_name', 'recipient']
+GROUP_LOAN_FIELDS = LOAN_FIELDS + [
+    'group_name', 'frequency_letter', 'total_group_loan', 'loan_given', 'due_date', 'transferred', 'blocked', 'new',
+]
+MEMBER_FIELDS = ['group_loan', 'member', 'frequency_letter', 'is_blocked']
+PAYMENT_FIELDS = ['loan', 'amount', 'payment_type', 'recorded_by', 'payment_date']
+COLLATERAL_FIELDS = [
+    'content_type', 'object_id', 'collateral_type', 'file', 'uploaded_by', 'uploaded_at',
+    'verified', 'rejected', 'verified_by', 'verified_at',
+]
+
+
+def zipf_weights(n, skew):
+    return [1 / (rank ** skew) for rank in range(1, n + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic, reproducible loan portfolio for capacity testing: regions, officers, "
+        "clients, individual and group loans with memberships, payment history and collateral rows. "
+        "Each loan is written with its payments, memberships and collateral to its loan officer's shard. "
+        "Run it against empty databases; the same --seed always produces the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--regions', type=int, default=5, help=f"Number of regions (max {len(REGIONS)})")
+        parser.add_argument('--officers', type=int, default=20, help="Loan officers across all regions")
+        parser.add_argument('--clients', type=int, default=10000)
+        parser.add_argument('--years', type=float, default=2, help="Length of payment history")
+        parser.add_argument('--loans-per-client', type=float, default=6, help="Average individual loan cycles per client")
+        parser.add_argument('--group-share', type=float, default=0.4, help="Fraction of clients who also borrow in a group")
+        parser.add_argument('--group-size', type=int, nargs=2, default=[5, 30], metavar=('MIN', 'MAX'))
+        parser.add_argument('--loans-per-group', type=float, default=4, help="Average loan cycles per group")
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help="Zipf exponent for how unevenly clients spread over regions and officers (0 = uniform)")
+        parser.add_argument('--overdue-rate', type=float, default=0.08)
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Clients generated per transaction")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows per INSERT")
+
+    def handle(self, *args, **options):
+        if not 1 <= options['regions'] <= len(REGIONS):
+            raise CommandError(f"--regions must be between 1 and {len(REGIONS)}")
+
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.sqlite = connections[DEFAULT_DB_ALIAS].vendor == 'sqlite'
+        self.today = timezone.localdate()
+        self.history_start = self.today - timedelta(days=int(options['years'] * 365))
+        self.tag = f"s{options['seed']}"
+        self.group_seq = 0
+        self.counts = {}
+        self.started = time.monotonic()
+
+        if self.sqlite:
+            for alias in sharding.shards():
+                # SQLite refuses it inside a transaction, as when called from one
+                if not connections[alias].in_atomic_block:
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute('PRAGMA synchronous = OFF')
+
+        self.individual_ct = ContentType.objects.get_for_model(IndividualLoan).id
+        self.group_ct = ContentType.objects.get_for_model(GroupLoan).id
+
+        with sharding.atomic():
+            self.create_staff()
+
+        chunk_size = options['chunk_size']
+        for offset in range(0, options['clients'], chunk_size):
+            with sharding.atomic(sharding.shards()):
+                clients = self.create_clients(offset, min(chunk_size, options['clients'] - offset))
+                self.create_individual_loans(clients)
+                self.create_groups(clients)
+            self.report(f"{offset + len(clients)}/{options['clients']} clients")
+
+        # The raw INSERTs leave the loan counter columns at zero
+        counters.rebuild()
+        # Fresh statistics for the planner and the admin's row count estimates
+        for alias in sharding.shards():
+            with connections[alias].cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.monotonic() - self.started:.1f}s: "
+            + ', '.join(f"{count} {name}" for name, count in self.counts.items())
+        ))
+
+    def report(self, progress):
+        total = sum(self.counts.values())
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f"{progress}: {total} rows in {elapsed:.1f}s ({total / max(elapsed, 0.001):.0f} rows/s)")
+
+    # Rows are written as plain tuples. Model instances and the ORM's per-value
+    # preparation cost more than the database itself at tens of millions of rows.
+
+    def _insert_sql(self, model, fields, rows=1, using=DEFAULT_DB_ALIAS):
+        qn = connections[using].ops.quote_name
+        columns = ', '.join(qn(model._meta.get_field(name).column) for name in fields)
+        values = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * rows)
+        return f"INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES {values}"
+
+    def _count(self, model, n):
+        label = str(model._meta.verbose_name_plural)
+        self.counts[label] = self.counts.get(label, 0) + n
+
+    def insert_rows(self, model, fields, rows, using=DEFAULT_DB_ALIAS):
+        sql = self._insert_sql(model, fields, using=using)
+        with connections[using].cursor() as cursor:
+            for start in range(0, len(rows), self.batch_size):
+                cursor.executemany(sql, rows[start:start + self.batch_size])
+        self._count(model, len(rows))
+
+    def insert_returning_ids(self, model, fields, rows, using=DEFAULT_DB_ALIAS):
+        """
+        Insert rows and return their new primary keys in row order. The IDs of
+        one INSERT are allocated in row order, so sorting them undoes any
+        reordering in what RETURNING hands back.
+        """
+        per_statement = max(1, min(self.batch_size, 30000 // len(fields)))  # SQLite caps bound parameters
+        returning = f" RETURNING {connections[using].ops.quote_name('id')}"
+        ids = []
+        with connections[using].cursor() as cursor:
+            for start in range(0, len(rows), per_statement):
+                batch = rows[start:start + per_statement]
+                cursor.execute(
+                    self._insert_sql(model, fields, len(batch), using) + returning,
+                    [value for row in batch for value in row]
+                )
+                ids.extend(sorted(row[0] for row in cursor.fetchall()))
+        self._count(model, len(rows))
+        return ids
+
+    def timestamp(self, day, hour=9):
+        minute = self.rng.randint(0, 59)
+        if self.sqlite:
+            # Django keeps aware datetimes on SQLite as naive UTC text
+            return f"{day.isoformat()} {hour:02d}:{minute:02d}:00"
+        return f"{day.isoformat()} {hour:02d}:{minute:02d}:00+00:00"
+
+    def unusable_password(self):
+        return UNUSABLE_PASSWORD_PREFIX + '%040x' % self.rng.getrandbits(160)
+
+    def create_staff(self):
+        regions = REGIONS[:self.options['regions']]
+        region_weights = zipf_weights(len(regions), self.options['skew'])
+        joined = self.timestamp(self.history_start)
+
+        def staff_row(prefix, i, role, region):
+            return (
+                f"{prefix}.{i}.{self.tag}@example.com", f"{prefix[:2].upper()}{self.tag}{i:06d}",
+                self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES), None, region, role, None,
+                self.unusable_password(), joined, True, False, True,
+            )
+
+        self.insert_rows(User, USER_FIELDS, [
+            staff_row('regionmanager', i, 'region_manager', region) for i, region in enumerate(regions)
+        ])
+
+        # Busy regions get more officers, and within a region a few officers carry most of the book
+        officer_regions = self.rng.choices(regions, weights=region_weights, k=max(self.options['officers'], 1))
+        officer_regions += [region for region in regions if region not in officer_regions]
+        officer_ids = self.insert_returning_ids(User, USER_FIELDS, [
+            staff_row('officer', i, 'loan_officer', region) for i, region in enumerate(officer_regions)
+        ])
+
+        self.officers_by_region = {}
+        self.officer_shards = {}
+        for officer_id, region in zip(officer_ids, officer_regions):
+            self.officers_by_region.setdefault(region, []).append(officer_id)
+            self.officer_shards[officer_id] = sharding.shard_for_region(region)
+        self.officer_weights = {
+            region: zipf_weights(len(officers), self.options['skew'])
+            for region, officers in self.officers_by_region.items()
+        }
+        self.regions = regions
+        self.region_weights = region_weights
+
+    def create_clients(self, offset, count):
+        regions = self.rng.choices(self.regions, weights=self.region_weights, k=count)
+        joined = self.timestamp(self.history_start)
+        seed_digit = self.options['seed'] % 10
+        clients, rows = [], []
+        for i, region in zip(range(offset, offset + count), regions):
+            first_name, last_name = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            clients.append((first_name, last_name, region))
+            rows.append((
+                f"client.{i}.{self.tag}@example.com",
+                f"{100000 + i % 900000:06d}/{i // 900000 + 10:02d}/{seed_digit}",
+                first_name,
+                last_name,
+                f"+26097{self.rng.randint(0, 9999999):07d}",
+                region,
+                'clients',
+                (date(1960, 1, 1) + timedelta(days=self.rng.randint(0, 40 * 365))).isoformat(),
+                self.unusable_password(),
+                joined,
+                False, False, True,
+            ))
+        ids = self.insert_returning_ids(User, USER_FIELDS, rows)
+        return [(client_id, *client) for client_id, client in zip(ids, clients)]
+
+    def pick_officer(self, region):
+        return self.rng.choices(self.officers_by_region[region], weights=self.officer_weights[region])[0]
+
+    def loan_cycles(self, average):
+        """Start dates of consecutive loan cycles spread over the history window."""
+        cycles = max(1, min(int(self.rng.expovariate(1 / average)) + 1, int(average * 4)))
+        window = (self.today - self.history_start).days
+        spacing = max(window // cycles, 29)
+        first = self.history_start + timedelta(days=self.rng.randint(0, max(spacing - 29, 0)))
+        starts = (first + timedelta(days=n * spacing) for n in range(cycles))
+        return [start for start in starts if start <= self.today]
+
+    def loan_terms(self, start_date):
+        frequency = self.rng.choices(FREQUENCIES, weights=FREQUENCY_WEIGHTS)[0]
+        days = 28 if frequency == 'monthly' else self.rng.choice([14, 21, 28])
+        return frequency, start_date + timedelta(days=days), self.rng.choice(AMOUNTS)
+
+    def repayment(self, amount, start_date, end_date, frequency):
+        """
+        Decide how one borrower repaid: returns (status, paid, [(date, amount, payment_type)]).
+        Most pay on schedule; some pay the rest off early, some go overdue and are recovered late.
+        """
+        period = PERIODS[frequency]
+        dues = [start_date + timedelta(days=d) for d in range(period, (end_date - start_date).days + 1, period)]
+        dues = dues or [end_date]
+        each = (amount / len(dues)).quantize(CENT)
+        last = amount - each * (len(dues) - 1)
+
+        overdue = self.rng.random() < self.options['overdue_rate']
+        advance = not overdue and len(dues) > 1 and self.rng.random() < 0.1
+        payments = []
+        for n, due in enumerate(dues):
+            installment = last if n == len(dues) - 1 else each
+            if advance and n == len(dues) // 2:
+                payments.append((due - timedelta(days=1), amount - each * n, 'ADVANCE'))
+                break
+            if overdue and n >= len(dues) - 2:
+                if self.rng.random() < 0.6:
+                    payments.append((end_date + timedelta(days=self.rng.randint(3, 45)), installment, 'RECOVERY'))
+                continue
+            payments.append((due, installment, 'NORMAL'))
+
+        payments = [payment for payment in payments if payment[0] <= self.today]
+        paid = sum((payment[1] for payment in payments), ZERO)
+        if paid >= amount:
+            status = 'completed'
+        elif end_date < self.today:
+            status = 'overdue'
+        else:
+            status = 'active'
+        return status, paid, payments
+
+    def create_individual_loans(self, clients):
+        rows, plans = [], []
+        for client_id, first_name, last_name, region in clients:
+            officer_id = self.pick_officer(region)
+            for start_date in self.loan_cycles(self.options['loans_per_client']):
+                frequency, end_date, amount = self.loan_terms(start_date)
+                status, paid, payments = self.repayment(amount, start_date, end_date, frequency)
+                created = self.timestamp(start_date, hour=8)
+                rows.append((
+                    'individual', amount, ZERO, INTEREST_RATE, frequency, officer_id,
+                    amount - paid, paid, start_date.isoformat(), end_date.isoformat(), status, created, created,
+                    first_name, last_name, client_id,
+                ))
+                plans.append((officer_id, status, created, payments))
+
+        for alias, rows, plans in self.by_shard(rows, plans):
+            loan_ids = self.insert_returning_ids(IndividualLoan, INDIVIDUAL_LOAN_FIELDS, rows, alias)
+            self.insert_rows(IndividualLoanPayment, PAYMENT_FIELDS, [
+                (loan_id, amount, payment_type, officer_id, self.timestamp(day, hour=self.rng.randint(8, 17)))
+                for loan_id, (officer_id, _, _, payments) in zip(loan_ids, plans)
+                for day, amount, payment_type in payments
+            ], alias)
+            self.create_collateral(self.individual_ct, 'individual_loans', loan_ids, plans, alias)
+
+    def create_groups(self, clients):
+        by_region = {}
+        for client_id, _, _, region in clients:
+            if self.rng.random() < self.options['group_share']:
+                by_region.setdefault(region, []).append(client_id)
+
+        min_size, max_size = self.options['group_size']
+        groups = []
+        for region, members in by_region.items():
+            self.rng.shuffle(members)
+            while len(members) >= min_size:
+                size = min(self.rng.randint(min_size, max_size), len(members))
+                groups.append((region, members[:size]))
+                members = members[size:]
+
+        rows, plans = [], []
+        for region, members in groups:
+            officer_id = self.pick_officer(region)
+            self.group_seq += 1
+            name = f"{self.rng.choice(LAST_NAMES)} {self.rng.choice(GROUP_KINDS)} Club {self.group_seq}"
+            letter = self.rng.choice('ABCDE')
+            for start_date in self.loan_cycles(self.options['loans_per_group']):
+                frequency, end_date, share = self.loan_terms(start_date)
+                member_plans = [
+                    (member_id, *self.repayment(share, start_date, end_date, frequency)) for member_id in members
+                ]
+                amount = share * len(members)
+                paid = sum((plan[2] for plan in member_plans), ZERO)
+                statuses = {plan[1] for plan in member_plans}
+                status = 'overdue' if 'overdue' in statuses else 'active' if 'active' in statuses else 'completed'
+                created = self.timestamp(start_date, hour=8)
+                rows.append((
+                    'group', amount, ZERO, INTEREST_RATE, frequency, officer_id,
+                    amount - paid, paid, start_date.isoformat(), end_date.isoformat(), status, created, created,
+                    name, letter, amount, True, end_date.isoformat(), False, False,
+                    (self.today - start_date).days < 28,
+                ))
+                plans.append((officer_id, status, created, letter, member_plans))
+
+        for alias, rows, plans in self.by_shard(rows, plans):
+            loan_ids = self.insert_returning_ids(GroupLoan, GROUP_LOAN_FIELDS, rows, alias)
+            self.insert_rows(GroupMemberStatus, MEMBER_FIELDS, [
+                (loan_id, member_id, letter, member_status == 'overdue' and self.rng.random() < 0.5)
+                for loan_id, (_, _, _, letter, member_plans) in zip(loan_ids, plans)
+                for member_id, member_status, _, _ in member_plans
+            ], alias)
+            self.insert_rows(GroupLoanPayment, PAYMENT_FIELDS + ['member'], [
+                (loan_id, amount, payment_type, officer_id, self.timestamp(day, hour=self.rng.randint(8, 17)), member_id)
+                for loan_id, (officer_id, _, _, _, member_plans) in zip(loan_ids, plans)
+                for member_id, _, _, payments in member_plans
+                for day, amount, payment_type in payments
+            ], alias)
+            self.create_collateral(self.group_ct, 'group_loans', loan_ids, plans, alias)
+
+    def by_shard(self, rows, plans):
+        """Split loan rows, with their plans (which start with the loan officer), by the officer's shard."""
+        split = defaultdict(lambda: ([], []))
+        for row, plan in zip(rows, plans):
+            shard_rows, shard_plans = split[self.officer_shards[plan[0]]]
+            shard_rows.append(row)
+            shard_plans.append(plan)
+        return [(alias, *split[alias]) for alias in sharding.shards() if alias in split]
+
+    def create_collateral(self, content_type_id, kind, loan_ids, plans, using=DEFAULT_DB_ALIAS):
+        """Placeholder collateral rows: the file paths are never read, only the metadata."""
+        rows = []
+        for loan_id, (officer_id, status, created, *_) in zip(loan_ids, plans):
+            reviewed = status != 'active'
+            types = ['PHOTO']
+            if self.rng.random() < 0.3:
+                types.append('DOCUMENT')
+            if self.rng.random() < 0.05:
+                types.append('VIDEO')
+            for collateral_type in types:
+                rows.append((
+                    content_type_id, loan_id, collateral_type,
+                    f"collaterals/{kind}/{loan_id}/{collateral_type.lower()}/synthetic.bin",
+                    officer_id, created,
+                    reviewed or self.rng.random() < 0.7, False,
+                    officer_id if reviewed else None, created if reviewed else None,
+                ))
+        self.insert_rows(Collateral, COLLATERAL_FIELDS, rows, using)
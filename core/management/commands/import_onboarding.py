@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imports import OnboardingImport
+
+
+class Command(BaseCommand):
+    help = (
+        "Import clients with their individual and group loans from a branch CSV. Rows are validated and "
+        "inserted in batches; if any row has errors nothing is imported and every error is listed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row")
+        parser.add_argument('--dry-run', action='store_true', help="Validate everything, then roll back")
+        parser.add_argument('--passwords', choices=['unusable', 'hash'], default='unusable',
+                            help="'hash' sets passwords from the password column, at one full hash per client")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help="Also write the row errors to this JSON file")
+
+    def handle(self, *args, **options):
+        importer = OnboardingImport(
+            passwords=options['passwords'],
+            batch_size=options['batch_size'],
+            progress=lambda importer: self.stdout.write(
+                f"{importer.rows} rows read, {len(importer.errors)} with errors"
+            ),
+        )
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as fh:
+                result = importer.run(fh, dry_run=options['dry_run'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in result['errors'][:50]:
+            self.stdout.write(self.style.ERROR(f"row {error['row']}: {json.dumps(error['errors'])}"))
+        if options['errors']:
+            with open(options['errors'], 'w') as fh:
+                json.dump(result['errors'], fh, indent=2)
+
+        created = ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in result['created'].items())
+        if result['errors']:
+            raise CommandError(f"{len(result['errors'])} rows have errors; nothing was imported")
+        verb = "Would create" if result['dry_run'] else "Created"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {created} from {result['rows']} rows ({result['existing_clients']} existing clients)"
+        ))
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.models import Collateral, GroupLoan, GroupLoanPayment, GroupMemberStatus, IndividualLoan, IndividualLoanPayment
+from mifi import sharding
+
+LOAN_TABLES = ((IndividualLoan, IndividualLoanPayment), (GroupLoan, GroupLoanPayment))
+
+
+def move_loans(model, payment_model, ids, alias):
+    """
+    Copy the loans `ids` on 'default', with their payments, memberships and
+    collateral rows, to `alias` under the same ids, then delete them from
+    'default'. The shard commits first: a chunk that fails on 'default' after
+    that is copied again, over the rows already there, on the next run.
+    """
+    source = DEFAULT_DB_ALIAS
+    content_type = ContentType.objects.get_for_model(model)
+    with sharding.atomic([alias]):
+        loans = list(model.objects.using(source).select_for_update().filter(pk__in=ids))
+        ids = [loan.pk for loan in loans]
+        payments = payment_model.objects.using(source).filter(loan_id__in=ids)
+        memberships = GroupMemberStatus.objects.using(source).filter(group_loan_id__in=ids)
+        collaterals = Collateral.objects.using(source).filter(content_type=content_type, object_id__in=ids)
+
+        model.objects.using(alias).bulk_create(loans, ignore_conflicts=True)
+        if model is GroupLoan:
+            GroupMemberStatus.objects.using(alias).bulk_create(memberships, batch_size=1000, ignore_conflicts=True)
+        payment_model.objects.using(alias).bulk_create(payments, batch_size=1000, ignore_conflicts=True)
+        Collateral.objects.using(alias).bulk_create(collaterals, batch_size=1000, ignore_conflicts=True)
+
+        collaterals.delete()
+        payments.delete()
+        if model is GroupLoan:
+            memberships.delete()
+        model.objects.using(source).filter(pk__in=ids).delete()
+    return len(ids)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the loans on 'default' whose loan officer is in a shard's REGIONS (SHARDING['SHARDS']), with "
+        "their payments, group memberships and collateral rows, to that shard, a chunk of loans per "
+        "transaction. Run after migrating a new shard or moving a region to one; safe to stop and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Loans per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the loans that would move")
+
+    def handle(self, *args, **options):
+        shards = getattr(settings, 'SHARDING', {}).get('SHARDS', {})
+        if not shards:
+            raise CommandError("No shards are configured in SHARDING['SHARDS'].")
+
+        for alias, shard in shards.items():
+            for model, payment_model in LOAN_TABLES:
+                label = model._meta.label
+                due = model.objects.using(DEFAULT_DB_ALIAS).filter(loan_officer__region__in=shard.get('REGIONS', ()))
+                if options['dry_run']:
+                    self.stdout.write(f"{alias}: {due.count()} {label} would move")
+                    continue
+                moved = 0
+                last_id = 0
+                while True:
+                    ids = list(due.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:options['chunk_size']])
+                    if not ids:
+                        break
+                    moved += move_loans(model, payment_model, ids, alias)
+                    last_id = ids[-1]
+                    self.stdout.write(f"{alias}: {moved} {label} moved")
+                self.stdout.write(self.style.SUCCESS(f"{alias}: {moved} {label} moved"))
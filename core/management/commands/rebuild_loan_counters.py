@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount every loan's counter columns (payments, last payment, collateral by type, group members "
+        "and blocked members) from the rows they count. Run after writing loans outside the ORM or to "
+        "repair drift; safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Loans per transaction")
+
+    def handle(self, *args, **options):
+        done = rebuild(
+            chunk_size=options['chunk_size'],
+            progress=lambda label, count: self.stdout.write(f"{label}: {count} recounted"),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "Done: " + ', '.join(f"{count} {label}" for label, count in done.items())
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0011_collateral_collateral_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collateral',
+            name='rejected',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='collateral',
+            index=models.Index(condition=models.Q(('rejected', False), ('verified', False)), fields=['id'], name='collateral_review_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:52
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+COLLATERAL_COUNTERS = {'PHOTO': 'photo_count', 'VIDEO': 'video_count', 'DOCUMENT': 'document_count'}
+
+
+def _count(queryset, field):
+    counted = queryset.order_by().values(field).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def count_existing(apps, schema_editor):
+    """Recount the new columns on the database being migrated, with the models as of this migration."""
+    alias = schema_editor.connection.alias
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Collateral = apps.get_model('core', 'Collateral')
+    GroupMemberStatus = apps.get_model('core', 'GroupMemberStatus')
+
+    for loan_name, payment_name in (('IndividualLoan', 'IndividualLoanPayment'), ('GroupLoan', 'GroupLoanPayment')):
+        model = apps.get_model('core', loan_name)
+        payments = apps.get_model('core', payment_name).objects.using(alias).filter(loan=OuterRef('pk'))
+        counters = {
+            'payment_count': _count(payments, 'loan'),
+            'last_payment_at': Subquery(
+                payments.order_by().values('loan').annotate(last=Max('payment_date')).values('last')
+            ),
+        }
+        content_type = ContentType.objects.using(alias).filter(app_label='core', model=loan_name.lower()).first()
+        if content_type is not None:
+            collaterals = Collateral.objects.using(alias).filter(content_type=content_type, object_id=OuterRef('pk'))
+            for collateral_type, field in COLLATERAL_COUNTERS.items():
+                counters[field] = _count(collaterals.filter(collateral_type=collateral_type), 'object_id')
+        if loan_name == 'GroupLoan':
+            memberships = GroupMemberStatus.objects.using(alias).filter(group_loan=OuterRef('pk'))
+            counters['member_count'] = _count(memberships, 'group_loan')
+            counters['blocked_member_count'] = _count(memberships.filter(is_blocked=True), 'group_loan')
+        model.objects.using(alias).update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0012_collateral_rejected_review_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grouploan',
+            name='blocked_member_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouploan',
+            name='document_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouploan',
+            name='last_payment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='grouploan',
+            name='member_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouploan',
+            name='payment_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouploan',
+            name='photo_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouploan',
+            name='video_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='individualloan',
+            name='document_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='individualloan',
+            name='last_payment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='individualloan',
+            name='payment_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='individualloan',
+            name='photo_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='individualloan',
+            name='video_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_loan_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grouploan',
+            name='version',
+            field=models.PositiveIntegerField(db_default=1, default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='groupmemberstatus',
+            name='version',
+            field=models.PositiveIntegerField(db_default=1, default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='individualloan',
+            name='version',
+            field=models.PositiveIntegerField(db_default=1, default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0014_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='collateral',
+            name='content_type',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AlterField(
+            model_name='collateral',
+            name='uploaded_by',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='uploaded_collaterals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='collateral',
+            name='verified_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='verified_collaterals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='grouploan',
+            name='loan_officer',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_loans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='grouploanpayment',
+            name='member',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='group_loan_payments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='grouploanpayment',
+            name='recorded_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_recorded_payments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='groupmemberstatus',
+            name='blocked_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='blocked_memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='groupmemberstatus',
+            name='member',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='group_member_statuses', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='individualloan',
+            name='loan_officer',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_loans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='individualloan',
+            name='recipient',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='individual_loans_as_recipient', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='individualloanpayment',
+            name='recorded_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_recorded_payments', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
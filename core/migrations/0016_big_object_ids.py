@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_shard_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='collateral',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
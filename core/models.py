@@ -1,18 +1,108 @@
-from datetime import timedelta
 from decimal import Decimal
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from users.models import User
+from mifi import sharding
+from ledger import accrual, journal
+from live import feed
+from outbox import events
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
+# Loan columns that count rows elsewhere, by collateral type for collateral
+COLLATERAL_COUNTERS = {'PHOTO': 'photo_count', 'VIDEO': 'video_count', 'DOCUMENT': 'document_count'}
+LOAN_COUNTERS = ('payment_count', 'last_payment_at', *COLLATERAL_COUNTERS.values())
+GROUP_COUNTERS = ('member_count', 'blocked_member_count')
+# Loans, payments, memberships and collateral may be on a region's shard
+# (mifi.sharding) while users and content types are on 'default', so the
+# foreign keys from them to users and content types are not enforced by the
+# database (db_constraint=False)
+
+
+def bump_counters(model, pk, using=None, **deltas):
+    """
+    Move counter columns on one row by relative amounts in one UPDATE, so
+    changes made at the same time add up instead of overwriting each other.
+    Call it in the transaction that adds or removes the counted rows, with
+    `using` the database they are on (default: the pinned shard).
+    """
+    changes = {name: models.F(name) + delta for name, delta in deltas.items() if delta}
+    if changes and pk is not None:
+        model.objects.db_manager(using).filter(pk=pk).update(**changes)
+
+
+class VersionConflict(Exception):
+    """A conditional save found its row changed, or gone, since the version it was based on."""
+
+
+class VersionedModel(models.Model):
+    """
+    A row whose version moves on by one in every UPDATE save() makes,
+    computed by the UPDATE itself. After expect_version() the next save
+    writes only the given fields and matches the row only if it is still
+    at that version, so concurrent edits are caught by one statement
+    instead of a lock. Balances and counters move through their own
+    UPDATEs and leave the version alone: they are not edited by clients.
+    """
+    version = models.PositiveIntegerField(default=1, db_default=1, editable=False)
+
+    _expected_version = None
+    _changed_fields = None
+
+    class Meta:
+        abstract = True
+
+    def expect_version(self, version, fields):
+        """
+        Make the next save conditional on `version`. `fields` are the names
+        to write, or a dict keyed by them (e.g. a serializer's validated_data),
+        read when the save happens.
+        """
+        self._expected_version = version
+        self._changed_fields = fields
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            if self._changed_fields is not None:
+                names = self._meta._non_pk_concrete_field_names
+                kwargs['update_fields'] = [
+                    *(name for name in self._changed_fields if name in names),
+                    *(field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)),
+                ]
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self._expected_version = self._changed_fields = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = self._expected_version
+        if expected is not None:
+            base_qs = base_qs.filter(version=expected)
+        bumped = any(field.attname == 'version' for field, model, value in values)
+        values = [
+            (field, model, models.F('version') + 1 if field.attname == 'version' else value)
+            for field, model, value in values
+        ]
+        updated = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if expected is not None and not updated:
+            raise VersionConflict()
+        if updated and bumped:
+            # Exact for a conditional save; otherwise right unless another write came in between
+            self.version = expected + 1 if expected is not None else self.version + 1
+        return updated
+
+
 def photo_upload_path(instance, filename):
     return f"collateral/photos/loan_{instance.loan.id}/{filename}"
 
 def video_upload_path(instance, filename):
     return f"collateral/videos/loan_{instance.loan.id}/{filename}"
 
-class Loan(models.Model):
+class Loan(VersionedModel):
     LOAN_TYPES = (
         ('individual', 'Individual'),
         ('group', 'Group'),
@@ -50,6 +140,7 @@ class Loan(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     loan_officer = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.SET_NULL,
         null=True,
         related_name='%(class)s_loans'
@@ -63,64 +154,46 @@ class Loan(models.Model):
         choices=LOAN_STATUSES, 
         default='active'
     )
+    # Maintained by the code that adds and removes payments and collateral
+    # (db_default covers raw INSERTs); `manage.py rebuild_loan_counters`
+    # recounts them
+    payment_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+    last_payment_at = models.DateTimeField(null=True, blank=True, editable=False)
+    photo_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+    video_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+    document_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+
+    # On the shard of the loan officer's region; a loan's other rows follow it
+    shard_by = 'loan_officer'
 
 
-    def calculate_interest(self):
+    def calculate_interest(self, days=None):
+        """
+        Interest at interest_rate percent a year over the whole term, or over
+        its first `days` days, exact to the ngwee. The daily accrual charges
+        the same amounts one day at a time.
+        """
         duration_days = (self.end_date - self.start_date).days
-        if duration_days <= 0:
+        days = duration_days if days is None else min(days, duration_days)
+        if days <= 0:
             return Decimal('0.00')
-        
-        # Fixed interest rate of 40%
-        interest_rate = Decimal('40.0')
-        
-        # Calculate based on repayment frequency
-        if self.repayment_frequency == 'daily':
-            # For daily loans, interest is calculated per day
-            interest_per_day = (self.amount * interest_rate) / (100 * 365)
-            return round(interest_per_day * duration_days, 2)
-        
-        elif self.repayment_frequency == 'weekly':
-            # For weekly loans, interest is calculated per week
-            weeks = duration_days / 7
-            interest_per_week = (self.amount * interest_rate) / (100 * 52)
-            return round(interest_per_week * weeks, 2)
-        
-        elif self.repayment_frequency == 'monthly':
-            # For monthly loans, interest is calculated per month
-            months = duration_days / 30  # Approximate
-            interest_per_month = (self.amount * interest_rate) / (100 * 12)
-            return round(interest_per_month * months, 2)
+        return accrual.kwacha(
+            accrual.interest_for_days(self.amount, self.interest_rate, self.repayment_frequency, days)
+        ).quantize(Decimal('0.01'))
 
     def get_payment_schedule(self):
         """
         Generate a payment schedule based on repayment frequency
-        Returns a list of (date, amount) tuples
+        Returns a list of (date, amount) tuples, evenly spaced after
+        start_date with the last one on end_date. The last instalment takes
+        any rounding remainder, so the amounts add up to what is owed.
         """
-        schedule = []
-        current_date = self.start_date
-        total_installments = self.get_total_installments()
-        installment_amount = self.total_due / total_installments
-        
-        while current_date <= self.end_date:
-            schedule.append((current_date, installment_amount))
-            
-            if self.repayment_frequency == 'daily':
-                current_date += timedelta(days=1)
-            elif self.repayment_frequency == 'weekly':
-                current_date += timedelta(weeks=1)
-            elif self.repayment_frequency == 'monthly':
-                # Handle month increments properly
-                next_month = current_date.month + 1
-                next_year = current_date.year
-                if next_month > 12:
-                    next_month = 1
-                    next_year += 1
-                try:
-                    current_date = current_date.replace(month=next_month, year=next_year)
-                except ValueError:
-                    # Handle cases where day doesn't exist in next month
-                    current_date = (current_date.replace(day=1) + timedelta(days=32)).replace(day=current_date.day)
-        
+        installments = max(self.get_total_installments(), 1)
+        owed = self.total_due + self.total_paid
+        installment = (owed / installments).quantize(Decimal('0.01'))
+        period = (self.end_date - self.start_date) / installments
+        schedule = [(self.start_date + period * n, installment) for n in range(1, installments)]
+        schedule.append((self.end_date, owed - installment * (installments - 1)))
         return schedule
 
     def get_total_installments(self):
@@ -136,11 +209,99 @@ class Loan(models.Model):
         
         return 1
 
+    def get_next_due_payment(self):
+        """
+        The earliest installment due by today that total_paid does not cover
+        yet, as (due_date, amount outstanding), or None when up to date.
+        """
+        covered = self.total_paid
+        today = timezone.localdate()
+        for due_date, installment in self.get_payment_schedule():
+            if due_date > today:
+                break
+            if covered < installment:
+                return due_date, installment - covered
+            covered -= installment
+        return None
+
+    def record_payment(self, amount, user, payment_type='NORMAL', **payment_fields):
+        """
+        Save a payment row and post it to the journal, which moves total_due
+        and total_paid in one guarded UPDATE. A loan paid down to zero is
+        marked completed.
+        """
+        if amount <= 0:
+            raise ValidationError("Payment amount must be positive.")
+
+        with sharding.atomic([self._state.db]):
+            payment = self.payments.create(
+                amount=amount,
+                recorded_by=user,
+                payment_type=payment_type,
+                **payment_fields
+            )
+            journal.post_payment(self, payment, user)
+            events.payments_posted(self, [payment])
+            feed.payments_posted(self, [payment])
+            self.complete_if_paid()
+        return payment
+
+    def check_payment_type(self, payment_type):
+        """Raise ValidationError unless a `payment_type` payment can be made on the loan as it stands."""
+        if payment_type in ('NORMAL', 'ADVANCE') and self.status != 'active':
+            raise ValidationError("Payments can only be made on active loans")
+        if payment_type == 'ADVANCE' and self.get_next_due_payment():  # If there are pending payments
+            raise ValidationError("Advance payments can only be made when there are no pending payments")
+        if payment_type == 'RECOVERY' and self.status != 'overdue':
+            raise ValidationError("Recovery payments can only be made on overdue loans")
+
+    def complete_if_paid(self):
+        """Mark the loan completed once its journal-posted total_due is down to zero."""
+        if self.total_due <= 0 and self.status != 'completed':
+            type(self).objects.using(self._state.db).filter(pk=self.pk).update(
+                status='completed', version=models.F('version') + 1
+            )
+            self.status = self._stored_status = 'completed'
+            feed.statuses_changed(type(self), [(self.pk, self.loan_officer_id)], 'completed')
+
+    def reopen_if_owed(self):
+        """Undo complete_if_paid() when a reversal leaves the loan owing again."""
+        if self.total_due > 0 and self.status == 'completed':
+            status = 'overdue' if self.end_date < timezone.localdate() else 'active'
+            type(self).objects.using(self._state.db).filter(pk=self.pk).update(
+                status=status, version=models.F('version') + 1
+            )
+            self.status = self._stored_status = status
+            feed.statuses_changed(type(self), [(self.pk, self.loan_officer_id)], status)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # save() compares against this to publish status changes to the live feed
+        if 'status' in field_names:
+            instance._stored_status = instance.status
+        return instance
+
     def save(self, *args, **kwargs):
-        # On creation, set total_due = amount if not already set
+        # On creation, set total_due = amount if not already set; the ledger's
+        # disbursement entry records the same amount
         if self.pk is None and not self.total_due:
             self.total_due = self.amount
-        super().save(*args, **kwargs)
+        creating = self._state.adding
+        if not creating and kwargs.get('update_fields') is None:
+            # Counters only move through bump_counters: a stale instance must not write them back
+            skipped = {*LOAN_COUNTERS, *GROUP_COUNTERS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped and field.attname not in skipped
+            ]
+        with sharding.atomic([sharding.database_of(self, kwargs.get('using'))]):
+            super().save(*args, **kwargs)
+            if creating:
+                events.loans_created([self])
+        if getattr(self, '_stored_status', self.status) != self.status:
+            feed.statuses_changed(type(self), [(self.pk, self.loan_officer_id)], self.status)
+        self._stored_status = self.status
     
     def clean(self):
         super().clean()
@@ -166,6 +327,7 @@ class IndividualLoan(Loan):
     last_name = models.CharField(max_length=100)
     recipient = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='individual_loans_as_recipient'
     )
@@ -191,77 +353,21 @@ class IndividualLoan(Loan):
     
 
     def make_payment(self, amount, user, member=None):
-        if amount <= 0:
-            raise ValidationError("Payment amount must be positive.")
-            
         if amount > self.total_due:
             raise ValidationError("Payment amount exceeds total due.")
-            
-        self.total_due -= amount
-        self.total_paid += amount
-        self.save()
-        
-        if isinstance(self, IndividualLoan):
-            return IndividualLoanPayment.objects.create(
-                loan=self,
-                amount=amount,
-                recorded_by=user
-            )
-        elif isinstance(self, GroupLoan) and member:
-            return GroupLoanPayment.objects.create(
-                loan=self,
-                amount=amount,
-                recorded_by=user,
-                member=member
-            )
-        else:
-            raise ValidationError("Invalid payment parameters.")
+        return self.record_payment(amount, user)
         
     def make_normal_payment(self, amount, user):
-        if self.status != 'ACTIVE':
-            raise ValidationError("Payments can only be made on active loans")
-            
-        payment = IndividualLoanPayment.objects.create(
-            loan=self,
-            amount=amount,
-            recorded_by=user,
-            payment_type='NORMAL'
-        )
-        self.balance -= amount
-        self.save()
-        return payment
+        self.check_payment_type('NORMAL')
+        return self.record_payment(amount, user, 'NORMAL')
     
     def make_advance_payment(self, amount, user):
-        if self.status != 'ACTIVE':
-            raise ValidationError("Payments can only be made on active loans")
-        if self.get_next_due_payment():  # If there are pending payments
-            raise ValidationError("Advance payments can only be made when there are no pending payments")
-            
-        payment = IndividualLoanPayment.objects.create(
-            loan=self,
-            amount=amount,
-            recorded_by=user,
-            payment_type='ADVANCE'
-        )
-        self.balance -= amount
-        self.save()
-        return payment
+        self.check_payment_type('ADVANCE')
+        return self.record_payment(amount, user, 'ADVANCE')
     
     def make_recovery_payment(self, amount, user):
-        if self.status != 'OVERDUE':
-            raise ValidationError("Recovery payments can only be made on overdue loans")
-            
-        payment = IndividualLoanPayment.objects.create(
-            loan=self,
-            amount=amount,
-            recorded_by=user,
-            payment_type='RECOVERY'
-        )
-        self.balance -= amount
-        if self.balance <= 0:
-            self.status = 'PAID'
-        self.save()
-        return payment
+        self.check_payment_type('RECOVERY')
+        return self.record_payment(amount, user, 'RECOVERY')
     
     
     
@@ -270,12 +376,9 @@ class IndividualLoan(Loan):
         
         # If this is an existing loan and we're updating it
         if self.pk:
-            existing_collaterals = self.collaterals.all()
-            collateral_types = existing_collaterals.values_list('collateral_type', flat=True)
-            
             # Check if all required collateral types are present
             for required_type in self.REQUIRED_COLLATERAL_TYPES:
-                if required_type not in collateral_types:
+                if not getattr(self, COLLATERAL_COUNTERS[required_type]):
                     raise ValidationError(
                         f"Required collateral type {required_type} is missing"
                     )
@@ -291,10 +394,11 @@ class IndividualLoan(Loan):
             self.clean()
             super().save(*args, **kwargs)
 
-class GroupMemberStatus(models.Model):
+class GroupMemberStatus(VersionedModel):
     group_loan = models.ForeignKey('GroupLoan', on_delete=models.CASCADE)
     member = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='group_member_statuses'
     )
@@ -306,18 +410,52 @@ class GroupMemberStatus(models.Model):
     blocked_at = models.DateTimeField(null=True, blank=True)
     blocked_by = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
         related_name='blocked_memberships'
     )
+    shard_by = 'group_loan'
 
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # save() and delete() move the group's counters from this state
+        instance._counted = (instance.__dict__.get('group_loan_id'), instance.__dict__.get('is_blocked'))
+        return instance
+
+    @staticmethod
+    def move_counters(before, after, using=None):
+        """Adjust member counters from one (group_loan_id, is_blocked) state to another; None is no row."""
+        deltas = {}
+        for state, sign in ((before, -1), (after, 1)):
+            if state is not None:
+                group = deltas.setdefault(state[0], {'member_count': 0, 'blocked_member_count': 0})
+                group['member_count'] += sign
+                group['blocked_member_count'] += sign if state[1] else 0
+        for group_loan_id, counters in deltas.items():
+            bump_counters(GroupLoan, group_loan_id, using, **counters)
+
     def save(self, *args, **kwargs):
         # Automatically set frequency_letter from parent group if not set
         if not self.frequency_letter and self.group_loan_id:
             self.frequency_letter = self.group_loan.frequency_letter
-        super().save(*args, **kwargs)
+        counted = (self.group_loan_id, self.is_blocked)
+        using = sharding.database_of(self, kwargs.get('using'))
+        with sharding.atomic([using]):
+            super().save(*args, **kwargs)
+            self.move_counters(getattr(self, '_counted', None), counted, using)
+        self._counted = counted
+
+    def delete(self, *args, **kwargs):
+        using = sharding.database_of(self, kwargs.get('using'))
+        with sharding.atomic([using]):
+            result = super().delete(*args, **kwargs)
+            self.move_counters(getattr(self, '_counted', (self.group_loan_id, self.is_blocked)), None, using)
+        self._counted = None
+        return result
 
     def __str__(self):
         return f"{self.member.email} - Group {self.frequency_letter}"
@@ -338,8 +476,8 @@ class Collateral(models.Model):
         ('DOCUMENT', 'Document'),
     )   
     # Generic foreign key approach
-    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
-    object_id = models.PositiveIntegerField()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, db_constraint=False)
+    object_id = models.PositiveBigIntegerField()
     loan = GenericForeignKey('content_type', 'object_id')
     collateral_type = models.CharField(
         max_length=10, 
@@ -351,25 +489,71 @@ class Collateral(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     uploaded_by = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='uploaded_collaterals'
     )
     verified = models.BooleanField(default=False)
     verified_by = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
         related_name='verified_collaterals'
     )
     verified_at = models.DateTimeField(null=True, blank=True)
+    rejected = models.BooleanField(default=False)
+    shard_by = 'loan'
 
     class Meta:
         indexes = [
             models.Index(fields=['content_type', 'object_id']),
+            models.Index(
+                fields=['id'],
+                name='collateral_review_queue_idx',
+                condition=models.Q(verified=False, rejected=False),
+            ),
         ]
 
-    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # save() and delete() move the loan's counters from this state
+        instance._counted = tuple(instance.__dict__.get(name) for name in ('content_type_id', 'object_id', 'collateral_type'))
+        return instance
+
+    @staticmethod
+    def move_counters(before, after, using=None):
+        """Adjust loan counters from one (content_type_id, object_id, collateral_type) state to another."""
+        deltas = {}
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None or None in state[:2] or state[2] not in COLLATERAL_COUNTERS:
+                continue
+            counters = deltas.setdefault(state[:2], dict.fromkeys(COLLATERAL_COUNTERS.values(), 0))
+            counters[COLLATERAL_COUNTERS[state[2]]] += sign
+        for (content_type_id, object_id), counters in deltas.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if issubclass(model, Loan):
+                bump_counters(model, object_id, using, **counters)
+
+    def save(self, *args, **kwargs):
+        counted = (self.content_type_id, self.object_id, self.collateral_type)
+        using = sharding.database_of(self, kwargs.get('using'))
+        with sharding.atomic([using]):
+            super().save(*args, **kwargs)
+            self.move_counters(getattr(self, '_counted', None), counted, using)
+        self._counted = counted
+
+    def delete(self, *args, **kwargs):
+        counted = getattr(self, '_counted', (self.content_type_id, self.object_id, self.collateral_type))
+        using = sharding.database_of(self, kwargs.get('using'))
+        with sharding.atomic([using]):
+            result = super().delete(*args, **kwargs)
+            self.move_counters(counted, None, using)
+        self._counted = None
+        return result
+
 
 class GroupLoan(Loan):
     FREQUENCY_LETTERS = (
@@ -405,6 +589,8 @@ class GroupLoan(Loan):
     new = models.BooleanField(default=True)
     members = models.ManyToManyField(User,through='GroupMemberStatus',through_fields=('group_loan', 'member'),related_name='group_loans')
     time = models.CharField(max_length=100, blank=True, null=True)
+    member_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+    blocked_member_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
 
 
     def clean(self):
@@ -424,54 +610,122 @@ class GroupLoan(Loan):
         """Returns a combined frequency representation"""
         return f"{self.frequency_letter}"
     
+    def make_payment(self, amount, user, member=None):
+        if member is None:
+            raise ValidationError("Invalid payment parameters.")
+        if amount > self.total_due:
+            raise ValidationError("Payment amount exceeds total due.")
+        return self.record_payment(amount, user, member=member)
+
     def make_normal_payment(self, amount, user, member):
-        if self.status != 'ACTIVE':
-            raise ValidationError("Payments can only be made on active loans")
-            
-        payment = GroupLoanPayment.objects.create(
-            loan=self,
-            amount=amount,
-            recorded_by=user,
-            member=member,
-            payment_type='NORMAL'
-        )
-        self.balance -= amount
-        self.save()
-        return payment
+        self.check_payment_type('NORMAL')
+        return self.record_payment(amount, user, 'NORMAL', member=member)
     
     def make_advance_payment(self, amount, user, member):
-        if self.status != 'ACTIVE':
-            raise ValidationError("Payments can only be made on active loans")
-        if self.get_next_due_payment():  # If there are pending payments
-            raise ValidationError("Advance payments can only be made when there are no pending payments")
-            
-        payment = GroupLoanPayment.objects.create(
-            loan=self,
-            amount=amount,
-            recorded_by=user,
-            member=member,
-            payment_type='ADVANCE'
-        )
-        self.balance -= amount
-        self.save()
-        return payment
+        self.check_payment_type('ADVANCE')
+        return self.record_payment(amount, user, 'ADVANCE', member=member)
     
     def make_recovery_payment(self, amount, user, member):
-        if self.status != 'OVERDUE':
-            raise ValidationError("Recovery payments can only be made on overdue loans")
-            
-        payment = GroupLoanPayment.objects.create(
+        self.check_payment_type('RECOVERY')
+        return self.record_payment(amount, user, 'RECOVERY', member=member)
+
+    def collection_sheet(self):
+        """
+        Per-member dues for a group meeting: each member's equal share of the
+        loan spread over its installments, what they have paid so far and
+        whether they are blocked. Paid totals come from a correlated SUM, so
+        the whole sheet is read in one query (two on a sharded database).
+        """
+        paid = GroupLoanPayment.objects.using(self._state.db).filter(
             loan=self,
-            amount=amount,
-            recorded_by=user,
-            member=member,
-            payment_type='RECOVERY'
+            member=models.OuterRef('member_id')
+        ).values('member').annotate(total=models.Sum('amount')).values('total')
+
+        memberships = GroupMemberStatus.objects.using(self._state.db).filter(group_loan=self).annotate(
+            paid=Coalesce(models.Subquery(paid), Decimal('0.00'), output_field=models.DecimalField())
         )
-        self.balance -= amount
-        if self.balance <= 0:
-            self.status = 'PAID'
-        self.save()
-        return payment
+        if sharding.crosses(GroupMemberStatus, User):
+            # The members are on 'default' and this loan perhaps not: their names are a second query
+            rows = list(memberships.values('member_id', 'is_blocked', 'paid'))
+            members = User.objects.in_bulk({row['member_id'] for row in rows})
+            for row in rows:
+                member = members.get(row['member_id'])
+                row['member__first_name'] = member.first_name if member else ''
+                row['member__last_name'] = member.last_name if member else ''
+            rows.sort(key=lambda row: (row['member__last_name'], row['member__first_name']))
+        else:
+            rows = list(
+                memberships
+                .values('member_id', 'member__first_name', 'member__last_name', 'is_blocked', 'paid')
+                .order_by('member__last_name', 'member__first_name')
+            )
+
+        installments = max(self.get_total_installments(), 1)
+        share = (self.total_due + self.total_paid) / max(len(rows), 1)
+        expected_installment = (share / installments).quantize(Decimal('0.01'))
+
+        return [
+            {
+                'member_id': row['member_id'],
+                'first_name': row['member__first_name'],
+                'last_name': row['member__last_name'],
+                'is_blocked': row['is_blocked'],
+                'expected_installment': expected_installment,
+                'paid': row['paid'],
+                'outstanding': max(share.quantize(Decimal('0.01')) - row['paid'], Decimal('0.00')),
+            }
+            for row in rows
+        ]
+
+    def record_collection_sheet(self, entries, user):
+        """
+        Apply a completed meeting sheet: every payment and its journal entry
+        are inserted in bulk and the group totals move in one conditional
+        UPDATE. Each entry's payment_type must be one a single payment could
+        have, and a sheet that pays the loan off completes it, as
+        record_payment does. Either the whole sheet is recorded or none of it is.
+        """
+        member_ids = [entry['member_id'] for entry in entries]
+        if len(member_ids) != len(set(member_ids)):
+            raise ValidationError("Each member can appear only once on a collection sheet.")
+
+        total = sum((entry['amount'] for entry in entries), Decimal('0.00'))
+        if total <= 0:
+            raise ValidationError("Payment amount must be positive.")
+        # The rules each entry would meet as a single payment
+        for payment_type in {entry.get('payment_type', 'NORMAL') for entry in entries}:
+            self.check_payment_type(payment_type)
+
+        with sharding.atomic([self._state.db]):
+            known = set(
+                GroupMemberStatus.objects.using(self._state.db).filter(group_loan=self, member_id__in=member_ids)
+                .values_list('member_id', flat=True)
+            )
+            unknown = set(member_ids) - known
+            if unknown:
+                raise ValidationError(
+                    f"Members {sorted(unknown)} do not belong to this group."
+                )
+
+            payments = GroupLoanPayment.objects.using(self._state.db).bulk_create([
+                GroupLoanPayment(
+                    loan=self,
+                    member_id=entry['member_id'],
+                    amount=entry['amount'],
+                    payment_type=entry.get('payment_type', 'NORMAL'),
+                    recorded_by=user
+                )
+                for entry in entries
+            ])
+            GroupLoanPayment.count_added(payments)
+
+            # One journal entry per payment; the totals move in one guarded UPDATE
+            journal.post_payments(self, payments, user)
+            events.payments_posted(self, payments)
+            feed.payments_posted(self, payments)
+            self.complete_if_paid()
+
+        return payments
     
 class Payment(models.Model):
     """Model to track loan payments"""
@@ -486,14 +740,48 @@ class Payment(models.Model):
     payment_type = models.CharField(max_length=10, choices=PAYMENT_TYPES, default='NORMAL')
     recorded_by = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.SET_NULL,
         null=True,
         related_name='%(class)s_recorded_payments'
     )
+    shard_by = 'loan'
     
     class Meta:
         abstract = True
 
+    @classmethod
+    def count_added(cls, payments):
+        """Count newly inserted payments of one loan on it; bulk_create callers must call this themselves."""
+        if payments:
+            loans = cls._meta.get_field('loan').related_model.objects.using(payments[0]._state.db)
+            loans.filter(pk=payments[0].loan_id).update(
+                payment_count=models.F('payment_count') + len(payments),
+                last_payment_at=max(payment.payment_date for payment in payments),
+            )
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        with sharding.atomic([sharding.database_of(self, kwargs.get('using'))]):
+            super().save(*args, **kwargs)
+            if creating:
+                self.count_added([self])
+
+    def delete(self, *args, deleted_by=None, **kwargs):
+        """Remove the payment and reverse its journal entry, which gives the loan its totals back."""
+        loan = self.loan
+        payment_id = self.pk
+        with sharding.atomic([loan._state.db]):
+            result = super().delete(*args, **kwargs)
+            payments = type(self).objects.using(loan._state.db).filter(loan_id=loan.pk)
+            type(loan).objects.using(loan._state.db).filter(pk=loan.pk).update(
+                payment_count=models.F('payment_count') - 1,
+                last_payment_at=payments.aggregate(last=models.Max('payment_date'))['last'],
+            )
+            journal.reverse_payment(loan, payment_id, deleted_by)
+            loan.reopen_if_owed()
+        return result
+
 class IndividualLoanPayment(Payment):
     loan = models.ForeignKey(
         IndividualLoan,
@@ -509,6 +797,7 @@ class GroupLoanPayment(Payment):
     )
     member = models.ForeignKey(
         User,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='group_loan_payments'
     )
\ No newline at end of file
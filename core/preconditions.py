@@ -0,0 +1,93 @@
+"""
+Optimistic concurrency for edits to loans and group memberships.
+
+Reads carry the row's version as an ETag. An update has to say which
+version it was based on, in an If-Match header (or a `version` field for
+clients that cannot set headers), and is written with one conditional
+UPDATE: if someone else saved the row in the meantime nothing is written
+and the client gets a 412 with the current version to reload from. An
+update without a version gets a 428; `If-Match: *` asks for the old
+last-write-wins behaviour explicitly.
+"""
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from mifi import sharding
+
+from .models import VersionConflict
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = "The record was changed by someone else. Reload it and apply your changes again."
+    default_code = 'version_conflict'
+
+
+class PreconditionRequired(APIException):
+    status_code = status.HTTP_428_PRECONDITION_REQUIRED
+    default_detail = "Send the version you are updating in an If-Match header or a `version` field."
+    default_code = 'version_required'
+
+
+def etag(instance):
+    return f'"{instance.version}"'
+
+
+def expected_version(request):
+    """The version the update is based on, None for `If-Match: *`."""
+    header = request.headers.get('If-Match')
+    if header is not None:
+        header = header.strip()
+        if header == '*':
+            return None
+        value = header.removeprefix('W/').strip('"')
+    elif isinstance(request.data, dict) and request.data.get('version') is not None:
+        value = str(request.data['version'])
+    else:
+        raise PreconditionRequired()
+    if not value.isdigit():
+        raise ValidationError({'version': ["Must be the version number (the ETag) of the record."]})
+    return int(value)
+
+
+class ConditionalUpdateMixin:
+    """
+    Viewsets over VersionedModel rows: ETags on reads and writes, and
+    PUT/PATCH only against the version the client last saw.
+    """
+    versioned_object = None
+
+    def get_object(self):
+        self.versioned_object = super().get_object()
+        return self.versioned_object
+
+    def update(self, request, *args, **kwargs):
+        version = expected_version(request)
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        if version is not None:
+            # The keys are read at save time, after perform_update has added to them
+            instance.expect_version(version, serializer.validated_data)
+        try:
+            with sharding.atomic():
+                self.perform_update(serializer)
+        except VersionConflict:
+            current = type(instance).objects.filter(pk=instance.pk).values_list('version', flat=True).first()
+            if current is None:
+                raise PreconditionFailed("The record has been deleted.")
+            return Response(
+                {'detail': PreconditionFailed.default_detail, 'version': current},
+                status=PreconditionFailed.status_code,
+                headers={'ETag': f'"{current}"'},
+            )
+        return Response(serializer.data)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        instance = self.versioned_object
+        if (instance is not None and request.method != 'DELETE' and response.status_code < 300
+                and not response.has_header('ETag')):
+            response['ETag'] = etag(instance)
+        return super().finalize_response(request, response, *args, **kwargs)
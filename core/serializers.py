@@ -1,10 +1,25 @@
+from decimal import Decimal
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
-from .models import GroupLoanPayment, IndividualLoan, GroupLoan, GroupMemberStatus, IndividualLoanPayment, Collateral
+from .models import GROUP_COUNTERS, GroupLoanPayment, IndividualLoan, GroupLoan, GroupMemberStatus, IndividualLoanPayment, Collateral, Payment, bump_counters
+from users.models import User
 from users.serializers import UserSerializer
+from mifi import sharding
+from mifi.sparse import SparseSerializerMixin
 from rest_framework.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
 
+
+def check_users(ids):
+    """
+    Reject user ids with no user. Loan rows may be on another database than
+    the users, so the database doesn't check their user ids (see mifi.sharding).
+    """
+    ids = set(ids)
+    missing = ids - set(User.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    if missing:
+        raise serializers.ValidationError(f"No users with ids {sorted(missing)}.")
+
 class GroupLoanPaymentSerializer(serializers.ModelSerializer):
     recorded_by = UserSerializer(read_only=True)
     member = UserSerializer(read_only=True)
@@ -22,7 +37,7 @@ class IndividualLoanPaymentSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('payment_date', 'recorded_by')
 
-class IndividualLoanPaymentSerializer(serializers.ModelSerializer):
+class IndividualLoanPaymentSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     recorded_by = UserSerializer(read_only=True)
     
     class Meta:
@@ -30,16 +45,21 @@ class IndividualLoanPaymentSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('payment_date', 'recorded_by')
 
-class GroupLoanPaymentSerializer(serializers.ModelSerializer):
+class GroupLoanPaymentSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     recorded_by = UserSerializer(read_only=True)
     member = UserSerializer(read_only=True)
+    member_id = serializers.IntegerField(write_only=True)
     
     class Meta:
         model = GroupLoanPayment
         fields = '__all__'
         read_only_fields = ('payment_date', 'recorded_by')
 
-class IndividualLoanSerializer(serializers.ModelSerializer):
+    def validate_member_id(self, value):
+        check_users([value])
+        return value
+
+class IndividualLoanSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     recipient = UserSerializer(read_only=True)
     recipient_id = serializers.IntegerField(write_only=True)
     loan_officer = UserSerializer(read_only=True)
@@ -50,11 +70,15 @@ class IndividualLoanSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at', 'loan_type', 'loan_officer', 'total_due', 'total_paid')
 
+    def validate_recipient_id(self, value):
+        check_users([value])
+        return value
+
     def validate(self, data):
         data['loan_type'] = 'individual'
         return data
 
-class GroupMemberStatusSerializer(serializers.ModelSerializer):
+class GroupMemberStatusSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     member = UserSerializer(read_only=True)
     blocked_by = UserSerializer(read_only=True)
     group_loan = serializers.PrimaryKeyRelatedField(read_only=True)
@@ -64,7 +88,7 @@ class GroupMemberStatusSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('blocked_at', 'frequency_letter')
 
-class GroupLoanSerializer(serializers.ModelSerializer):
+class GroupLoanSerializer(sharding.ShardedSerializerMixin, SparseSerializerMixin, serializers.ModelSerializer):
     members = UserSerializer(many=True, read_only=True)
     member_statuses = GroupMemberStatusSerializer(many=True, read_only=True)
     loan_officer = UserSerializer(read_only=True)
@@ -82,14 +106,20 @@ class GroupLoanSerializer(serializers.ModelSerializer):
             'id', 'loan_type', 'group_name', 'frequency_letter', "end_date", "start_date",
             'amount', 'penalty', 'total_group_loan', 'loan_given', "time",
             'due_date', 'transferred', 'blocked', 'new', 'members',
-            'member_statuses', 'loan_officer', 'created_at', 'updated_at', 'member_ids', 'payments'
+            'member_statuses', 'loan_officer', 'created_at', 'updated_at', 'member_ids', 'payments',
+            'member_count', 'blocked_member_count', 'payment_count', 'last_payment_at', 'version',
         ]
 
         read_only_fields = (
             'created_at', 'updated_at', 'members', 'member_statuses',
-            'loan_type', 'loan_officer'
+            'loan_type', 'loan_officer', 'member_count', 'blocked_member_count', 'payment_count', 'last_payment_at',
+            'version',
         )
 
+    def validate_member_ids(self, value):
+        check_users(value)
+        return value
+
     def validate(self, data):
         data['loan_type'] = 'group'
         if 'member_ids' not in data:
@@ -100,39 +130,64 @@ class GroupLoanSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         member_ids = validated_data.pop('member_ids')
-        group_loan = GroupLoan.objects.create(**validated_data)
-        
-        for member_id in member_ids:
-            GroupMemberStatus.objects.create(
-                group_loan=group_loan,
-                member_id=member_id,
-                frequency_letter=group_loan.frequency_letter
-            )
-        
+
+        with sharding.atomic():
+            group_loan = GroupLoan.objects.create(**validated_data)
+            self._sync_members(group_loan, member_ids)
+
         return group_loan
 
     def update(self, instance, validated_data):
         member_ids = validated_data.pop('member_ids', None)
-        
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-        
-        if member_ids is not None:
-            if len(member_ids) < 2:
-                raise serializers.ValidationError({"member_ids": "At least 2 members are required."})
-            
-            instance.members.clear()
-            for member_id in member_ids:
-                GroupMemberStatus.objects.create(
-                    group_loan=instance,
+
+        if member_ids is not None and len(member_ids) < 2:
+            raise serializers.ValidationError({"member_ids": "At least 2 members are required."})
+
+        with sharding.atomic():
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+
+            if member_ids is not None:
+                self._sync_members(instance, member_ids)
+
+        return instance
+
+    def _sync_members(self, group_loan, member_ids):
+        """
+        Bring the group's memberships in line with member_ids using one read,
+        one bulk DELETE and one bulk INSERT. Members that stay keep their
+        existing status row, including is_blocked/blocked_by history.
+        """
+        requested = set(member_ids)
+        current = dict(
+            GroupMemberStatus.objects.filter(group_loan=group_loan).values_list('member_id', 'is_blocked')
+        )
+
+        removed = current.keys() - requested
+        if removed:
+            GroupMemberStatus.objects.filter(group_loan=group_loan, member_id__in=removed).delete()
+
+        added = requested - current.keys()
+        if added:
+            GroupMemberStatus.objects.bulk_create([
+                GroupMemberStatus(
+                    group_loan=group_loan,
                     member_id=member_id,
-                    frequency_letter=instance.frequency_letter
+                    frequency_letter=group_loan.frequency_letter
                 )
-        
-        return instance
+                for member_id in sorted(added)
+            ])
+
+        # The bulk writes skip GroupMemberStatus.save() and delete()
+        bump_counters(
+            GroupLoan, group_loan.pk,
+            member_count=len(added) - len(removed),
+            blocked_member_count=-sum(current[member_id] for member_id in removed),
+        )
+        group_loan.refresh_from_db(fields=GROUP_COUNTERS)
     
-class CollateralSerializer(serializers.ModelSerializer):
+class CollateralSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
     uploaded_by = UserSerializer(read_only=True)
     loan_type = serializers.CharField(write_only=True, required=False)  # Make optional
@@ -143,11 +198,11 @@ class CollateralSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'loan_type', 'loan_id', 'collateral_type', 
             'file', 'file_url', 'description', 'uploaded_at', 'verified',
-            'verified_by', 'verified_at', 'uploaded_by',
+            'verified_by', 'verified_at', 'rejected', 'uploaded_by',
         ]
         read_only_fields = [
             'id', 'file_url', 'uploaded_at', 'verified_at',
-            'verified_by', 'uploaded_by'
+            'verified_by', 'rejected', 'uploaded_by'
         ]
 
     def get_file_url(self, obj):
@@ -222,4 +277,124 @@ class CollateralSerializer(serializers.ModelSerializer):
             )
         
         return data
-    
+
+
+class CollateralReviewSerializer(SparseSerializerMixin, serializers.ModelSerializer):
+    """Flat, read-only shape for the back-office review queue (no nested users, no per-row joins)"""
+    loan_type = serializers.SerializerMethodField()
+    loan_id = serializers.IntegerField(source='object_id', read_only=True)
+    preview_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Collateral
+        fields = [
+            'id', 'loan_type', 'loan_id', 'collateral_type', 'preview_url',
+            'description', 'uploaded_at', 'uploaded_by',
+        ]
+        read_only_fields = fields
+
+    def get_loan_type(self, obj):
+        # get_for_id is served from the ContentType cache, so this never hits the database per row
+        return ContentType.objects.get_for_id(obj.content_type_id).model
+
+    def get_preview_url(self, obj):
+        if obj.file:
+            return self.context['request'].build_absolute_uri(obj.file.url)
+        return None
+
+
+class CollateralReviewDecisionSerializer(serializers.Serializer):
+    DECISIONS = (
+        ('verify', 'Verify'),
+        ('reject', 'Reject'),
+    )
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000,
+    )
+    decision = serializers.ChoiceField(choices=DECISIONS)
+
+
+class CollectionSheetMemberSerializer(serializers.Serializer):
+    member_id = serializers.IntegerField()
+    first_name = serializers.CharField()
+    last_name = serializers.CharField()
+    is_blocked = serializers.BooleanField()
+    expected_installment = serializers.DecimalField(max_digits=12, decimal_places=2)
+    paid = serializers.DecimalField(max_digits=12, decimal_places=2)
+    outstanding = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CollectionSheetEntrySerializer(serializers.Serializer):
+    member_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+    payment_type = serializers.ChoiceField(choices=Payment.PAYMENT_TYPES, default='NORMAL')
+
+
+class CollectionSheetSerializer(serializers.Serializer):
+    payments = CollectionSheetEntrySerializer(many=True, allow_empty=False)
+
+    def validate_payments(self, value):
+        check_users([entry['member_id'] for entry in value])
+        return value
+
+
+class OnboardingRowSerializer(serializers.Serializer):
+    """
+    One spreadsheet row: a client, optionally with an individual loan or a
+    share of a group loan. Group rows with the same group_name, start_date
+    and loan_officer make up one group loan.
+    """
+    email = serializers.EmailField()
+    first_name = serializers.CharField(max_length=150)
+    last_name = serializers.CharField(max_length=150)
+    nrc_number = serializers.CharField(max_length=30)
+    date_of_birth = serializers.DateField()
+    phone_number = serializers.CharField(max_length=20, required=False)
+    address = serializers.CharField(required=False)
+    region = serializers.CharField(max_length=100, required=False)
+    password = serializers.CharField(required=False, write_only=True)
+
+    loan_type = serializers.ChoiceField(choices=IndividualLoan.LOAN_TYPES, required=False)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'), required=False)
+    interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0, default=Decimal('40.00'))
+    penalty = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0, default=Decimal('0.00'))
+    repayment_frequency = serializers.ChoiceField(choices=IndividualLoan.REPAYMENT_FREQUENCIES, default='weekly')
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    loan_officer = serializers.EmailField(required=False)
+    group_name = serializers.CharField(max_length=100, required=False)
+    frequency_letter = serializers.ChoiceField(choices=GroupLoan.FREQUENCY_LETTERS, required=False)
+    due_date = serializers.DateField(required=False)
+
+    LOAN_FIELDS = ('amount', 'start_date', 'end_date', 'loan_officer')
+    GROUP_FIELDS = ('group_name', 'frequency_letter')
+
+    def validate(self, data):
+        loan_type = data.get('loan_type')
+        if not loan_type:
+            return data
+
+        required = self.LOAN_FIELDS + (self.GROUP_FIELDS if loan_type == 'group' else ())
+        missing = {field: ["This field is required for a loan."] for field in required if field not in data}
+        if missing:
+            raise serializers.ValidationError(missing)
+        # The same rules as Loan.clean(), which bulk inserts never call
+        if data['end_date'] < data['start_date']:
+            raise serializers.ValidationError({'end_date': ["End date must be after start date."]})
+        if (data['end_date'] - data['start_date']).days > 28:
+            raise serializers.ValidationError({'end_date': ["Loan duration cannot exceed 28 days."]})
+        return data
+
+
+class OnboardingImportSerializer(serializers.Serializer):
+    PASSWORDS = (
+        ('unusable', 'Ignore the password column; clients set one through the reset flow'),
+        ('hash', 'Hash the password column (slow: one full password hash per client)'),
+    )
+
+    file = serializers.FileField()
+    dry_run = serializers.BooleanField(default=False)
+    passwords = serializers.ChoiceField(choices=PASSWORDS, default='unusable')
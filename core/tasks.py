@@ -0,0 +1,21 @@
+from django.db.models import F
+from django.utils import timezone
+from jobs.queue import task
+from mifi import sharding
+from .models import IndividualLoan, GroupLoan
+
+
+@task('core.mark_overdue_loans')
+def mark_overdue_loans():
+    """Flip active loans past their end date with money still owed to overdue"""
+    today = timezone.localdate()
+    now = timezone.now()
+    marked = dict.fromkeys([model._meta.model_name for model in (IndividualLoan, GroupLoan)], 0)
+    for alias in sharding.shards():
+        for model in (IndividualLoan, GroupLoan):
+            marked[model._meta.model_name] += model.objects.using(alias).filter(
+                status='active',
+                end_date__lt=today,
+                total_due__gt=0
+            ).update(status='overdue', updated_at=now, version=F('version') + 1)
+    return marked
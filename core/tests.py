@@ -1,3 +1,594 @@
-from django.test import TestCase
+from contextlib import ExitStack
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Count, F, Q
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from archive.models import ArchivedLoan
+from ledger import journal
+from mifi import sharding
+from ledger.models import JournalEntry
+from users.models import User
+from . import counters, dashboard
+from .imports import OnboardingImport
+from .models import Collateral, GroupLoan, GroupLoanPayment, GroupMemberStatus, IndividualLoan, IndividualLoanPayment
+
+API = '/api/test/v1/'
+
+
+def make_user(role='clients', region='Lusaka', **fields):
+    make_user.count = getattr(make_user, 'count', 0) + 1
+    n = make_user.count
+    return User.objects.create_user(
+        email=f'{role}.{n}@example.com',
+        nrc_number=f'{n:06d}/10/1',
+        first_name=fields.pop('first_name', f'First{n}'),
+        last_name=fields.pop('last_name', f'Last{n}'),
+        role=role,
+        region=region,
+        **fields
+    )
+
+
+def make_individual_loan(officer, recipient=None, amount='1000.00', days=28, **fields):
+    start = fields.pop('start_date', timezone.localdate())
+    recipient = recipient or make_user()
+    # On the officer's shard, where the officer's own requests create it
+    with sharding.pinned(sharding.home_shard(officer)):
+        return IndividualLoan.objects.create(
+            loan_type='individual',
+            amount=Decimal(amount),
+            loan_officer=officer,
+            recipient=recipient,
+            first_name='Mwila',
+            last_name='Banda',
+            start_date=start,
+            end_date=start + timedelta(days=days),
+            **fields
+        )
+
+
+def make_group_loan(officer, members, amount='1000.00', days=28, **fields):
+    start = fields.pop('start_date', timezone.localdate())
+    with sharding.pinned(sharding.home_shard(officer)):
+        loan = GroupLoan.objects.create(
+            loan_type='group',
+            amount=Decimal(amount),
+            total_group_loan=Decimal(amount),
+            loan_officer=officer,
+            group_name='Tembo Women Club',
+            frequency_letter='A',
+            start_date=start,
+            end_date=start + timedelta(days=days),
+            due_date=start + timedelta(days=days),
+            **fields
+        )
+        for member in members:
+            GroupMemberStatus.objects.create(group_loan=loan, member=member, frequency_letter='A')
+    return loan
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class CollateralReviewQueueTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.client = APIClient()
+        lusaka, copperbelt = make_user('loan_officer', 'Lusaka'), make_user('loan_officer', 'Copperbelt')
+        loan = make_individual_loan(lusaka)
+        content_type = ContentType.objects.get_for_model(IndividualLoan)
+        self.pending = [
+            Collateral.objects.using(loan._state.db).create(
+                content_type=content_type, object_id=loan.pk, collateral_type='PHOTO',
+                file='collateral.jpg', uploaded_by=uploader
+            )
+            for uploader in (lusaka, lusaka, copperbelt)
+        ]
+
+    def queue(self, user, **params):
+        self.client.force_authenticate(user)
+        return self.client.get(API + 'collaterals/review-queue/', params)
+
+    def test_pages_by_keyset(self):
+        manager = make_user('manager')
+        first = self.queue(manager, limit=2).json()
+        self.assertEqual([item['id'] for item in first['results']], [c.pk for c in self.pending[:2]])
+        rest = self.queue(manager, limit=2, after=first['next_after']).json()
+        self.assertEqual([item['id'] for item in rest['results']], [self.pending[2].pk])
+        self.assertIsNone(rest['next_after'])
+
+    def test_rejects_bad_limits(self):
+        manager = make_user('manager')
+        for limit in ('0', '-1', 'ten'):
+            self.assertEqual(self.queue(manager, limit=limit).status_code, 400, limit)
+        self.assertEqual(self.queue(manager, limit=10000).status_code, 200)
+
+    def test_region_manager_sees_own_region(self):
+        response = self.queue(make_user('region_manager', 'Lusaka'))
+        self.assertEqual([item['id'] for item in response.json()['results']], [c.pk for c in self.pending[:2]])
+
+    def test_region_manager_decides_own_region_only(self):
+        self.client.force_authenticate(make_user('region_manager', 'Copperbelt'))
+        response = self.client.post(
+            API + 'collaterals/bulk-verify/', {'ids': [c.pk for c in self.pending], 'decision': 'verify'}, format='json'
+        )
+        self.assertEqual(response.json()['updated_count'], 1)
+        verified = Collateral.objects.using(self.pending[0]._state.db).filter(verified=True)
+        self.assertEqual(list(verified.values_list('pk', flat=True)), [self.pending[2].pk])
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class CollectionSheetTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.members = [make_user(), make_user()]
+        self.loan = make_group_loan(self.officer, self.members)
+        self.client = APIClient()
+        self.client.force_authenticate(self.officer)
+
+    def submit(self, *entries):
+        return self.client.post(
+            API + f'group/{self.loan.pk}/collection-sheet/',
+            {'payments': [
+                {'member_id': member.pk, 'amount': amount, 'payment_type': payment_type}
+                for member, amount, payment_type in entries
+            ]},
+            format='json'
+        )
+
+    def test_recovery_payment_needs_an_overdue_loan(self):
+        response = self.submit((self.members[0], '10.00', 'RECOVERY'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.loan.payments.exists())
+
+    def test_normal_payment_needs_an_active_loan(self):
+        GroupLoan.objects.using(self.loan._state.db).filter(pk=self.loan.pk).update(status='overdue')
+        self.assertEqual(self.submit((self.members[0], '10.00', 'NORMAL')).status_code, 400)
+        self.assertEqual(self.submit((self.members[0], '10.00', 'RECOVERY')).status_code, 201)
+
+    def test_paying_off_completes_the_loan(self):
+        response = self.submit((self.members[0], '600.00', 'NORMAL'), (self.members[1], '400.00', 'NORMAL'))
+        self.assertEqual(response.status_code, 201)
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.total_due, Decimal('0.00'))
+        self.assertEqual(self.loan.status, 'completed')
+        self.assertEqual(self.loan.payment_count, 2)
+
+    def test_payment_for_a_member_of_the_group_only(self):
+        outsider = make_user()
+        for member_id in (outsider.pk, 0):
+            response = self.client.post(
+                API + f'group/{self.loan.pk}/payments/',
+                {'loan': self.loan.pk, 'member_id': member_id, 'amount': '10.00'},
+                format='json'
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.submit((SimpleNamespace(pk=0), '10.00', 'NORMAL')).status_code, 400)
+        self.assertFalse(self.loan.payments.exists())
+
+        response = self.client.post(
+            API + f'group/{self.loan.pk}/payments/',
+            {'loan': self.loan.pk, 'member_id': self.members[0].pk, 'amount': '10.00'},
+            format='json'
+        )
+        self.assertEqual((response.status_code, response.json()['member']['id']), (201, self.members[0].pk))
+
+    def test_loans_need_existing_users(self):
+        today = timezone.localdate()
+        response = self.client.post(API + 'group/', {
+            'group_name': 'Phiri Farmers Club', 'frequency_letter': 'B', 'amount': '500.00',
+            'total_group_loan': '500.00', 'start_date': today, 'end_date': today + timedelta(days=28),
+            'due_date': today + timedelta(days=28), 'member_ids': [self.members[0].pk, 0],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('member_ids', response.json())
+        response = self.client.post(API + 'individual/', {
+            'first_name': 'Mwila', 'last_name': 'Banda', 'amount': '500.00', 'recipient_id': 0,
+            'start_date': today, 'end_date': today + timedelta(days=28),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recipient_id', response.json())
+        # Where the officer's loans go
+        with sharding.pinned(self.loan._state.db):
+            self.assertEqual(GroupLoan.objects.count() + IndividualLoan.objects.count(), 1)
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class PaymentDeleteTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.loan = make_individual_loan(self.officer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.officer)
+
+    def test_delete_reverses_the_journal_entry(self):
+        payment = self.loan.make_normal_payment(Decimal('1000.00'), self.officer)
+        self.assertEqual(self.loan.status, 'completed')
+
+        response = self.client.delete(API + f'individual/{self.loan.pk}/payments/{payment.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.total_due, self.loan.total_paid), (Decimal('1000.00'), Decimal('0.00')))
+        self.assertEqual(self.loan.status, 'active')
+        self.assertEqual(self.loan.payment_count, 0)
+        self.assertEqual(journal.balance(self.loan)['total_due'], Decimal('1000.00'))
+        reversal = JournalEntry.objects.get(entry_type='reversal')
+        self.assertEqual((reversal.payment_id, reversal.posted_by), (payment.pk, self.officer))
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class GroupMembershipSyncTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.members = [make_user() for _ in range(3)]
+        # Loan.clean() refuses updates to a loan without a photo on file
+        self.loan = make_group_loan(self.officer, self.members, photo_count=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.officer)
+
+    def sync(self, members):
+        response = self.client.patch(
+            API + f'group/{self.loan.pk}/', {'member_ids': [member.pk for member in members]},
+            format='json', HTTP_IF_MATCH='*'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_members_that_stay_keep_their_status(self):
+        statuses = {status.member_id: status for status in self.loan.groupmemberstatus_set.all()}
+        for member in self.members[:2]:
+            statuses[member.pk].is_blocked = True
+            statuses[member.pk].save()
+        newcomer = make_user()
+
+        data = self.sync([self.members[0], self.members[2], newcomer])
+        self.assertEqual((data['member_count'], data['blocked_member_count']), (3, 1))
+        kept = {status.member_id: status for status in self.loan.groupmemberstatus_set.all()}
+        self.assertEqual(set(kept), {self.members[0].pk, self.members[2].pk, newcomer.pk})
+        self.assertEqual(kept[self.members[0].pk].pk, statuses[self.members[0].pk].pk)
+        self.assertTrue(kept[self.members[0].pk].is_blocked)
+        self.assertEqual(kept[newcomer.pk].frequency_letter, self.loan.frequency_letter)
+
+    def test_cost_does_not_grow_with_the_group(self):
+        def queries(size):
+            members = [make_user() for _ in range(size)]
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in sharding.shards()]
+                self.sync(members)
+            return sum(len(queries) for queries in captured)
+
+        self.assertEqual(queries(2), queries(20))
+
+
+class GeneratePortfolioTests(TestCase):
+    databases = '__all__'
+
+    def test_small_portfolio(self):
+        call_command(
+            'generate_portfolio', clients=30, regions=3, officers=4, group_share=0.5, group_size=[2, 4],
+            seed=7, stdout=StringIO()
+        )
+        clients = set(User.objects.filter(role='clients').values_list('pk', flat=True))
+        officers = dict(User.objects.filter(role='loan_officer').values_list('pk', 'region'))
+        self.assertEqual(len(clients), 30)
+        self.assertEqual(User.objects.filter(role='region_manager').count(), 3)
+
+        borrowers, groups = set(), 0
+        for alias in sharding.shards():
+            loans = IndividualLoan.objects.using(alias)
+            group_loans = GroupLoan.objects.using(alias)
+            # Each loan with its rows on its officer's shard
+            for officer_id in {*loans.values_list('loan_officer', flat=True), *group_loans.values_list('loan_officer', flat=True)}:
+                self.assertEqual(sharding.shard_for_region(officers[officer_id]), alias)
+            borrowers.update(loans.values_list('recipient', flat=True))
+            groups += group_loans.count()
+
+            # The raw INSERTs are counted once they are done
+            miscounted = loans.annotate(payments_made=Count('payments')).exclude(payment_count=F('payments_made'))
+            self.assertFalse(miscounted.exists())
+            self.assertFalse(loans.filter(photo_count=0).exists())
+            miscounted = group_loans.annotate(
+                members_in=Count('groupmemberstatus'),
+                members_blocked=Count('groupmemberstatus', filter=Q(groupmemberstatus__is_blocked=True)),
+            ).exclude(member_count=F('members_in'), blocked_member_count=F('members_blocked'))
+            self.assertFalse(miscounted.exists())
+            self.assertFalse(group_loans.filter(member_count__lt=2).exists())
+        self.assertEqual(borrowers, clients)
+        self.assertGreater(groups, 0)
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class OnboardingImportTests(TestCase):
+    databases = '__all__'
+    header = 'email,first_name,last_name,nrc_number,date_of_birth,loan_type,amount,start_date,end_date,loan_officer,group_name,frequency_letter'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.start = timezone.localdate()
+        self.end = self.start + timedelta(days=28)
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('manager'))
+
+    def row(self, n, loan_type='', amount='', group_name='', officer=None, nrc=None):
+        loan = [amount, self.start, self.end, officer or self.officer.email] if loan_type else ['', '', '', '']
+        group = [group_name, 'A'] if group_name else ['', '']
+        return ','.join(map(str, [
+            f'client{n}@example.com', 'Chanda', f'Phiri{n}', nrc or f'{n:06d}/11/1', '1990-01-01', loan_type, *loan, *group,
+        ]))
+
+    def upload(self, rows, **data):
+        csv = '\n'.join([self.header, *rows]).encode()
+        return self.client.post(
+            API + 'imports/onboarding/', {'file': SimpleUploadedFile('branch.csv', csv), **data}, format='multipart'
+        )
+
+    def test_imports_clients_and_loans(self):
+        existing = User.objects.create_user(
+            email='client9@example.com', nrc_number='000009/11/1', first_name='Chanda', last_name='Phiri9', role='clients'
+        )
+        rows = [
+            self.row(1, 'individual', '500.00'),
+            self.row(2),
+            self.row(3, 'group', '300.00', 'Tembo Women Club'),
+            self.row(4, 'group', '200.00', 'Tembo Women Club'),
+            self.row(9, 'group', '250.00', 'Tembo Women Club'),
+        ]
+        # Batches of two: the group's members arrive in different batches
+        summary = OnboardingImport(batch_size=2).run(StringIO('\n'.join([self.header, *rows])))
+        self.assertEqual(summary['errors'], [])
+        self.assertEqual(summary['created'], {'clients': 4, 'individual_loans': 1, 'group_loans': 1, 'memberships': 3})
+        self.assertEqual(summary['existing_clients'], 1)
+
+        db = sharding.home_shard(self.officer)
+        client = User.objects.get(email='client1@example.com')
+        self.assertFalse(client.has_usable_password())
+        loan = IndividualLoan.objects.using(db).get(recipient_id=client.pk)
+        self.assertEqual((loan.amount, loan.total_due, loan.loan_officer_id), (Decimal('500.00'), Decimal('500.00'), self.officer.pk))
+        group = GroupLoan.objects.using(db).get(group_name='Tembo Women Club')
+        self.assertEqual((group.amount, group.member_count), (Decimal('750.00'), 3))
+        self.assertIn(existing.pk, set(group.groupmemberstatus_set.values_list('member_id', flat=True)))
+        self.assertEqual(journal.balance(group)['total_due'], Decimal('750.00'))
+        self.assertEqual(JournalEntry.objects.filter(entry_type='disbursement').count(), 2)
+
+    def test_any_error_rolls_back_the_file(self):
+        response = self.upload([
+            self.row(1, 'individual', '500.00'),
+            self.row(2, 'individual', '500.00', officer='nobody@example.com'),
+            self.row(3, nrc='000001/11/1'),
+            self.row(4, 'group', '300.00'),
+        ])
+        self.assertEqual(response.status_code, 400)
+        # Every failing row is reported, not just the first
+        self.assertEqual(sorted((error['row'], list(error['errors'])) for error in response.json()['errors']), [
+            (3, ['loan_officer']), (4, ['nrc_number']), (5, ['group_name', 'frequency_letter']),
+        ])
+        self.assertFalse(User.objects.filter(role='clients').exists())
+        for alias in sharding.shards():
+            self.assertFalse(IndividualLoan.objects.using(alias).exists())
+        self.assertFalse(JournalEntry.objects.exists())
+
+    def test_dry_run_reports_without_writing(self):
+        response = self.upload([self.row(1, 'individual', '500.00'), self.row(2)], dry_run='true')
+        summary = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((summary['imported'], summary['created']['clients'], summary['rows']), (False, 2, 2))
+        self.assertFalse(User.objects.filter(role='clients').exists())
+
+        response = self.upload([self.row(1, 'individual', '500.00')])
+        self.assertEqual((response.status_code, response.json()['imported']), (201, True))
+        self.assertTrue(IndividualLoan.objects.using(sharding.home_shard(self.officer)).filter(amount=500).exists())
+
+
+class LoanCountersMigrationTests(TestCase):
+    databases = '__all__'
+
+    def test_recounts_with_the_models_of_its_time(self):
+        # Shards skip RunPython, so the migration only ever recounts 'default'
+        officer = make_user('loan_officer', 'Region outside every shard')
+        members = [make_user(), make_user()]
+        loan = make_group_loan(officer, members)
+        loan.make_normal_payment(Decimal('10.00'), officer, members[0])
+        GroupMemberStatus.objects.filter(member=members[1]).update(is_blocked=True)
+        Collateral.objects.create(
+            content_type=ContentType.objects.get_for_model(GroupLoan), object_id=loan.pk,
+            collateral_type='PHOTO', file='collateral.jpg', uploaded_by=officer
+        )
+        GroupLoan.objects.update(payment_count=0, member_count=0, blocked_member_count=0, photo_count=0)
+
+        migration = import_module('core.migrations.0013_loan_counters')
+        apps = MigrationLoader(connection).project_state(('core', '0013_loan_counters')).apps
+        migration.count_existing(apps, SimpleNamespace(connection=connection))
+
+        loan.refresh_from_db()
+        self.assertEqual(
+            (loan.payment_count, loan.member_count, loan.blocked_member_count, loan.photo_count), (1, 2, 1, 1)
+        )
+
+
+class LoanCountersTests(TestCase):
+    databases = '__all__'
+
+    def collateral(self, loan, collateral_type):
+        return Collateral(
+            content_type=ContentType.objects.get_for_model(loan), object_id=loan.pk,
+            collateral_type=collateral_type, file='collateral.jpg', uploaded_by=loan.loan_officer
+        )
+
+    def test_rebuild_counts_rows_written_around_the_models(self):
+        last_paid = timezone.now() - timedelta(days=3)
+        loans = []
+        for region in ('Lusaka', 'Region outside every shard'):
+            officer = make_user('loan_officer', region)
+            members = [make_user(), make_user()]
+            loan, untouched = make_individual_loan(officer), make_individual_loan(officer)
+            group = make_group_loan(officer, members[:1])
+            db = loan._state.db
+
+            # bulk_create and update() skip the models' save() and delete(), which keep the counters
+            payments = IndividualLoanPayment.objects.using(db).bulk_create([
+                IndividualLoanPayment(loan=loan, amount=Decimal('10.00'), recorded_by=officer) for _ in range(2)
+            ])
+            IndividualLoanPayment.objects.using(db).filter(pk=payments[0].pk).update(payment_date=last_paid)
+            IndividualLoanPayment.objects.using(db).filter(pk=payments[1].pk).update(payment_date=last_paid - timedelta(days=1))
+            GroupLoanPayment.objects.using(db).bulk_create([
+                GroupLoanPayment(loan=group, member=members[0], amount=Decimal('5.00'), recorded_by=officer)
+            ])
+            GroupMemberStatus.objects.using(db).bulk_create([
+                GroupMemberStatus(group_loan=group, member=members[1], frequency_letter='A')
+            ])
+            GroupMemberStatus.objects.using(db).filter(group_loan=group, member=members[1]).update(is_blocked=True)
+            collaterals = Collateral.objects.using(db).bulk_create([
+                self.collateral(loan, 'PHOTO'), self.collateral(loan, 'PHOTO'),
+                self.collateral(loan, 'DOCUMENT'), self.collateral(group, 'VIDEO'),
+            ])
+            Collateral.objects.using(db).filter(pk=collaterals[1].pk).update(collateral_type='VIDEO')
+            # Drift on a loan with nothing to count
+            IndividualLoan.objects.using(db).filter(pk=untouched.pk).update(payment_count=3, last_payment_at=last_paid)
+            loans.append((loan, untouched, group))
+
+        self.assertEqual(counters.rebuild(chunk_size=1), {'core.IndividualLoan': 4, 'core.GroupLoan': 2})
+
+        fields = ('payment_count', 'last_payment_at', 'photo_count', 'video_count', 'document_count')
+        for loan, untouched, group in loans:
+            loan.refresh_from_db()
+            untouched.refresh_from_db()
+            group.refresh_from_db()
+            self.assertEqual([getattr(loan, field) for field in fields], [2, last_paid, 1, 1, 1])
+            self.assertEqual([getattr(untouched, field) for field in fields], [0, None, 0, 0, 0])
+            self.assertEqual(
+                [getattr(group, field) for field in (*fields, 'member_count', 'blocked_member_count')],
+                [1, group.payments.get().payment_date, 0, 1, 0, 2, 1]
+            )
+
+
+class DashboardTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        # 250.00 falls due every Thursday from 8 October 2026
+        self.loan = make_individual_loan(self.officer, start_date=date(2026, 10, 1), repayment_frequency='weekly')
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+    def summary(self, today):
+        with sharding.pinned(sharding.home_shard(self.officer)):
+            return dashboard.officer_summary(self.officer, today)
+
+    def pay(self, amount, day):
+        payment = self.loan.make_normal_payment(Decimal(amount), self.officer)
+        paid_at = timezone.make_aware(datetime.combine(day, time(12)))
+        type(payment).objects.using(payment._state.db).filter(pk=payment.pk).update(payment_date=paid_at)
+
+    def test_dues_run_to_the_end_of_the_week(self):
+        dues = {}
+        for today in (date(2026, 10, 14), date(2026, 10, 18), date(2026, 10, 19)):
+            summary = self.summary(today)
+            dues[today] = (summary['due_today'], summary['due_this_week'])
+        self.assertEqual(dues, {
+            # Wednesday: Thursday's instalment is due by Sunday
+            date(2026, 10, 14): ('250.00', '500.00'),
+            # Sunday ends its own week
+            date(2026, 10, 18): ('500.00', '500.00'),
+            # Monday starts the next one
+            date(2026, 10, 19): ('500.00', '750.00'),
+        })
+
+        self.pay('300.00', date(2026, 10, 19))
+        summary = self.summary(date(2026, 10, 19))
+        self.assertEqual((summary['due_today'], summary['due_this_week']), ('200.00', '450.00'))
+        self.assertEqual((summary['collected_today'], summary['payments_today']), ('300.00', 1))
+        self.assertEqual(self.summary(date(2026, 10, 20))['payments_today'], 0)
+
+    def test_archived_loans_count_as_completed(self):
+        ArchivedLoan.objects.create(
+            content_type=ContentType.objects.get_for_model(IndividualLoan), object_id=10 ** 15,
+            loan_officer=self.officer, amount=Decimal('500.00'), completed_at=timezone.now(), data={}
+        )
+        loans = self.summary(date(2026, 10, 14))['loans']
+        self.assertEqual((loans['individual']['active'], loans['individual']['completed']), (1, 1))
+        self.assertEqual(loans['group']['completed'], 0)
+
+    def test_cached_summary_starts_afresh_at_midnight(self):
+        def cached(today):
+            with mock.patch('core.dashboard.timezone.localdate', return_value=today):
+                with sharding.pinned(sharding.home_shard(self.officer)):
+                    return dashboard.cached_summary(self.officer)
+
+        self.assertEqual(cached(date(2026, 10, 19))['payments_today'], 0)
+        self.pay('100.00', date(2026, 10, 19))
+        self.assertEqual(cached(date(2026, 10, 19))['payments_today'], 0)
+        tomorrow = cached(date(2026, 10, 20))
+        self.assertEqual((tomorrow['date'], tomorrow['collected_today']), ('2026-10-20', '0.00'))
+        self.assertEqual(tomorrow['due_today'], '400.00')
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class ConditionalUpdateTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        # Loan.clean() refuses updates to a loan without a photo on file
+        self.loan = make_individual_loan(self.officer, photo_count=1)
+        self.url = API + f'individual/{self.loan.pk}/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.officer)
+
+    def rename(self, first_name, **headers):
+        return self.client.patch(self.url, {'first_name': first_name}, format='json', **headers)
+
+    def test_reads_and_writes_carry_the_version(self):
+        self.assertEqual(self.client.get(self.url)['ETag'], '"1"')
+        response = self.rename('Chanda', HTTP_IF_MATCH='"1"')
+        self.assertEqual((response.status_code, response['ETag']), (200, '"2"'))
+
+    def test_update_without_a_version_is_refused(self):
+        self.assertEqual(self.rename('Chanda').status_code, 428)
+        self.assertEqual(self.rename('Chanda', HTTP_IF_MATCH='one').status_code, 400)
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.first_name, self.loan.version), ('Mwila', 1))
+
+    def test_stale_version_gets_the_current_one(self):
+        self.rename('Chanda', HTTP_IF_MATCH='"1"')
+        response = self.rename('Bwalya', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual((response.json()['version'], response['ETag']), (2, '"2"'))
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.first_name, 'Chanda')
+
+        # The version may come in the body instead, and * overrides the check
+        response = self.client.patch(self.url, {'first_name': 'Bwalya', 'version': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rename('Mutale', HTTP_IF_MATCH='*').status_code, 200)
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.first_name, self.loan.version), ('Mutale', 4))
+
+    def test_stale_membership_block_is_refused(self):
+        membership = make_group_loan(self.officer, [make_user()]).groupmemberstatus_set.get()
+        url = API + f'group-members/{membership.pk}/'
+        self.assertEqual(self.client.patch(url, {'is_blocked': True}, format='json', HTTP_IF_MATCH='"1"').status_code, 200)
+        response = self.client.patch(url, {'is_blocked': False}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 412)
+        membership.refresh_from_db()
+        self.assertTrue(membership.is_blocked)
@@ -1,25 +1,39 @@
+import io
+from collections import Counter
+from django.db.models import Q
 from django.forms import ValidationError
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from users.models import User
-from .models import Collateral, GroupLoanPayment, IndividualLoan, GroupLoan, GroupMemberStatus, IndividualLoanPayment
-from .serializers import CollateralSerializer, GroupLoanPaymentSerializer, IndividualLoanPaymentSerializer, IndividualLoanSerializer, GroupLoanSerializer, GroupMemberStatusSerializer
+from .models import COLLATERAL_COUNTERS, Collateral, GroupLoanPayment, IndividualLoan, GroupLoan, GroupMemberStatus, IndividualLoanPayment, bump_counters
+from .serializers import CollateralReviewDecisionSerializer, CollateralReviewSerializer, CollateralSerializer, CollectionSheetMemberSerializer, CollectionSheetSerializer, GroupLoanPaymentSerializer, IndividualLoanPaymentSerializer, IndividualLoanSerializer, GroupLoanSerializer, GroupMemberStatusSerializer, OnboardingImportSerializer
+from .imports import OnboardingImport
+from . import dashboard
 from .permissions import IsLoanOfficerOrHigher
+from .preconditions import ConditionalUpdateMixin
+from users.permissions import IsManagerOrHigher, IsRegionManagerOrHigher
 from core import serializers
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, PermissionDenied
 from django.contrib.contenttypes.models import ContentType
 from rest_framework.response import Response
 from rest_framework import status
 
 from core import models
+from archive.mixins import ArchivedLoanMixin, ArchivedPaymentsMixin
+from idempotency.mixins import IdempotentCreateMixin
+from mifi import metrics, sharding
+from mifi.sparse import SparseQuerysetMixin
+from outbox import events
 
-class IndividualLoanViewSet(viewsets.ModelViewSet):
+class IndividualLoanViewSet(IdempotentCreateMixin, ConditionalUpdateMixin, SparseQuerysetMixin, ArchivedLoanMixin, sharding.ShardedViewMixin, viewsets.ModelViewSet):
     queryset = IndividualLoan.objects.all().order_by('-created_at')
     serializer_class = IndividualLoanSerializer
     permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
+    shard_lookup = ('pk', IndividualLoan)
 
     def perform_create(self, serializer):
         serializer.save(loan_officer=self.request.user)
@@ -35,17 +49,17 @@ class IndividualLoanViewSet(viewsets.ModelViewSet):
         else:
             # For regular users, show loans where they're either officer OR recipient
             return IndividualLoan.objects.filter(
-                models.Q(loan_officer=user) | 
-                models.Q(recipient=user)
-                .order_by('-created_at')
-            )
+                Q(loan_officer=user) | 
+                Q(recipient=user)
+            ).order_by('-created_at')
         
 
                 
-class GroupLoanViewSet(viewsets.ModelViewSet):
+class GroupLoanViewSet(IdempotentCreateMixin, ConditionalUpdateMixin, SparseQuerysetMixin, ArchivedLoanMixin, sharding.ShardedViewMixin, viewsets.ModelViewSet):
     queryset = GroupLoan.objects.all().order_by('-created_at')
     serializer_class = GroupLoanSerializer
     permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
+    shard_lookup = ('pk', GroupLoan)
 
     def perform_create(self, serializer):
         try:
@@ -62,10 +76,11 @@ class GroupLoanViewSet(viewsets.ModelViewSet):
         else:
             return self.queryset.filter(members=user)
 
-class GroupMemberStatusViewSet(viewsets.ModelViewSet):
+class GroupMemberStatusViewSet(IdempotentCreateMixin, ConditionalUpdateMixin, SparseQuerysetMixin, sharding.ShardedViewMixin, viewsets.ModelViewSet):
     serializer_class = GroupMemberStatusSerializer
     permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
     queryset = GroupMemberStatus.objects.all().order_by('-blocked_at')
+    shard_lookup = ('pk', GroupMemberStatus)
     
     def get_queryset(self):
         user = self.request.user
@@ -91,7 +106,13 @@ class GroupMemberStatusViewSet(viewsets.ModelViewSet):
             else:
                 serializer.validated_data['blocked_by'] = None
                 serializer.validated_data['blocked_at'] = None
-        serializer.save()
+        was_blocked = serializer.instance.is_blocked
+        with sharding.atomic():
+            membership = serializer.save()
+            if membership.is_blocked != was_blocked:
+                events.members_blocked(
+                    [(membership.group_loan_id, membership.member_id)], membership.is_blocked, self.request.user
+                )
 
 class IndividualLoanPaymentViewSet(viewsets.ModelViewSet):
     serializer_class = IndividualLoanPaymentSerializer
@@ -136,9 +157,11 @@ class GroupLoanPaymentViewSet(viewsets.ModelViewSet):
     #     serializer = GroupLoanPaymentSerializer(payments, many=True)
     #     return Response(serializer.data)
 
-class IndividualLoanPaymentViewSet(viewsets.ModelViewSet):
+class IndividualLoanPaymentViewSet(IdempotentCreateMixin, SparseQuerysetMixin, ArchivedPaymentsMixin, sharding.ShardedViewMixin, viewsets.ModelViewSet):
     serializer_class = IndividualLoanPaymentSerializer
     permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
+    shard_lookup = ('loan_id', IndividualLoan)
+    write_throttle_scope = 'payments'
     
     def get_queryset(self):
         loan_id = self.kwargs.get('loan_id')
@@ -149,19 +172,32 @@ class IndividualLoanPaymentViewSet(viewsets.ModelViewSet):
         amount = serializer.validated_data['amount']
         payment_type = serializer.validated_data.get('payment_type', 'NORMAL')
         
-        if payment_type == 'ADVANCE':
-            payment = loan.make_advance_payment(amount, self.request.user)
-        elif payment_type == 'RECOVERY':
-            payment = loan.make_recovery_payment(amount, self.request.user)
-        else:
-            payment = loan.make_normal_payment(amount, self.request.user)
-            
+        try:
+            if payment_type == 'ADVANCE':
+                payment = loan.make_advance_payment(amount, self.request.user)
+            elif payment_type == 'RECOVERY':
+                payment = loan.make_recovery_payment(amount, self.request.user)
+            else:
+                payment = loan.make_normal_payment(amount, self.request.user)
+        except ValidationError as e:
+            metrics.inc('mifi_payment_failures_total', kind='individual')
+            raise serializers.ValidationError({'detail': e.messages})
+        except Exception:
+            metrics.inc('mifi_payment_failures_total', kind='individual')
+            raise
+
+        metrics.inc_on_commit('mifi_payments_posted_total', kind='individual')
         serializer.instance = payment
+
+    def perform_destroy(self, instance):
+        instance.delete(deleted_by=self.request.user)
     
 
-class GroupLoanPaymentViewSet(viewsets.ModelViewSet):
+class GroupLoanPaymentViewSet(IdempotentCreateMixin, SparseQuerysetMixin, ArchivedPaymentsMixin, sharding.ShardedViewMixin, viewsets.ModelViewSet):
     serializer_class = GroupLoanPaymentSerializer
     permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
+    shard_lookup = ('loan_id', GroupLoan)
+    write_throttle_scope = 'payments'
     
     def get_queryset(self):
         loan_id = self.kwargs.get('loan_id')
@@ -169,23 +205,111 @@ class GroupLoanPaymentViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         loan = get_object_or_404(GroupLoan, pk=self.kwargs.get('loan_id'))
-        member = get_object_or_404(User, pk=serializer.validated_data['member_id'])
+        member_id = serializer.validated_data.pop('member_id')
+        if not loan.groupmemberstatus_set.filter(member_id=member_id).exists():
+            raise serializers.ValidationError({'member_id': f"Member {member_id} does not belong to this group."})
+        member = User.objects.get(pk=member_id)
         amount = serializer.validated_data['amount']
         payment_type = serializer.validated_data.get('payment_type', 'NORMAL')
         
-        if payment_type == 'ADVANCE':
-            payment = loan.make_advance_payment(amount, self.request.user, member)
-        elif payment_type == 'RECOVERY':
-            payment = loan.make_recovery_payment(amount, self.request.user, member)
-        else:
-            payment = loan.make_normal_payment(amount, self.request.user, member)
-            
+        try:
+            if payment_type == 'ADVANCE':
+                payment = loan.make_advance_payment(amount, self.request.user, member)
+            elif payment_type == 'RECOVERY':
+                payment = loan.make_recovery_payment(amount, self.request.user, member)
+            else:
+                payment = loan.make_normal_payment(amount, self.request.user, member)
+        except ValidationError as e:
+            metrics.inc('mifi_payment_failures_total', kind='group')
+            raise serializers.ValidationError({'detail': e.messages})
+        except Exception:
+            metrics.inc('mifi_payment_failures_total', kind='group')
+            raise
+
+        metrics.inc_on_commit('mifi_payments_posted_total', kind='group')
         serializer.instance = payment
+
+    def perform_destroy(self, instance):
+        instance.delete(deleted_by=self.request.user)
     
-class CollateralViewSet(viewsets.ModelViewSet):
+class GroupCollectionSheetViewSet(IdempotentCreateMixin, sharding.ShardedViewMixin, viewsets.ViewSet):
+    """One read and one write per group meeting instead of a POST per member"""
+    permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
+    shard_lookup = ('loan_id', GroupLoan)
+    write_throttle_scope = 'payments'
+
+    def get_loan(self):
+        user = self.request.user
+        queryset = GroupLoan.objects.all()
+        if user.role == 'loan_officer':
+            queryset = queryset.filter(loan_officer=user)
+        elif user.role not in ['superuser', 'manager', 'region_manager']:
+            queryset = queryset.filter(members=user)
+        return get_object_or_404(queryset, pk=self.kwargs.get('loan_id'))
+
+    def get_sheet(self, loan):
+        return {
+            'loan_id': loan.id,
+            'group_name': loan.group_name,
+            'total_due': str(loan.total_due),
+            'total_paid': str(loan.total_paid),
+            'members': CollectionSheetMemberSerializer(loan.collection_sheet(), many=True).data,
+        }
+
+    def list(self, request, loan_id=None):
+        return Response(self.get_sheet(self.get_loan()))
+
+    def create(self, request, loan_id=None):
+        loan = self.get_loan()
+        serializer = CollectionSheetSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        entries = serializer.validated_data['payments']
+        try:
+            loan.record_collection_sheet(entries, request.user)
+        except ValidationError as e:
+            metrics.inc('mifi_payment_failures_total', len(entries), kind='group')
+            raise serializers.ValidationError({'detail': e.messages})
+
+        metrics.inc_on_commit('mifi_payments_posted_total', len(entries), kind='group')
+
+        return Response(self.get_sheet(loan), status=status.HTTP_201_CREATED)
+
+class OfficerDashboardViewSet(viewsets.ViewSet):
+    """
+    Loan counts, dues, collections and blocked members for one loan officer.
+    Officers get their own; managers choose one with ?officer=<id>, region
+    managers within their region.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_officer(self):
+        user = self.request.user
+        officer_id = self.request.query_params.get('officer')
+        if user.role == 'loan_officer' or (not officer_id and user.role in ['region_manager', 'manager', 'superuser']):
+            return user
+        if user.role not in ['region_manager', 'manager', 'superuser']:
+            raise PermissionDenied("Only loan officers and managers have a dashboard.")
+        queryset = User.objects.filter(role='loan_officer')
+        if user.role == 'region_manager':
+            queryset = queryset.filter(region=user.region)
+        return get_object_or_404(queryset, pk=officer_id)
+
+    def list(self, request):
+        officer = self.get_officer()
+        with sharding.pinned(sharding.home_shard(officer)):
+            return Response(dashboard.cached_summary(officer))
+
+class CollateralViewSet(IdempotentCreateMixin, SparseQuerysetMixin, sharding.ShardedViewMixin, viewsets.ModelViewSet):
     serializer_class = CollateralSerializer
     permission_classes = [IsAuthenticated]
     queryset = Collateral.objects.all()
+    shard_lookup = ('pk', Collateral)
+
+    def get_permissions(self):
+        if self.action in ('review_queue', 'bulk_verify'):
+            return [IsAuthenticated(), IsRegionManagerOrHigher()]
+        return super().get_permissions()
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -244,19 +368,97 @@ class CollateralViewSet(viewsets.ModelViewSet):
         content_type = ContentType.objects.get_for_model(model)
         
         # Update collaterals
-        updated = Collateral.objects.filter(
+        unattached = Collateral.objects.filter(
             id__in=collateral_ids,
             content_type__isnull=True,  # Only attach unattached collaterals
             object_id__isnull=True
-        ).update(
-            content_type=content_type,
-            object_id=loan_id
         )
+        with sharding.atomic():
+            types = Counter(unattached.select_for_update().values_list('collateral_type', flat=True))
+            updated = unattached.update(
+                content_type=content_type,
+                object_id=loan_id
+            )
+            bump_counters(model, loan.pk, **{
+                COLLATERAL_COUNTERS[collateral_type]: count for collateral_type, count in types.items()
+                if collateral_type in COLLATERAL_COUNTERS
+            })
         
         return Response({
             'status': f'Attached {updated} collaterals to loan',
             'attached_count': updated
         })
+
+    def pending_review(self):
+        """Unverified, unrejected collateral; a region manager's is what their region uploaded."""
+        queryset = Collateral.objects.filter(verified=False, rejected=False)
+        user = self.request.user
+        if user.role == 'region_manager':
+            uploaders = User.objects.filter(region=user.region).values('pk')
+            if sharding.crosses(Collateral, User):
+                uploaders = list(uploaders.values_list('pk', flat=True))
+            queryset = queryset.filter(uploaded_by__in=uploaders)
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def review_queue(self, request):
+        """
+        Unverified, unrejected collateral, oldest first, paged by keyset:
+        pass the returned `next_after` back as `?after=` to get the next page.
+        """
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = min(int(request.query_params.get('limit', 100)), 500)
+        except ValueError:
+            return Response(
+                {'error': 'after and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if limit < 1:
+            return Response(
+                {'error': 'limit must be at least 1'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.pending_review().filter(id__gt=after)
+
+        collateral_type = request.query_params.get('collateral_type')
+        if collateral_type:
+            queryset = queryset.filter(collateral_type=collateral_type.upper())
+
+        # Reviewers are managers: the queue is every shard's, merged by id
+        queryset = queryset.order_by('id')
+        page = sharding.merged([queryset.using(alias)[:limit] for alias in sharding.shards()])[:limit]
+        serializer = CollateralReviewSerializer(page, many=True, context={'request': request})
+
+        return Response({
+            'results': serializer.data,
+            'next_after': page[-1].id if len(page) == limit else None
+        })
+
+    @action(detail=False, methods=['post'])
+    def bulk_verify(self, request):
+        serializer = CollateralReviewDecisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        decision = serializer.validated_data['decision']
+
+        # Only pending items are touched, so replaying a decision is harmless
+        updated = sum(
+            self.pending_review().using(alias).filter(id__in=ids).update(
+                verified=decision == 'verify',
+                rejected=decision == 'reject',
+                verified_by=request.user,
+                verified_at=timezone.now()
+            )
+            for alias in sharding.shards()
+        )
+
+        return Response({
+            'decision': decision,
+            'updated_count': updated,
+            'skipped_count': len(set(ids)) - updated
+        })
     
 class LoanTypeViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
@@ -277,4 +479,30 @@ class CollateralTypeViewSet(viewsets.ModelViewSet):
             {'value': 'VIDEO', 'label': 'Video'},
             {'value': 'DOCUMENT', 'label': 'Document'},
         ]
-        return Response(loan_types)
\ No newline at end of file
+        return Response(loan_types)
+
+class OnboardingImportViewSet(IdempotentCreateMixin, viewsets.ViewSet):
+    """
+    Upload a branch CSV of clients and loans. The file is streamed from the
+    upload's temporary file, so large spreadsheets are not held in memory;
+    very large migrations are better run with the import_onboarding command.
+    """
+    permission_classes = [IsAuthenticated, IsManagerOrHigher]
+    parser_classes = [MultiPartParser]
+
+    def create(self, request):
+        serializer = OnboardingImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        lines = io.TextIOWrapper(data['file'].file, encoding='utf-8-sig', newline='')
+        try:
+            result = OnboardingImport(passwords=data['passwords']).run(lines, dry_run=data['dry_run'])
+        except UnicodeDecodeError:
+            raise serializers.ValidationError({'file': ["The file must be UTF-8 encoded CSV."]})
+        finally:
+            lines.detach()
+
+        if result['errors']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK if result['dry_run'] else status.HTTP_201_CREATED)
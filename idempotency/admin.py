@@ -0,0 +1,20 @@
+from django.contrib import admin
+
+from .models import IdempotencyKey
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'response_status', 'locked_at', 'created_at')
+    list_filter = ('response_status',)
+    list_select_related = ('user',)
+    search_fields = ('=key',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('user', 'key', 'fingerprint', 'locked_at', 'response_status', 'response_body',
+                       'response_headers', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from idempotency.store import purge
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored Idempotency-Key responses older than --hours (default IDEMPOTENCY['TTL_HOURS']). "
+        "Retries with a purged key run as new requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int)
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per DELETE")
+
+    def handle(self, *args, **options):
+        if options['hours'] is not None and options['hours'] < 0:
+            raise CommandError("--hours cannot be negative")
+        purged = purge(hours=options['hours'], chunk_size=options['chunk_size'])
+        self.stdout.write(f"{purged} idempotency keys purged")
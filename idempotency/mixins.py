@@ -0,0 +1,50 @@
+from mifi import sharding
+
+from . import store
+
+
+class Replay(Exception):
+    def __init__(self, record):
+        self.record = record
+
+
+class IdempotentCreateMixin:
+    """
+    Viewsets: a create request sent with an Idempotency-Key header runs at
+    most once per user and key; retries get the first response back.
+    """
+    idempotent_actions = ('create',)
+    idempotency_record = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        key = request.headers.get(store.HEADER)
+        if key is None or self.action not in self.idempotent_actions:
+            return
+        record, claimed = store.claim(request, key)
+        if not claimed:
+            raise Replay(record)
+        self.idempotency_record = record
+        # The work and its recorded response commit together
+        method = request.method.lower()
+        setattr(self, method, self.recorded(getattr(self, method)))
+
+    def recorded(self, handler):
+        def run(request, *args, **kwargs):
+            with sharding.atomic():
+                response = handler(request, *args, **kwargs)
+                if response.status_code < 400:
+                    store.save(self.idempotency_record, response)
+            return response
+        return run
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return store.replay(exc.record)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        record = self.idempotency_record
+        if record is not None and record.response_status is None:
+            store.release(record)
+        return super().finalize_response(request, response, *args, **kwargs)
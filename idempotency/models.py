@@ -0,0 +1,26 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+class IdempotencyKey(models.Model):
+    """
+    An Idempotency-Key a user sent with a create request: held while the
+    request runs, then the response every retry with the key is answered with.
+    """
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="Hash of the method, path and body first sent with the key")
+    locked_at = models.DateTimeField(help_text="When the request holding the key started")
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.response_status or 'in progress'})"
@@ -0,0 +1,143 @@
+"""
+Idempotency keys for create requests sent over networks that drop replies.
+
+The first request with a key claims it with an INSERT, which the unique
+(user, key) index lets only one request win. The winner runs the work and
+saves its response in the same transaction, so the key records a response
+exactly when the work committed. Retries with the key get that response
+back without the work running again; a retry that arrives while the first
+request is still running gets a 409, and one with a different body a 422.
+
+Failed requests (4xx and 5xx) change nothing and release the key, so the
+client can correct the request and send it again under the same key. A
+request that dies without releasing its key holds it for LOCK_SECONDS,
+after which a retry may take it over; should the first request still
+finish, it finds its claim gone and rolls back. Keys are kept for
+TTL_HOURS and then purged.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+# Response headers worth replaying; the rest are set again on the way out
+REPLAYED_HEADERS = ['Location']
+
+
+def _setting(name, default):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, default)
+
+
+class KeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still being processed."
+    default_code = 'idempotency_key_in_use'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used for a different request."
+    default_code = 'idempotency_key_reused'
+
+
+def _value(value):
+    if isinstance(value, UploadedFile):
+        return [value.name, value.size]
+    return value
+
+
+def fingerprint(request):
+    """Hash of what the request asks for: method, path and parsed body."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: [_value(value) for value in values] for key, values in data.lists()}
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def claim(request, key):
+    """
+    (record, claimed): a new claim on `key` for this request, or the
+    finished record of an earlier request to replay.
+    """
+    if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        raise ValidationError({HEADER: ["Must be 1 to 255 characters."]})
+    digest = fingerprint(request)
+    for attempt in range(3):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user, key=key, fingerprint=digest, locked_at=now
+                )
+            return record, True
+        except IntegrityError:
+            pass
+
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is None:
+            # Released or purged since the INSERT: try again
+            continue
+        if record.created_at < now - timedelta(hours=_setting('TTL_HOURS', 24)):
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+        if record.fingerprint != digest:
+            raise KeyReused()
+        if record.response_status is not None:
+            return record, False
+
+        stale = now - timedelta(seconds=_setting('LOCK_SECONDS', 300))
+        taken_over = IdempotencyKey.objects.filter(
+            pk=record.pk, response_status__isnull=True, locked_at__lt=stale
+        ).update(locked_at=now)
+        if not taken_over:
+            raise KeyInUse()
+        record.locked_at = now
+        return record, True
+    raise KeyInUse()
+
+
+def save(record, response):
+    """Store the response on the claim; call in the transaction that did the work."""
+    headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    saved = IdempotencyKey.objects.filter(
+        pk=record.pk, locked_at=record.locked_at, response_status__isnull=True
+    ).update(response_status=response.status_code, response_body=response.data, response_headers=headers)
+    if not saved:
+        # Taken over by a retry after LOCK_SECONDS: that one does the work
+        raise KeyInUse()
+    record.response_status = response.status_code
+
+
+def release(record):
+    """Give the key up after a failed request, unless a retry has taken it over."""
+    IdempotencyKey.objects.filter(pk=record.pk, locked_at=record.locked_at, response_status__isnull=True).delete()
+
+
+def replay(record):
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        headers={**record.response_headers, 'Idempotent-Replayed': 'true'},
+    )
+
+
+def purge(hours=None, chunk_size=5000):
+    """Delete keys older than `hours` (default TTL_HOURS), `chunk_size` rows per statement. Returns how many."""
+    before = timezone.now() - timedelta(hours=_setting('TTL_HOURS', 24) if hours is None else hours)
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=before).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,7 @@
+from jobs.queue import task
+from .store import purge
+
+
+@task('idempotency.purge')
+def purge_keys(hours=None):
+    return purge(hours=hours)
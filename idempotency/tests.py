@@ -0,0 +1,67 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.tests import API, make_individual_loan, make_user
+from .models import IdempotencyKey
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class IdempotencyKeyTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.loan = make_individual_loan(self.officer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.officer)
+
+    def pay(self, amount, key='key-1'):
+        return self.client.post(
+            API + f'individual/payments/{self.loan.pk}/',
+            {'loan': self.loan.pk, 'amount': amount, 'payment_type': 'NORMAL'},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_gets_the_first_response(self):
+        first = self.pay('100.00')
+        self.assertEqual(first.status_code, 201)
+        retry = self.pay('100.00')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.loan.payments.count(), 1)
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.total_paid, Decimal('100.00'))
+
+    def test_key_is_per_user(self):
+        self.pay('100.00')
+        self.client.force_authenticate(make_user('loan_officer'))
+        self.pay('100.00')
+        self.assertEqual(IdempotencyKey.objects.filter(key='key-1').count(), 2)
+
+    def test_different_body_is_rejected(self):
+        self.pay('100.00')
+        self.assertEqual(self.pay('200.00').status_code, 422)
+        self.assertEqual(self.loan.payments.count(), 1)
+
+    def test_failed_request_releases_the_key(self):
+        self.assertEqual(self.pay('5000.00').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.pay('100.00').status_code, 201)
+
+    def test_key_in_use(self):
+        self.pay('100.00', key='done')
+        held = IdempotencyKey.objects.get(key='done')
+        IdempotencyKey.objects.create(
+            user=self.officer, key='key-1', fingerprint=held.fingerprint, locked_at=timezone.now()
+        )
+        self.assertEqual(self.pay('100.00').status_code, 409)
+
+        # Held past LOCK_SECONDS by a request that died: a retry takes it over
+        IdempotencyKey.objects.filter(key='key-1').update(locked_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(self.pay('100.00').status_code, 201)
+        self.assertEqual(self.loan.payments.count(), 2)
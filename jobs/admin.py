@@ -0,0 +1,19 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name',)
+    readonly_fields = ('created_at', 'locked_by', 'locked_at', 'finished_at', 'last_error', 'result')
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected jobs")
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=timezone.now(), locked_by=None, locked_at=None
+        )
+        self.message_user(request, f"Requeued {updated} jobs.")
@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = "Queue a registered background task, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Registered task name")
+        parser.add_argument('--payload', default='{}', help="JSON object passed to the task as keyword arguments")
+        parser.add_argument('--priority', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            payload = json.loads(options['payload'])
+        except ValueError as e:
+            raise CommandError(f"--payload is not valid JSON: {e}")
+
+        try:
+            job = queue.enqueue(options['name'], payload, priority=options['priority'])
+        except LookupError as e:
+            raise CommandError(f"{e}. Registered: {', '.join(queue.registered_tasks())}")
+
+        self.stdout.write(f"Queued {job}")
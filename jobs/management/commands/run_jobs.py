@@ -0,0 +1,85 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from jobs import queue
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Number of worker threads")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is drained instead of polling forever")
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+
+        queue.requeue_stale()
+
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(f"{prefix}:{i}", options['poll_interval'], options['burst']),
+                daemon=True,
+            )
+            for i in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+
+        self.stdout.write(f"Started {len(threads)} job workers ({', '.join(queue.registered_tasks())})")
+
+        while any(thread.is_alive() for thread in threads):
+            if self.stop.wait(timeout=60):
+                break
+            queue.requeue_stale()
+
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write("Job workers stopped")
+
+    def work(self, worker_id, poll_interval, burst):
+        try:
+            while not self.stop.is_set():
+                try:
+                    jobs = queue.claim(worker_id)
+                except Exception:
+                    # e.g. "database is locked": the worker carries on with a fresh connection
+                    logger.exception("Worker %s could not claim jobs", worker_id)
+                    connection.close()
+                    self.stop.wait(poll_interval)
+                    continue
+                if not jobs:
+                    if burst:
+                        return
+                    self.stop.wait(poll_interval)
+                    continue
+
+                for job in jobs:
+                    started = time.monotonic()
+                    try:
+                        ok = queue.run(job)
+                    except Exception:
+                        # The outcome was not recorded; requeue_stale hands the job back once its lock expires
+                        logger.exception("Worker %s could not record job %s (%s)", worker_id, job.pk, job.name)
+                        connection.close()
+                        continue
+                    self.stdout.write(
+                        f"[{worker_id}] {job.name} #{job.pk} "
+                        f"{'succeeded' if ok else 'failed'} in {time.monotonic() - started:.2f}s"
+                    )
+        finally:
+            connection.close()
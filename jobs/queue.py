@@ -0,0 +1,178 @@
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def _setting(name, default):
+    return getattr(settings, 'JOB_QUEUE', {}).get(name, default)
+
+
+def task(name, max_attempts=None):
+    """
+    Register a function as a background task under `name`. The function gets
+    the job payload as keyword arguments; whatever JSON-serialisable value it
+    returns is stored on the job. `fn.enqueue(**payload)` queues a run.
+    """
+    def decorator(fn):
+        if name in _registry:
+            raise ValueError(f"Task {name} is already registered")
+        _registry[name] = fn
+
+        def enqueue_task(priority=0, run_at=None, **payload):
+            return enqueue(name, payload, priority=priority, run_at=run_at, max_attempts=max_attempts)
+
+        fn.task_name = name
+        fn.enqueue = enqueue_task
+        return fn
+    return decorator
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f"No task registered as {name}")
+
+
+def registered_tasks():
+    return sorted(_registry)
+
+
+def enqueue(name, payload=None, priority=0, run_at=None, max_attempts=None):
+    """
+    Queue a job. When called inside a transaction the job only becomes
+    visible to workers once that transaction commits, so it never runs
+    against rows the caller has not written yet.
+    """
+    get_task(name)
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or _setting('MAX_ATTEMPTS', 5),
+    )
+
+
+def claim(worker_id, limit=1):
+    """
+    Atomically take up to `limit` due jobs for `worker_id`.
+
+    Backends with SKIP LOCKED (PostgreSQL, MySQL 8) lock candidate rows and
+    skip the ones other workers hold. SQLite has no row locks, so each
+    candidate is taken with a compare-and-set UPDATE guarded on
+    status='queued'; a worker that loses the race simply moves to the next
+    candidate.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('-priority', 'run_at', 'id')
+    running = dict(status='running', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(**running)
+    else:
+        ids = []
+        for job_id in due.values_list('id', flat=True)[:limit * 4]:
+            if Job.objects.filter(id=job_id, status='queued').update(**running):
+                ids.append(job_id)
+                if len(ids) == limit:
+                    break
+
+    return list(Job.objects.filter(id__in=ids).order_by('-priority', 'run_at', 'id'))
+
+
+def backoff(attempts):
+    """Exponential retry delay: base, 2x base, 4x base ... capped at max."""
+    base = _setting('RETRY_BACKOFF_SECONDS', 30)
+    cap = _setting('RETRY_BACKOFF_MAX_SECONDS', 3600)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Renew the job's lock every LOCK_TIMEOUT_SECONDS / 3 while the block runs,
+    from a thread of its own, so requeue_stale only takes back jobs whose
+    worker has gone, however long they legitimately run.
+    """
+    done = threading.Event()
+    interval = _setting('LOCK_TIMEOUT_SECONDS', 900) / 3
+
+    def beat():
+        try:
+            while not done.wait(interval):
+                try:
+                    Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status='running').update(locked_at=timezone.now())
+                except Exception:
+                    # e.g. SQLite busy with the job's own writes; the next beat tries again
+                    logger.warning("Could not renew the lock of job %s (%s)", job.pk, job.name, exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def run(job):
+    """Execute one claimed job, keeping its lock fresh while it runs, and record the outcome."""
+    try:
+        with heartbeat(job):
+            result = get_task(job.name)(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Job %s (%s) failed on attempt %s", job.pk, job.name, job.attempts, exc_info=True)
+
+        if job.attempts < job.max_attempts:
+            changes = dict(status='queued', run_at=timezone.now() + backoff(job.attempts))
+        else:
+            changes = dict(status='failed', finished_at=timezone.now())
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            last_error=error, locked_by=None, locked_at=None, **changes
+        )
+        return False
+
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status='succeeded', result=result, finished_at=timezone.now(), locked_by=None, locked_at=None
+    )
+    return True
+
+
+def requeue_stale():
+    """
+    Hand back jobs whose worker died mid-run: a running job's lock is renewed
+    by its heartbeat, so one older than LOCK_TIMEOUT_SECONDS has no worker.
+    A job that has used up its attempts fails instead. Returns how many
+    were requeued.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=_setting('LOCK_TIMEOUT_SECONDS', 900)))
+    released = dict(locked_by=None, locked_at=None, last_error="The worker stopped before the job finished.")
+    stale.filter(attempts__gte=F('max_attempts')).update(status='failed', finished_at=now, **released)
+    return stale.update(status='queued', run_at=now, **released)
+
+
+def queue_depth():
+    """Number of queued jobs per task name (due or not)."""
+    return dict(
+        Job.objects.filter(status='queued').values_list('name').annotate(count=Count('id')).order_by()
+    )
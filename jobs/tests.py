@@ -0,0 +1,62 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import queue
+from .management.commands.run_jobs import Command
+from .models import Job
+
+
+@queue.task('jobs.tests.sleep')
+def sleep(seconds):
+    time.sleep(seconds)
+    # Whatever a worker's periodic requeue_stale would take back meanwhile
+    return queue.requeue_stale()
+
+
+class RequeueStaleTests(TestCase):
+    def stale_job(self, **fields):
+        locked_at = timezone.now() - timedelta(hours=1)
+        return Job.objects.create(name='jobs.tests.sleep', status='running', locked_by='gone', locked_at=locked_at, **fields)
+
+    def test_requeues_jobs_with_attempts_left(self):
+        job = self.stale_job(attempts=1, max_attempts=3)
+        self.assertEqual(queue.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('queued', None))
+
+    def test_fails_jobs_on_their_last_attempt(self):
+        job = self.stale_job(attempts=3, max_attempts=3)
+        self.assertEqual(queue.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_leaves_fresh_locks_alone(self):
+        Job.objects.create(name='jobs.tests.sleep', status='running', locked_by='w', locked_at=timezone.now())
+        self.assertEqual(queue.requeue_stale(), 0)
+
+
+class HeartbeatTests(TransactionTestCase):
+    @override_settings(JOB_QUEUE={'LOCK_TIMEOUT_SECONDS': 0.3})
+    def test_long_job_keeps_its_lock(self):
+        sleep.enqueue(seconds=1)
+        [job] = queue.claim('worker')
+        self.assertTrue(queue.run(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), ('succeeded', 1, 0))
+
+
+class WorkerTests(TestCase):
+    def test_worker_survives_database_errors(self):
+        command = Command()
+        command.stop = threading.Event()
+        with mock.patch.object(queue, 'claim', side_effect=[OperationalError('database is locked'), []]) as claim:
+            with self.assertLogs('jobs.management.commands.run_jobs', 'ERROR'):
+                command.work('worker', 0, burst=True)
+        self.assertEqual(claim.call_count, 2)
@@ -0,0 +1,195 @@
+"""
+Daily interest and penalty accrual across the whole portfolio.
+
+Interest accrues for each day of a loan's term at `interest_rate` percent a
+year. Each day is charged as the difference between the interest owed after
+n days and after n - 1 days, both rounded to the ngwee, so the daily charges
+always add up to exactly `Loan.calculate_interest()`. Once a loan is past its
+end date with money still owed, the `penalty` rate accrues daily on the
+outstanding total_due instead.
+
+Amounts are handled as integer ngwee so a chunk is computed with plain
+integer arithmetic column by column, with no float rounding anywhere.
+
+A date's run is held by one worker at a time, and only loans whose
+disbursement is in the journal are charged: a run that meets loans which
+are not (created by raw inserts and not yet backfilled) charges the rest
+and stays unfinished, so the date is accrued again after backfill_ledger
+has journaled them.
+"""
+import os
+import socket
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils import timezone
+
+from mifi import sharding
+
+from . import journal
+from .models import AccrualRun, JournalEntry
+
+LOAN_MODELS = ('core.IndividualLoan', 'core.GroupLoan')
+# Days in the year each repayment frequency's rate is quoted over
+DAY_COUNT = {'daily': 365, 'weekly': 364, 'monthly': 360}
+
+
+class AccrualInProgress(Exception):
+    """Another worker holds the date's run, or took it over from this one."""
+
+
+class UnjournaledLoans(Exception):
+    """Loans due a charge have no disbursement in the journal: run backfill_ledger, then accrue the date again."""
+
+
+def _setting(name, default):
+    return getattr(settings, 'ACCRUAL', {}).get(name, default)
+
+
+def ngwee(value):
+    return int(value * 100)
+
+
+def kwacha(value):
+    return Decimal(value) / 100
+
+
+def _rate_for_days(amount, rate, basis, days):
+    # amount in ngwee, rate in hundredths of a percent; rounds half up
+    denominator = 10000 * basis
+    return (2 * amount * rate * days + denominator) // (2 * denominator)
+
+
+def interest_for_days(amount, rate, frequency, days):
+    """Interest in ngwee on `amount` after `days` days of the term."""
+    return _rate_for_days(ngwee(amount), ngwee(rate), DAY_COUNT.get(frequency, 365), days)
+
+
+def claim(accrual_date, worker_id):
+    """
+    Lock the date's run for this worker, unless it has finished; returns the
+    run. A lock older than LOCK_TIMEOUT_SECONDS is a worker that died and
+    is taken over. Raises AccrualInProgress if another worker holds it.
+    """
+    AccrualRun.objects.get_or_create(accrual_date=accrual_date)
+    now = timezone.now()
+    stale = now - timedelta(seconds=_setting('LOCK_TIMEOUT_SECONDS', 300))
+    AccrualRun.objects.filter(accrual_date=accrual_date, finished_at__isnull=True).filter(
+        models.Q(locked_by__isnull=True) | models.Q(locked_at__lt=stale)
+    ).update(locked_by=worker_id, locked_at=now)
+    run = AccrualRun.objects.get(accrual_date=accrual_date)
+    if run.finished_at is None and run.locked_by != worker_id:
+        raise AccrualInProgress(f"The accrual for {accrual_date} is being run by {run.locked_by}.")
+    return run
+
+
+def accrue(accrual_date, chunk_size=2000):
+    """
+    Charge interest and penalties for `accrual_date`, reading each loan model
+    in primary-key chunks and posting each chunk as bulk journal writes.
+    Returns the date's AccrualRun; a finished one is returned untouched.
+    Loans already charged on the date are skipped, so a run that stopped
+    part-way picks up where it left off. Every shard is accrued in turn.
+    Raises UnjournaledLoans, having charged every other loan, if some
+    loans' disbursements are not in the journal.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    run = claim(accrual_date, worker_id)
+    if run.finished_at is not None:
+        return run
+    unjournaled, finished_at = None, None
+    try:
+        unjournaled = _accrue(run, worker_id, chunk_size)
+        if not unjournaled:
+            finished_at = timezone.now()
+    finally:
+        AccrualRun.objects.filter(pk=run.pk, locked_by=worker_id).update(
+            finished_at=finished_at, locked_by=None, locked_at=None
+        )
+    if unjournaled:
+        raise UnjournaledLoans(
+            f"{unjournaled} loans due a charge on {accrual_date} have no disbursement in the journal: "
+            "run backfill_ledger, then accrue the date again."
+        )
+    run.refresh_from_db()
+    return run
+
+
+def _accrue(run, worker_id, chunk_size):
+    """Post the run's charges; returns the number of loans left out for want of a disbursement."""
+    accrual_date = run.accrual_date
+    memo = f"Accrual for {accrual_date.isoformat()}"
+    unjournaled = 0
+    for label in LOAN_MODELS:
+        model = apps.get_model(label)
+        entries = JournalEntry.objects.filter(content_type=ContentType.objects.get_for_model(model))
+        charged = entries.filter(effective_date=accrual_date, entry_type__in=['interest', 'penalty'])
+        # The journal is on 'default': on a shard, charged loans are left out chunk by chunk
+        separate = sharding.crosses(model, JournalEntry)
+        for alias in sharding.each_shard():
+            loans = model.objects.filter(
+                status__in=['active', 'overdue'],
+                start_date__lt=accrual_date,
+            ).filter(
+                models.Q(end_date__gte=accrual_date, interest_rate__gt=0)
+                | models.Q(end_date__lt=accrual_date, penalty__gt=0, total_due__gt=0)
+            ).order_by('pk').values_list(
+                'pk', 'amount', 'interest_rate', 'penalty', 'repayment_frequency',
+                'start_date', 'end_date', 'total_due',
+            )
+            if not separate:
+                loans = loans.filter(~models.Exists(charged.filter(object_id=models.OuterRef('pk'))))
+
+            last_id = 0
+            while True:
+                chunk = list(loans.filter(pk__gt=last_id)[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                if separate:
+                    done = set(charged.filter(object_id__in=[row[0] for row in chunk]).values_list('object_id', flat=True))
+                    chunk = [row for row in chunk if row[0] not in done]
+                # A charge before the disbursement would leave the loan out of backfill_ledger for good
+                disbursed = set(
+                    entries.filter(entry_type='disbursement', object_id__in=[row[0] for row in chunk])
+                    .values_list('object_id', flat=True)
+                )
+                unjournaled += len(charges_for([row for row in chunk if row[0] not in disbursed], accrual_date))
+                charges = charges_for([row for row in chunk if row[0] in disbursed], accrual_date)
+                if not charges:
+                    continue
+                with sharding.atomic():
+                    journal.post_charges(model, charges, accrual_date, memo=memo)
+                    # Renews the lock; a worker that has lost it to another rolls the chunk back
+                    held = AccrualRun.objects.filter(pk=run.pk, locked_by=worker_id).update(
+                        loans=models.F('loans') + len(charges),
+                        interest=models.F('interest') + sum(amount for _, kind, amount in charges if kind == 'interest'),
+                        penalties=models.F('penalties') + sum(amount for _, kind, amount in charges if kind == 'penalty'),
+                        locked_at=timezone.now(),
+                    )
+                    if not held:
+                        raise AccrualInProgress(f"The accrual for {accrual_date} was taken over by another worker.")
+    return unjournaled
+
+
+def charges_for(chunk, accrual_date):
+    """[(loan_id, kind, amount)] owed on `accrual_date` by rows of a loan chunk."""
+    charges = []
+    for loan_id, amount, rate, penalty, frequency, start_date, end_date, total_due in chunk:
+        basis = DAY_COUNT.get(frequency, 365)
+        if accrual_date <= end_date:
+            days = (accrual_date - start_date).days
+            amount, rate = ngwee(amount), ngwee(rate)
+            owed = _rate_for_days(amount, rate, basis, days) - _rate_for_days(amount, rate, basis, days - 1)
+            kind = 'interest'
+        else:
+            owed = _rate_for_days(ngwee(total_due), ngwee(penalty), basis, 1)
+            kind = 'penalty'
+        if owed > 0:
+            charges.append((loan_id, kind, kwacha(owed).quantize(journal.CENT)))
+    return charges
@@ -0,0 +1,45 @@
+from django.contrib import admin
+from .models import AccrualRun, JournalEntry, JournalLine, LoanBalanceSnapshot
+
+
+class JournalLineInline(admin.TabularInline):
+    model = JournalLine
+    extra = 0
+    can_delete = False
+    readonly_fields = ('account', 'debit', 'credit')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(JournalEntry)
+class JournalEntryAdmin(admin.ModelAdmin):
+    """Read-only: corrections are posted as reversals, never edits."""
+    list_display = ('id', 'entry_type', 'content_type', 'object_id', 'effective_date', 'posted_at', 'posted_by')
+    list_filter = ('entry_type', 'content_type')
+    search_fields = ('=object_id', 'memo')
+    inlines = [JournalLineInline]
+    list_select_related = ('content_type', 'posted_by')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LoanBalanceSnapshot)
+class LoanBalanceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('content_type', 'object_id', 'as_of', 'principal', 'interest', 'penalty', 'collections')
+    list_filter = ('content_type', 'as_of')
+    search_fields = ('=object_id',)
+
+
+@admin.register(AccrualRun)
+class AccrualRunAdmin(admin.ModelAdmin):
+    list_display = ('accrual_date', 'loans', 'interest', 'penalties', 'started_at', 'finished_at')
+    readonly_fields = ('accrual_date', 'loans', 'interest', 'penalties', 'started_at', 'finished_at')
+    date_hierarchy = 'accrual_date'
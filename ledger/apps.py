@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_save
+
+
+def post_disbursement(sender, instance, created, raw=False, **kwargs):
+    from .journal import post_disbursement
+
+    if created and not raw:
+        post_disbursement(instance, user=instance.loan_officer)
+
+
+class LedgerConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'ledger'
+
+    def ready(self):
+        # Every loan enters the journal with its disbursement, however it was created
+        for model in ('core.IndividualLoan', 'core.GroupLoan'):
+            post_save.connect(post_disbursement, sender=model, dispatch_uid=f'ledger_disbursement_{model}')
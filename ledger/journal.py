@@ -0,0 +1,394 @@
+"""
+Posting to and reading from the loan journal.
+
+Every change to what a borrower owes is an append-only JournalEntry with
+balanced debit/credit lines. A loan's total_due and total_paid columns are
+only moved by posting here, in the same transaction and by the same amounts
+as the lines, so they are a cache of the journal rather than a second source
+of truth.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connection, connections, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from mifi import sharding
+
+from .models import JournalEntry, JournalLine, LoanBalanceSnapshot
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+# Payments settle penalties first, then interest, then principal
+RECEIVABLES = ['penalty', 'interest', 'principal']
+BALANCE_ACCOUNTS = RECEIVABLES + ['collections']
+CHARGE_INCOME = {'interest': 'interest_income', 'penalty': 'penalty_income'}
+
+
+def account_sums():
+    """Aggregates giving each balance account's debit-minus-credit total."""
+    return {
+        account: Coalesce(
+            models.Sum(models.F('debit') - models.F('credit'), filter=models.Q(account=account)),
+            ZERO,
+            output_field=models.DecimalField(max_digits=14, decimal_places=2)
+        )
+        for account in BALANCE_ACCOUNTS
+    }
+
+
+def money(value):
+    # SQLite sums decimals as floats, so aggregates come back as e.g. 53.5899999999999
+    return Decimal(value).quantize(CENT)
+
+
+def _totals_delta(lines):
+    due = sum((debit - credit for account, debit, credit in lines if account in RECEIVABLES), ZERO)
+    paid = sum((debit - credit for account, debit, credit in lines if account == 'collections'), ZERO)
+    return due, paid
+
+
+def _check_balanced(lines):
+    if not lines or any(debit < 0 or credit < 0 or (debit and credit) for _, debit, credit in lines):
+        raise ValidationError("Journal lines must each have one positive side.")
+    if sum(line[1] for line in lines) != sum(line[2] for line in lines):
+        raise ValidationError("Journal entry does not balance.")
+
+
+def post(loan, entries, user=None, update_totals=True):
+    """
+    Post entries for one loan. Each entry is a dict with entry_type, lines
+    [(account, debit, credit)], effective_date and optionally member_id,
+    payment_id, reverses and memo. Entries and lines go in as two bulk
+    INSERTs and the loan totals move in one guarded UPDATE.
+    """
+    content_type = ContentType.objects.get_for_model(loan)
+    due = paid = ZERO
+    for entry in entries:
+        _check_balanced(entry['lines'])
+        entry_due, entry_paid = _totals_delta(entry['lines'])
+        due += entry_due
+        paid += entry_paid
+
+    # The journal is on 'default', the loan perhaps on a shard
+    with sharding.atomic([loan._state.db]):
+        created = JournalEntry.objects.bulk_create([
+            JournalEntry(
+                content_type=content_type,
+                object_id=loan.pk,
+                entry_type=entry['entry_type'],
+                effective_date=entry.get('effective_date') or timezone.localdate(),
+                posted_by=user,
+                member_id=entry.get('member_id'),
+                payment_id=entry.get('payment_id'),
+                reverses=entry.get('reverses'),
+                memo=entry.get('memo', ''),
+            )
+            for entry in entries
+        ])
+        JournalLine.objects.bulk_create([
+            JournalLine(entry=journal_entry, account=account, debit=debit, credit=credit)
+            for journal_entry, entry in zip(created, entries)
+            for account, debit, credit in entry['lines']
+        ])
+        if update_totals and (due or paid):
+            _move_totals(loan, due, paid, entries)
+    return created
+
+
+def _move_totals(loan, due, paid, entries):
+    queryset = type(loan).objects.using(loan._state.db).filter(pk=loan.pk)
+    if due < 0:
+        # The guard makes the UPDATE its own overpayment check, so no row lock is needed
+        queryset = queryset.filter(total_due__gte=-due)
+    updated = queryset.update(
+        total_due=models.F('total_due') + due,
+        total_paid=models.F('total_paid') + paid,
+        updated_at=timezone.now()
+    )
+    if not updated:
+        if any(entry['entry_type'] == 'payment' for entry in entries):
+            raise ValidationError("Payment amount exceeds total due.")
+        raise ValidationError("Entry would take the loan balance below zero.")
+    loan.refresh_from_db(fields=['total_due', 'total_paid', 'updated_at'])
+
+
+def post_disbursement(loan, user=None):
+    # Loan.save() already starts total_due at the amount, so only the journal is written
+    return post(loan, [{
+        'entry_type': 'disbursement',
+        'lines': [('principal', loan.amount, ZERO), ('funding', ZERO, loan.amount)],
+        'effective_date': loan.start_date,
+    }], user=user, update_totals=False)[0]
+
+
+def post_charge(loan, kind, amount, effective_date=None, user=None, memo=''):
+    """Charge interest or a penalty to the loan; total_due grows by the amount."""
+    if kind not in CHARGE_INCOME:
+        raise ValueError(f"Unknown charge {kind}")
+    return post(loan, [{
+        'entry_type': kind,
+        'lines': [(kind, amount, ZERO), (CHARGE_INCOME[kind], ZERO, amount)],
+        'effective_date': effective_date,
+        'memo': memo,
+    }], user=user)[0]
+
+
+def _line_sql():
+    qn = connection.ops.quote_name
+    return "INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, %s)".format(
+        qn(JournalLine._meta.db_table),
+        *[qn(JournalLine._meta.get_field(name).column) for name in ('entry', 'account', 'debit', 'credit')]
+    )
+
+
+def post_disbursements(model, loans, memo=''):
+    """
+    Journal loans of one model that were bulk-inserted with total_due
+    already set to the amount: `loans` is [(loan_id, amount, start_date,
+    loan_officer_id)]. Like post_disbursement, the totals are left alone.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    with transaction.atomic():
+        created = JournalEntry.objects.bulk_create([
+            JournalEntry(
+                content_type=content_type,
+                object_id=loan_id,
+                entry_type='disbursement',
+                effective_date=start_date,
+                posted_by_id=officer_id,
+                memo=memo,
+            )
+            for loan_id, amount, start_date, officer_id in loans
+        ])
+        with connection.cursor() as cursor:
+            cursor.executemany(_line_sql(), [
+                line
+                for entry, (loan_id, amount, start_date, officer_id) in zip(created, loans)
+                for line in ((entry.pk, 'principal', amount, ZERO), (entry.pk, 'funding', ZERO, amount))
+            ])
+    return created
+
+
+def post_charges(model, charges, effective_date, memo=''):
+    """
+    Charge many loans of one model at once: `charges` is [(loan_id, kind,
+    amount)]. Entries go in as one bulk INSERT; lines and the relative
+    total_due UPDATEs are sent with executemany, because building ORM
+    objects and expressions costs more than the writes at portfolio scale.
+    Relative updates never overwrite a payment posted concurrently. The
+    loans are those on the pinned shard; the journal is on 'default'.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    loans = connections[sharding.current()]
+    qn = loans.ops.quote_name
+    total_sql = "UPDATE {table} SET {due} = {due} + %s, {updated} = %s WHERE {pk} = %s".format(
+        table=qn(model._meta.db_table),
+        due=qn(model._meta.get_field('total_due').column),
+        updated=qn(model._meta.get_field('updated_at').column),
+        pk=qn(model._meta.pk.column),
+    )
+    now = model._meta.get_field('updated_at').get_db_prep_value(timezone.now(), loans)
+
+    with sharding.atomic():
+        created = JournalEntry.objects.bulk_create([
+            JournalEntry(
+                content_type=content_type,
+                object_id=loan_id,
+                entry_type=kind,
+                effective_date=effective_date,
+                memo=memo,
+            )
+            for loan_id, kind, amount in charges
+        ])
+        with connection.cursor() as cursor:
+            cursor.executemany(_line_sql(), [
+                line
+                for entry, (loan_id, kind, amount) in zip(created, charges)
+                for line in ((entry.pk, kind, amount, ZERO), (entry.pk, CHARGE_INCOME[kind], ZERO, amount))
+            ])
+        with loans.cursor() as cursor:
+            cursor.executemany(total_sql, [(amount, now, loan_id) for loan_id, kind, amount in charges])
+    return created
+
+
+def payment_lines(amount, balances):
+    """Split a payment over the receivables, updating `balances` in place."""
+    lines = [('collections', amount, ZERO)]
+    remaining = amount
+    for account in RECEIVABLES:
+        # Whatever is left lands on principal; the total_due guard rejects a genuine overpayment
+        part = remaining if account == 'principal' else min(remaining, max(balances[account], ZERO))
+        if part > 0:
+            lines.append((account, ZERO, part))
+            balances[account] -= part
+            remaining -= part
+    return lines
+
+
+def post_payments(loan, payments, user=None):
+    """Post already-saved payment rows for one loan, e.g. a whole collection sheet."""
+    balances = balance(loan)
+    return post(loan, [
+        {
+            'entry_type': 'payment',
+            'lines': payment_lines(payment.amount, balances),
+            'effective_date': timezone.localdate(payment.payment_date) if payment.payment_date else None,
+            'member_id': getattr(payment, 'member_id', None),
+            'payment_id': payment.pk,
+        }
+        for payment in payments
+    ], user=user)
+
+
+def post_payment(loan, payment, user=None):
+    return post_payments(loan, [payment], user=user)[0]
+
+
+def reverse(entry, user=None, memo='', loan=None):
+    """
+    Cancel an entry by posting its mirror image; the original stays in the
+    journal. Pass the entry's `loan` when the caller has it loaded.
+    """
+    if entry.entry_type == 'reversal':
+        raise ValidationError("A reversal cannot itself be reversed.")
+    if JournalEntry.objects.filter(reverses=entry).exists():
+        raise ValidationError("This entry has already been reversed.")
+
+    if loan is None:
+        # entry.loan would look for the loan on the entry's database, not the loan's shard
+        model = entry.content_type.model_class()
+        loan = model.objects.using(sharding.locate(model, entry.object_id)).get(pk=entry.object_id)
+    lines = [(line.account, line.credit, line.debit) for line in entry.lines.all()]
+    return post(loan, [{
+        'entry_type': 'reversal',
+        'lines': lines,
+        'reverses': entry,
+        'member_id': entry.member_id,
+        'payment_id': entry.payment_id,
+        'memo': memo or f"Reversal of entry {entry.pk}",
+    }], user=user)[0]
+
+
+def reverse_payment(loan, payment_id, user=None):
+    """Reverse the entry that posted payment `payment_id` of `loan`, if it has not been already."""
+    entry = JournalEntry.objects.filter(
+        content_type=ContentType.objects.get_for_model(loan),
+        object_id=loan.pk,
+        entry_type='payment',
+        payment_id=payment_id,
+    ).filter(reversed_by__isnull=True).first()
+    if entry is None:
+        return None
+    # post() refreshes the caller's totals on `loan`
+    return reverse(entry, user=user, memo=f"Payment {payment_id} deleted", loan=loan)
+
+
+def balance(loan, as_of=None):
+    """
+    The loan's balances at the end of `as_of` (default: now): the nearest
+    snapshot on or before that day plus the entries it does not cover.
+    """
+    content_type = ContentType.objects.get_for_model(loan)
+    entries = JournalEntry.objects.filter(content_type=content_type, object_id=loan.pk)
+    snapshots = LoanBalanceSnapshot.objects.filter(content_type=content_type, object_id=loan.pk)
+    if as_of is not None:
+        entries = entries.filter(effective_date__lte=as_of)
+        snapshots = snapshots.filter(as_of__lte=as_of)
+
+    totals = dict.fromkeys(BALANCE_ACCOUNTS, ZERO)
+    snapshot = snapshots.order_by('-as_of').first()
+    if snapshot is not None:
+        totals = {account: getattr(snapshot, account) for account in BALANCE_ACCOUNTS}
+        # Later-dated entries, plus back-dated ones posted after the snapshot was taken
+        entries = entries.filter(
+            models.Q(effective_date__gt=snapshot.as_of) | models.Q(id__gt=snapshot.last_entry_id)
+        )
+
+    replay = JournalLine.objects.filter(entry__in=entries).aggregate(**account_sums())
+    for account in BALANCE_ACCOUNTS:
+        totals[account] += money(replay[account])
+
+    totals['total_due'] = sum((totals[account] for account in RECEIVABLES), ZERO)
+    totals['total_paid'] = totals['collections']
+    return totals
+
+
+def balances(model, ids, as_of):
+    """
+    balance() at the end of `as_of` for many loans of one model at once:
+    {loan id: totals}. Loans with a snapshot taken for that very day start
+    from it; the rest are replayed from the journal. Loans with nothing in
+    the journal by then are left out.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    entries = JournalEntry.objects.filter(content_type=content_type, effective_date__lte=as_of)
+    totals = defaultdict(lambda: dict.fromkeys(BALANCE_ACCOUNTS, ZERO))
+    covered = defaultdict(list)
+    for snapshot in LoanBalanceSnapshot.objects.filter(content_type=content_type, object_id__in=ids, as_of=as_of):
+        totals[snapshot.object_id] = {account: getattr(snapshot, account) for account in BALANCE_ACCOUNTS}
+        covered[snapshot.last_entry_id].append(snapshot.object_id)
+
+    # One replay for the loans without a snapshot, and one per snapshot run for back-dated entries
+    replays = [entries.filter(object_id__in=set(ids) - {pk for pks in covered.values() for pk in pks})]
+    replays += [entries.filter(object_id__in=pks, id__gt=last_entry_id) for last_entry_id, pks in covered.items()]
+    for replay in replays:
+        rows = (
+            JournalLine.objects.filter(entry__in=replay)
+            .values('entry__object_id').annotate(**account_sums()).order_by()
+        )
+        for row in rows:
+            for account in BALANCE_ACCOUNTS:
+                totals[row['entry__object_id']][account] += money(row[account])
+
+    for loan_totals in totals.values():
+        loan_totals['total_due'] = sum((loan_totals[account] for account in RECEIVABLES), ZERO)
+        loan_totals['total_paid'] = loan_totals['collections']
+    return dict(totals)
+
+
+def take_snapshots(as_of, batch_size=5000):
+    """
+    Write every loan's balances at the end of `as_of` from one GROUP BY over
+    the journal. Re-running for the same day replaces that day's rows.
+    """
+    last_entry_id = JournalEntry.objects.aggregate(last=models.Max('id'))['last']
+    if last_entry_id is None:
+        return 0
+
+    rows = (
+        JournalLine.objects.filter(entry__effective_date__lte=as_of, entry_id__lte=last_entry_id)
+        .values('entry__content_type_id', 'entry__object_id')
+        .annotate(**account_sums())
+        .order_by()
+    )
+
+    written = 0
+    batch = []
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(LoanBalanceSnapshot(
+            content_type_id=row['entry__content_type_id'],
+            object_id=row['entry__object_id'],
+            as_of=as_of,
+            last_entry_id=last_entry_id,
+            **{account: money(row[account]) for account in BALANCE_ACCOUNTS}
+        ))
+        if len(batch) >= batch_size:
+            written += _write_snapshots(batch)
+            batch = []
+    if batch:
+        written += _write_snapshots(batch)
+    return written
+
+
+def _write_snapshots(batch):
+    LoanBalanceSnapshot.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=['content_type', 'object_id', 'as_of'],
+        update_fields=BALANCE_ACCOUNTS + ['last_entry_id'],
+    )
+    return len(batch)
@@ -0,0 +1,50 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ledger.accrual import AccrualInProgress, UnjournaledLoans, accrue
+from ledger.models import AccrualRun
+
+
+class Command(BaseCommand):
+    help = (
+        "Post the day's interest and penalty charges for every active and overdue loan. Each date is "
+        "accrued once; re-running a finished date does nothing. Use --days to catch up on missed days. "
+        "Loans missing from the journal are not charged and leave the date unfinished: run backfill_ledger "
+        "first after raw inserts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Accrual date, YYYY-MM-DD (default: today)")
+        parser.add_argument('--days', type=int, default=1, help="Accrue this many days ending on --date")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Loans read and posted per transaction")
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                last = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError("--date must be YYYY-MM-DD")
+        else:
+            last = timezone.localdate()
+        if options['days'] < 1:
+            raise CommandError("--days must be at least 1")
+
+        for offset in range(options['days'] - 1, -1, -1):
+            accrual_date = last - timedelta(days=offset)
+            if AccrualRun.objects.filter(accrual_date=accrual_date, finished_at__isnull=False).exists():
+                self.stdout.write(f"{accrual_date}: already accrued")
+                continue
+            started = timezone.now()
+            try:
+                run = accrue(accrual_date, chunk_size=options['chunk_size'])
+            except AccrualInProgress as e:
+                self.stdout.write(self.style.WARNING(f"{accrual_date}: {e}"))
+                continue
+            except UnjournaledLoans as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                f"{accrual_date}: {run.loans} loans charged, interest {run.interest}, penalties {run.penalties} "
+                f"in {(run.finished_at - started).total_seconds():.1f}s"
+            )
@@ -0,0 +1,95 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import GroupLoan, GroupLoanPayment, IndividualLoan, IndividualLoanPayment
+from mifi import sharding
+from ledger.journal import ZERO
+from ledger.models import JournalEntry, JournalLine
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the journal for loans that have none yet (created before the ledger, or by raw inserts such "
+        "as generate_portfolio): one disbursement per loan and one payment entry per recorded payment. "
+        "Loans already in the journal are skipped, so it is safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Loans per transaction")
+
+    def handle(self, *args, **options):
+        for model, payment_model in ((IndividualLoan, IndividualLoanPayment), (GroupLoan, GroupLoanPayment)):
+            content_type = ContentType.objects.get_for_model(model)
+            journaled = JournalEntry.objects.filter(content_type=content_type)
+            # The journal is on 'default': on a shard, journaled loans are left out chunk by chunk
+            separate = sharding.crosses(model, JournalEntry)
+
+            done = 0
+            for alias in sharding.each_shard():
+                pending = model.objects.order_by('pk')
+                if not separate:
+                    pending = pending.filter(~Exists(journaled.filter(object_id=OuterRef('pk'))))
+                last_id = 0
+                while True:
+                    loans = list(
+                        pending.filter(pk__gt=last_id)
+                        .values('id', 'amount', 'start_date', 'loan_officer_id')[:options['chunk_size']]
+                    )
+                    if not loans:
+                        break
+                    last_id = loans[-1]['id']
+                    if separate:
+                        seen = set(journaled.filter(
+                            object_id__in=[loan['id'] for loan in loans]
+                        ).values_list('object_id', flat=True))
+                        loans = [loan for loan in loans if loan['id'] not in seen]
+                        if not loans:
+                            continue
+                    with transaction.atomic():
+                        self.backfill(content_type, loans, payment_model)
+                    done += len(loans)
+                    self.stdout.write(f"{model._meta.verbose_name_plural}: {done} backfilled")
+
+    def backfill(self, content_type, loans, payment_model):
+        fields = ['id', 'loan_id', 'amount', 'payment_date', 'recorded_by_id']
+        if payment_model is GroupLoanPayment:
+            fields.append('member_id')
+        payments = payment_model.objects.filter(
+            loan_id__in=[loan['id'] for loan in loans]
+        ).order_by('loan_id', 'payment_date', 'id').values(*fields)
+
+        entries, lines = [], []
+        for loan in loans:
+            entries.append(JournalEntry(
+                content_type=content_type,
+                object_id=loan['id'],
+                entry_type='disbursement',
+                effective_date=loan['start_date'],
+                posted_by_id=loan['loan_officer_id'],
+                memo="Backfilled",
+            ))
+            lines.append([('principal', loan['amount'], ZERO), ('funding', ZERO, loan['amount'])])
+
+        # Before the ledger nothing but principal was ever charged, so payments settle principal
+        for payment in payments:
+            entries.append(JournalEntry(
+                content_type=content_type,
+                object_id=payment['loan_id'],
+                entry_type='payment',
+                effective_date=timezone.localdate(payment['payment_date']),
+                posted_by_id=payment['recorded_by_id'],
+                member_id=payment.get('member_id'),
+                payment_id=payment['id'],
+                memo="Backfilled",
+            ))
+            lines.append([('collections', payment['amount'], ZERO), ('principal', ZERO, payment['amount'])])
+
+        entries = JournalEntry.objects.bulk_create(entries, batch_size=1000)
+        JournalLine.objects.bulk_create([
+            JournalLine(entry=entry, account=account, debit=debit, credit=credit)
+            for entry, entry_lines in zip(entries, lines)
+            for account, debit, credit in entry_lines
+        ], batch_size=1000)
@@ -0,0 +1,58 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import GroupLoan, IndividualLoan
+from mifi import sharding
+from ledger.journal import RECEIVABLES, account_sums, money
+from ledger.models import JournalLine
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare every loan's total_due/total_paid columns with its journal. With --fix the columns are "
+        "rewritten from the journal; loans with no journal at all need backfill_ledger first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true')
+        parser.add_argument('--show', type=int, default=20, help="Mismatches to list per loan type")
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for model in (IndividualLoan, GroupLoan):
+            content_type = ContentType.objects.get_for_model(model)
+            journal = {
+                row['entry__object_id']: (
+                    money(sum(row[account] for account in RECEIVABLES)), money(row['collections'])
+                )
+                for row in JournalLine.objects.filter(entry__content_type=content_type)
+                .values('entry__object_id').annotate(**account_sums()).order_by()
+            }
+
+            wrong, missing = [], 0
+            for alias in sharding.each_shard():
+                fixes = []
+                for loan_id, total_due, total_paid in model.objects.values_list('id', 'total_due', 'total_paid').iterator():
+                    if loan_id not in journal:
+                        missing += 1
+                    elif journal[loan_id] != (total_due, total_paid):
+                        fixes.append(model(id=loan_id, total_due=journal[loan_id][0], total_paid=journal[loan_id][1]))
+                        if len(wrong) + len(fixes) <= options['show']:
+                            self.stdout.write(
+                                f"{model.__name__} {loan_id}: columns {total_due}/{total_paid}, "
+                                f"journal {journal[loan_id][0]}/{journal[loan_id][1]}"
+                            )
+                if options['fix'] and fixes:
+                    model.objects.bulk_update(fixes, ['total_due', 'total_paid'], batch_size=1000)
+                wrong += fixes
+
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural}: {len(wrong)} differ from the journal, {missing} not in the journal"
+            )
+            if options['fix'] and wrong:
+                self.stdout.write(f"Rewrote totals of {len(wrong)} {model._meta.verbose_name_plural}")
+            elif wrong:
+                mismatched += len(wrong)
+
+        if mismatched:
+            raise CommandError(f"{mismatched} loans disagree with the journal; re-run with --fix to rewrite them")
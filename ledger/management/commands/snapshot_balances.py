@@ -0,0 +1,25 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ledger.journal import take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot every loan's journal balances at the end of a day (default: yesterday)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help="YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        if options['as_of']:
+            try:
+                as_of = date.fromisoformat(options['as_of'])
+            except ValueError:
+                raise CommandError("--as-of must be YYYY-MM-DD")
+        else:
+            as_of = timezone.localdate() - timedelta(days=1)
+
+        written = take_snapshots(as_of)
+        self.stdout.write(f"Wrote {written} balance snapshots as of {as_of}")
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('entry_type', models.CharField(choices=[('disbursement', 'Disbursement'), ('interest', 'Interest'), ('penalty', 'Penalty'), ('payment', 'Payment'), ('reversal', 'Reversal')], max_length=20)),
+                ('effective_date', models.DateField(help_text='Day the entry counts towards the loan balance')),
+                ('posted_at', models.DateTimeField(auto_now_add=True)),
+                ('payment_id', models.PositiveBigIntegerField(blank=True, help_text='IndividualLoanPayment or GroupLoanPayment this entry records', null=True)),
+                ('memo', models.CharField(blank=True, max_length=255)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='contenttypes.contenttype')),
+                ('member', models.ForeignKey(blank=True, help_text='Group member a group loan payment came from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='member_journal_entries', to=settings.AUTH_USER_MODEL)),
+                ('posted_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='journal_entries', to=settings.AUTH_USER_MODEL)),
+                ('reverses', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reversed_by', to='ledger.journalentry')),
+            ],
+            options={
+                'verbose_name_plural': 'journal entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('principal', 'Principal receivable'), ('interest', 'Interest receivable'), ('penalty', 'Penalty receivable'), ('collections', 'Collections'), ('funding', 'Loan funding'), ('interest_income', 'Interest income'), ('penalty_income', 'Penalty income')], max_length=20)),
+                ('debit', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('credit', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lines', to='ledger.journalentry')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('as_of', models.DateField()),
+                ('principal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('interest', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('penalty', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('collections', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_entry_id', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='contenttypes.contenttype')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['content_type', 'object_id', 'effective_date'], name='journal_loan_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='journalline',
+            constraint=models.CheckConstraint(condition=models.Q(('credit__gte', 0), ('debit__gte', 0), models.Q(('debit', 0), ('credit', 0), _connector='OR')), name='journal_line_one_side'),
+        ),
+        migrations.AddConstraint(
+            model_name='loanbalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'as_of'), name='balance_snapshot_unique'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccrualRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('accrual_date', models.DateField(unique=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('loans', models.PositiveIntegerField(default=0, help_text='Loans charged on this date')),
+                ('interest', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('penalties', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+    ]
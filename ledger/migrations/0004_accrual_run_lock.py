@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0003_big_object_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accrualrun',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='accrualrun',
+            name='locked_by',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
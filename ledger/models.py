@@ -0,0 +1,163 @@
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from users.models import User
+
+
+class AppendOnlyQuerySet(models.QuerySet):
+    """Journal rows are never changed or removed; corrections are posted as reversals."""
+
+    def update(self, **kwargs):
+        raise ValidationError("Journal records are immutable; post a reversal instead.")
+
+    def delete(self):
+        raise ValidationError("Journal records are immutable; post a reversal instead.")
+
+
+class AppendOnlyModel(models.Model):
+    objects = AppendOnlyQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Journal records are immutable; post a reversal instead.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Journal records are immutable; post a reversal instead.")
+
+    class Meta:
+        abstract = True
+
+
+class JournalEntry(AppendOnlyModel):
+    ENTRY_TYPES = (
+        ('disbursement', 'Disbursement'),
+        ('interest', 'Interest'),
+        ('penalty', 'Penalty'),
+        ('payment', 'Payment'),
+        ('reversal', 'Reversal'),
+    )
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.PROTECT)
+    object_id = models.PositiveBigIntegerField()
+    loan = GenericForeignKey('content_type', 'object_id')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    effective_date = models.DateField(help_text="Day the entry counts towards the loan balance")
+    posted_at = models.DateTimeField(auto_now_add=True)
+    posted_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='journal_entries'
+    )
+    member = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='member_journal_entries',
+        help_text="Group member a group loan payment came from"
+    )
+    payment_id = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        help_text="IndividualLoanPayment or GroupLoanPayment this entry records"
+    )
+    reverses = models.OneToOneField(
+        'self',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='reversed_by'
+    )
+    memo = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'effective_date'], name='journal_loan_date_idx'),
+        ]
+        verbose_name_plural = 'journal entries'
+
+    def __str__(self):
+        return f"{self.get_entry_type_display()} #{self.pk} on {self.content_type.model} {self.object_id}"
+
+
+class JournalLine(AppendOnlyModel):
+    """
+    One side of a journal entry. principal, interest and penalty are what the
+    borrower owes; collections is cash received from them. funding and the
+    income accounts are the other side of disbursements and charges.
+    """
+    ACCOUNTS = (
+        ('principal', 'Principal receivable'),
+        ('interest', 'Interest receivable'),
+        ('penalty', 'Penalty receivable'),
+        ('collections', 'Collections'),
+        ('funding', 'Loan funding'),
+        ('interest_income', 'Interest income'),
+        ('penalty_income', 'Penalty income'),
+    )
+
+    entry = models.ForeignKey(JournalEntry, on_delete=models.PROTECT, related_name='lines')
+    account = models.CharField(max_length=20, choices=ACCOUNTS)
+    debit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    credit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(debit__gte=0, credit__gte=0) & (models.Q(debit=0) | models.Q(credit=0)),
+                name='journal_line_one_side',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.account} Dr {self.debit} Cr {self.credit}"
+
+
+class LoanBalanceSnapshot(models.Model):
+    """
+    A loan's balances at the end of `as_of`, covering every journal entry up
+    to `last_entry_id`. Balances at a later date start from the nearest
+    snapshot and replay only the entries after it.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.PROTECT)
+    object_id = models.PositiveBigIntegerField()
+    loan = GenericForeignKey('content_type', 'object_id')
+    as_of = models.DateField()
+    principal = models.DecimalField(max_digits=12, decimal_places=2)
+    interest = models.DecimalField(max_digits=12, decimal_places=2)
+    penalty = models.DecimalField(max_digits=12, decimal_places=2)
+    collections = models.DecimalField(max_digits=12, decimal_places=2)
+    last_entry_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'as_of'], name='balance_snapshot_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id} as of {self.as_of}"
+
+
+class AccrualRun(models.Model):
+    """
+    One day of interest and penalty accrual. A run that has finished is
+    never repeated, so accruing the same date twice posts nothing new, and
+    one worker at a time holds an unfinished run (locked_by).
+    """
+    accrual_date = models.DateField(unique=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    loans = models.PositiveIntegerField(default=0, help_text="Loans charged on this date")
+    interest = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    penalties = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Accrual for {self.accrual_date}"
@@ -0,0 +1,30 @@
+from rest_framework import serializers
+
+from mifi.sparse import SparseSerializerMixin
+from .models import JournalEntry, JournalLine
+
+
+class JournalLineSerializer(SparseSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = JournalLine
+        fields = ['account', 'debit', 'credit']
+
+
+class JournalEntrySerializer(SparseSerializerMixin, serializers.ModelSerializer):
+    lines = JournalLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = JournalEntry
+        fields = [
+            'id', 'entry_type', 'effective_date', 'posted_at', 'posted_by', 'member',
+            'payment_id', 'reverses', 'memo', 'lines'
+        ]
+
+
+class LoanBalanceSerializer(serializers.Serializer):
+    as_of = serializers.DateField(allow_null=True)
+    principal = serializers.DecimalField(max_digits=14, decimal_places=2)
+    interest = serializers.DecimalField(max_digits=14, decimal_places=2)
+    penalty = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total_due = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total_paid = serializers.DecimalField(max_digits=14, decimal_places=2)
@@ -0,0 +1,25 @@
+from datetime import date, timedelta
+
+from django.utils import timezone
+
+from jobs.queue import task
+from .accrual import accrue
+from .journal import take_snapshots
+
+
+@task('ledger.snapshot_balances')
+def snapshot_balances(as_of=None):
+    as_of = date.fromisoformat(as_of) if as_of else timezone.localdate() - timedelta(days=1)
+    return {'as_of': as_of.isoformat(), 'snapshots': take_snapshots(as_of)}
+
+
+@task('ledger.accrue_interest')
+def accrue_interest(accrual_date=None):
+    accrual_date = date.fromisoformat(accrual_date) if accrual_date else timezone.localdate()
+    run = accrue(accrual_date)
+    return {
+        'accrual_date': accrual_date.isoformat(),
+        'loans': run.loans,
+        'interest': str(run.interest),
+        'penalties': str(run.penalties),
+    }
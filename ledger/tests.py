@@ -0,0 +1,136 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import IndividualLoan
+from core.tests import make_individual_loan, make_user
+from mifi import sharding
+from . import accrual, journal
+from .models import AccrualRun, JournalEntry
+
+
+class JournalTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.loan = make_individual_loan(self.officer, start_date=timezone.localdate() - timedelta(days=5))
+
+    def test_balance_is_exact_to_the_ngwee(self):
+        # Thirty 0.10 charges add up to 3.0000000000000013 as floats
+        for _ in range(30):
+            journal.post_charge(self.loan, 'interest', Decimal('0.10'))
+        totals = journal.balance(self.loan)
+        self.assertEqual(totals['interest'], Decimal('3.00'))
+        self.assertEqual(str(totals['total_due']), '1003.00')
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.total_due, totals['total_due'])
+
+    def test_payment_settles_penalty_then_interest_then_principal(self):
+        journal.post_charge(self.loan, 'penalty', Decimal('5.00'))
+        journal.post_charge(self.loan, 'interest', Decimal('12.34'))
+        self.loan.make_normal_payment(Decimal('20.00'), self.officer)
+
+        totals = journal.balance(self.loan)
+        self.assertEqual(
+            (totals['penalty'], totals['interest'], totals['principal']),
+            (Decimal('0.00'), Decimal('0.00'), Decimal('997.34'))
+        )
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.total_due, self.loan.total_paid), (Decimal('997.34'), Decimal('20.00')))
+
+    def test_overpayment_writes_nothing(self):
+        entries = JournalEntry.objects.count()
+        with self.assertRaises(ValidationError):
+            self.loan.make_normal_payment(Decimal('1000.01'), self.officer)
+        self.assertEqual(JournalEntry.objects.count(), entries)
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.total_due, Decimal('1000.00'))
+
+    def test_balance_from_a_snapshot_matches_the_replay(self):
+        today = timezone.localdate()
+        journal.post_charge(self.loan, 'interest', Decimal('1.11'), effective_date=today - timedelta(days=1))
+        journal.take_snapshots(today - timedelta(days=1))
+        journal.post_charge(self.loan, 'interest', Decimal('2.22'), effective_date=today)
+        # Back-dated after the snapshot was taken
+        journal.post_charge(self.loan, 'penalty', Decimal('0.33'), effective_date=today - timedelta(days=2))
+
+        self.assertEqual(journal.balance(self.loan)['total_due'], Decimal('1003.66'))
+        self.assertEqual(journal.balance(self.loan, as_of=today - timedelta(days=1))['total_due'], Decimal('1001.44'))
+
+
+class AccrualTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+
+    def test_rounds_half_up_to_the_ngwee(self):
+        # 5.00 at 36.5% for a day is exactly half a ngwee
+        self.assertEqual(accrual.interest_for_days(Decimal('5.00'), Decimal('36.50'), 'daily', 1), 1)
+        self.assertEqual(accrual.interest_for_days(Decimal('4.99'), Decimal('36.50'), 'daily', 1), 0)
+
+    def test_daily_charges_add_up_to_the_term_interest(self):
+        start = timezone.localdate() - timedelta(days=40)
+        loan = make_individual_loan(
+            self.officer, amount='1234.56', start_date=start, interest_rate=Decimal('17.30'), repayment_frequency='weekly'
+        )
+        for day in range(1, 29):
+            accrual.accrue(start + timedelta(days=day))
+
+        loan.refresh_from_db()
+        self.assertEqual(JournalEntry.objects.filter(entry_type='interest').count(), 28)
+        self.assertEqual(journal.balance(loan)['interest'], loan.calculate_interest())
+        self.assertEqual(loan.total_due, Decimal('1234.56') + loan.calculate_interest())
+
+    def test_penalty_accrues_once_past_the_end_date(self):
+        today = timezone.localdate()
+        loan = make_individual_loan(self.officer, start_date=today - timedelta(days=30), penalty=Decimal('10.00'))
+        run = accrual.accrue(today)
+        self.assertEqual((run.loans, run.penalties), (1, Decimal('0.27')))
+
+        # A finished date is not charged again, nor is a loan already charged on a resumed one
+        self.assertEqual(accrual.accrue(today).pk, run.pk)
+        AccrualRun.objects.filter(pk=run.pk).update(finished_at=None)
+        accrual.accrue(today)
+        loan.refresh_from_db()
+        self.assertEqual(loan.total_due, Decimal('1000.27'))
+        self.assertEqual(JournalEntry.objects.filter(entry_type='penalty').count(), 1)
+
+    def test_one_worker_runs_a_date(self):
+        today = timezone.localdate()
+        make_individual_loan(self.officer, start_date=today - timedelta(days=30), penalty=Decimal('10.00'))
+        AccrualRun.objects.create(accrual_date=today, locked_by='other:1', locked_at=timezone.now())
+        with self.assertRaises(accrual.AccrualInProgress):
+            accrual.accrue(today)
+        self.assertFalse(JournalEntry.objects.filter(entry_type='penalty').exists())
+
+        # A worker that stopped renewing its lock has died
+        AccrualRun.objects.update(locked_at=timezone.now() - timedelta(minutes=10))
+        run = accrual.accrue(today)
+        self.assertEqual((run.loans, run.penalties, run.locked_by), (1, Decimal('0.27'), None))
+        self.assertIsNotNone(run.finished_at)
+
+    def test_loans_missing_from_the_journal_hold_the_date_open(self):
+        today = timezone.localdate()
+        start = today - timedelta(days=30)
+        journaled = make_individual_loan(self.officer, start_date=start, penalty=Decimal('10.00'))
+        # Raw inserts skip the disbursement entry
+        with sharding.pinned(journaled._state.db):
+            raw = IndividualLoan.objects.bulk_create([IndividualLoan(
+                loan_type='individual', amount=Decimal('1000.00'), total_due=Decimal('1000.00'),
+                penalty=Decimal('10.00'), loan_officer=self.officer, recipient=make_user(), first_name='Chanda',
+                last_name='Phiri', start_date=start, end_date=start + timedelta(days=28), status='active',
+            )])[0]
+        with self.assertRaises(accrual.UnjournaledLoans):
+            accrual.accrue(today)
+        run = AccrualRun.objects.get(accrual_date=today)
+        self.assertEqual((run.loans, run.finished_at, run.locked_by), (1, None, None))
+
+        journal.post_disbursements(IndividualLoan, [(raw.pk, raw.amount, raw.start_date, self.officer.pk)])
+        run = accrual.accrue(today)
+        self.assertEqual((run.loans, run.penalties), (2, Decimal('0.54')))
+        self.assertEqual(JournalEntry.objects.filter(entry_type='penalty').count(), 2)
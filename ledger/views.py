@@ -0,0 +1,86 @@
+from datetime import date
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from rest_framework import serializers, viewsets
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from archive import history
+from core.models import IndividualLoan
+from core.permissions import IsLoanOfficerOrHigher
+from mifi import sharding
+from mifi.sparse import shape_queryset
+from .journal import balance
+from .models import JournalEntry
+from .serializers import JournalEntrySerializer, LoanBalanceSerializer
+
+MAX_ENTRIES = 200
+
+
+class LoanLedgerViewSet(sharding.ShardedViewMixin, viewsets.ViewSet):
+    """
+    A loan's journal, newest first (`?before=<entry id>&limit=` to page back),
+    and its balance at the end of any day (`balance/?as_of=YYYY-MM-DD`).
+    Mapped once per loan model through `loan_model`.
+    """
+    permission_classes = [IsAuthenticated, IsLoanOfficerOrHigher]
+    loan_model = None
+
+    def get_shard_lookup(self):
+        return ('loan_id', self.loan_model)
+
+    def get_loan(self):
+        user = self.request.user
+        queryset = self.loan_model.objects.all()
+        if user.role == 'loan_officer':
+            queryset = queryset.filter(loan_officer=user)
+        elif user.role not in ['superuser', 'manager', 'region_manager']:
+            if self.loan_model is IndividualLoan:
+                queryset = queryset.filter(Q(loan_officer=user) | Q(recipient=user))
+            else:
+                queryset = queryset.filter(members=user)
+        try:
+            return get_object_or_404(queryset, pk=self.kwargs.get('loan_id'))
+        except Http404:
+            # Archived loans keep their journal
+            loan = history.find_loan(self.loan_model, self.kwargs.get('loan_id'), user)
+            if loan is None:
+                raise
+            return loan
+
+    def get_as_of(self):
+        as_of = self.request.query_params.get('as_of')
+        if not as_of:
+            return None
+        try:
+            return date.fromisoformat(as_of)
+        except ValueError:
+            raise serializers.ValidationError({'as_of': "Use YYYY-MM-DD."})
+
+    def list(self, request, loan_id=None):
+        loan = self.get_loan()
+        serializer = JournalEntrySerializer(context={'request': request})
+        entries = shape_queryset(JournalEntry.objects.filter(
+            content_type=ContentType.objects.get_for_model(loan), object_id=loan.pk
+        ).order_by('-id'), serializer)
+
+        if as_of := self.get_as_of():
+            entries = entries.filter(effective_date__lte=as_of)
+        if before := request.query_params.get('before'):
+            if not before.isdigit():
+                raise serializers.ValidationError({'before': "Must be an entry id."})
+            entries = entries.filter(id__lt=before)
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), MAX_ENTRIES)
+        except ValueError:
+            limit = 50
+
+        return Response(JournalEntrySerializer(entries[:limit], many=True, context={'request': request}).data)
+
+    def balance(self, request, loan_id=None):
+        loan = self.get_loan()
+        as_of = self.get_as_of()
+        return Response(LoanBalanceSerializer({'as_of': as_of, **balance(loan, as_of)}).data)
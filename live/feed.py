@@ -0,0 +1,47 @@
+"""
+Payment and loan status events for the live feed, published once the
+transaction that wrote them commits. Each event carries the loan officer,
+which is what a stream's scope is checked against.
+"""
+from django.db import transaction
+
+from .hub import hub
+
+LOAN_KINDS = {'individualloan': 'individual', 'grouploan': 'group'}
+
+
+def publish_on_commit(events):
+    if events:
+        transaction.on_commit(lambda: hub.publish(events))
+
+
+def payments_posted(loan, payments):
+    publish_on_commit([
+        {
+            'type': 'payment',
+            'loan_type': LOAN_KINDS[loan._meta.model_name],
+            'loan_id': loan.pk,
+            'officer_id': loan.loan_officer_id,
+            'payment_id': payment.pk,
+            'member_id': getattr(payment, 'member_id', None),
+            'amount': str(payment.amount),
+            'payment_type': payment.payment_type,
+            'payment_date': payment.payment_date.isoformat() if payment.payment_date else None,
+            'recorded_by': payment.recorded_by_id,
+        }
+        for payment in payments
+    ])
+
+
+def statuses_changed(model, loans, status):
+    """`loans` is [(loan_id, loan_officer_id)], all now in `status`."""
+    publish_on_commit([
+        {
+            'type': 'loan_status',
+            'loan_type': LOAN_KINDS[model._meta.model_name],
+            'loan_id': loan_id,
+            'officer_id': officer_id,
+            'status': status,
+        }
+        for loan_id, officer_id in loans
+    ])
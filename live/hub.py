@@ -0,0 +1,172 @@
+"""
+Fan-out of live events to Server-Sent Events streams.
+
+Every ASGI process that serves a stream keeps one Hub: the open streams
+subscribe to it, and a buffer of recent events lets a reconnecting client
+resume after its Last-Event-ID. Events are published after the
+transaction that caused them commits, from whichever process did the
+write, and reach the other processes on the host as datagrams on the Unix
+sockets in LIVE['SOCKET_DIR'] (one per serving process). Nothing touches
+the database, so an idle stream costs a queue and a sleeping task.
+
+Event ids come from one counter for the host, a file in SOCKET_DIR that
+the processes take turns to advance, so they are unique and in publishing
+order whichever process a client reconnects to. Datagrams can still
+arrive out of that order, so the buffer is kept sorted by id.
+"""
+import asyncio
+import atexit
+import bisect
+import fcntl
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+# Datagrams stay well under the default socket buffer size
+EVENTS_PER_DATAGRAM = 50
+
+
+def _setting(name, default):
+    return getattr(settings, 'LIVE', {}).get(name, default)
+
+
+class Subscription:
+    def __init__(self, hub, size):
+        self.hub = hub
+        self.queue = asyncio.Queue(size)
+
+    def close(self):
+        self.hub.subscribers.discard(self)
+
+    def put(self, events):
+        try:
+            for event in events:
+                self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind reconnects and resumes from the buffer instead
+            self.close()
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Hub:
+    def __init__(self):
+        self.buffer = []
+        self.subscribers = set()
+        self.loop = None
+        self.socket_path = None
+        self.started_id = None
+        self.lock = threading.Lock()
+
+    def next_ids(self, count):
+        """
+        Take `count` ids from the host's counter. They also stay above the
+        clock in nanoseconds, so ids keep growing if the file is lost.
+        """
+        directory = _setting('SOCKET_DIR', 'live')
+        os.makedirs(directory, exist_ok=True)
+        with self.lock, open(os.path.join(directory, 'last-event-id'), 'a+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.seek(0)
+            first = max(int(fh.read() or 0) + 1, time.time_ns())
+            fh.seek(0)
+            fh.truncate()
+            fh.write(str(first + count - 1))
+            # Closing the file releases the lock
+        return range(first, first + count)
+
+    def publish(self, events):
+        """Give each event an id and deliver it here and to the host's other processes. Any thread."""
+        for event, event_id in zip(events, self.next_ids(len(events))):
+            event['id'] = event_id
+        for start in range(0, len(events), EVENTS_PER_DATAGRAM):
+            self.relay(json.dumps(events[start:start + EVENTS_PER_DATAGRAM]).encode())
+        self.receive(events)
+
+    def relay(self, datagram):
+        directory = _setting('SOCKET_DIR', 'live')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for path in glob.glob(os.path.join(directory, '*.sock')):
+                if path == self.socket_path:
+                    continue
+                try:
+                    sock.sendto(datagram, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Left behind by a process that has exited
+                    _unlink(path)
+                except BlockingIOError:
+                    # That process is not keeping up; its clients resync when they reconnect
+                    pass
+
+    def receive(self, events):
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.dispatch, events)
+
+    def dispatch(self, events):
+        for event in events:
+            if self.buffer and event['id'] < self.buffer[-1]['id']:
+                bisect.insort(self.buffer, event, key=lambda buffered: buffered['id'])
+            else:
+                self.buffer.append(event)
+        del self.buffer[:-_setting('BUFFER', 1000)]
+        for subscription in list(self.subscribers):
+            subscription.put(events)
+
+    def listen(self):
+        """Bind this process's socket on the running loop; called with the first subscription."""
+        self.loop = asyncio.get_running_loop()
+        # A client resuming from before this process listened may have missed events
+        self.started_id = self.next_ids(1)[0]
+        directory = _setting('SOCKET_DIR', 'live')
+        self.socket_path = os.path.join(directory, f'{os.getpid()}.sock')
+        _unlink(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(self.socket_path)
+        atexit.register(_unlink, self.socket_path)
+
+        def read():
+            while True:
+                try:
+                    datagram = sock.recv(1 << 20)
+                except BlockingIOError:
+                    return
+                self.dispatch(json.loads(datagram))
+
+        self.loop.add_reader(sock.fileno(), read)
+        self.socket = sock
+
+    def subscribe(self, last_event_id=None):
+        """
+        Open a subscription on the running loop. Returns it with the buffered
+        events after last_event_id, or None in place of the backlog when
+        events since then may have been lost and the client should reload.
+        """
+        if self.loop is None:
+            self.listen()
+        subscription = Subscription(self, _setting('QUEUE_SIZE', 200))
+        self.subscribers.add(subscription)
+        if last_event_id is None:
+            return subscription, []
+        oldest = self.buffer[0]['id'] if len(self.buffer) == _setting('BUFFER', 1000) else self.started_id
+        if last_event_id < oldest:
+            return subscription, None
+        start = bisect.bisect_right(self.buffer, last_event_id, key=lambda event: event['id'])
+        return subscription, self.buffer[start:]
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+hub = Hub()
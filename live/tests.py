@@ -0,0 +1,88 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.client import RequestFactory
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.tests import API, make_user
+from .hub import Hub
+from .views import authenticate
+
+
+class HubTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        live = override_settings(LIVE={'SOCKET_DIR': directory.name, 'BUFFER': 4, 'QUEUE_SIZE': 10})
+        live.enable()
+        self.addCleanup(live.disable)
+
+    def test_processes_take_ids_from_one_counter(self):
+        first, second = Hub(), Hub()
+        ids = [*first.next_ids(2), *second.next_ids(1), *first.next_ids(1)]
+        self.assertEqual(ids, sorted(set(ids)))
+        # Ahead of this process's clock, e.g. taken by a process whose clock is ahead
+        ahead = time.time_ns() + 10 ** 12
+        with open(os.path.join(settings.LIVE['SOCKET_DIR'], 'last-event-id'), 'w') as fh:
+            fh.write(str(ahead))
+        self.assertEqual(list(second.next_ids(2)), [ahead + 1, ahead + 2])
+
+    def listening_hub(self):
+        hub = Hub()
+        hub.subscribe()
+        # Only events dispatched by the test
+        hub.loop.remove_reader(hub.socket.fileno())
+        hub.socket.close()
+        return hub
+
+    async def test_resumes_from_events_that_arrived_out_of_order(self):
+        hub = self.listening_hub()
+        one, two, three = ({'id': event_id} for event_id in hub.next_ids(3))
+        # Relayed from another process after this one's own later event
+        hub.dispatch([one, three])
+        hub.dispatch([two])
+
+        _, backlog = hub.subscribe(one['id'])
+        self.assertEqual(backlog, [two, three])
+        self.assertEqual(hub.subscribe(three['id'])[1], [])
+
+    async def test_resync_once_the_buffer_has_moved_on(self):
+        hub = self.listening_hub()
+        # From before this process listened
+        self.assertIsNone(hub.subscribe(hub.started_id - 1)[1])
+        events = [{'id': event_id} for event_id in hub.next_ids(6)]
+        hub.dispatch(events)
+        self.assertIsNone(hub.subscribe(events[0]['id'])[1])
+        self.assertEqual(hub.subscribe(events[2]['id'])[1], events[3:])
+
+
+@override_settings(THROTTLING={'ENABLED': False}, LIVE={'TICKET_SECONDS': 30})
+class StreamTicketTests(TestCase):
+    def setUp(self):
+        self.officer = make_user('loan_officer')
+        self.factory = RequestFactory()
+
+    def user_for(self, **params):
+        request = self.factory.get(API + 'live/payments/', params)
+        request.auser = mock.AsyncMock(return_value=mock.Mock(is_authenticated=False))
+        return async_to_sync(authenticate)(request)
+
+    def test_stream_opens_with_a_ticket_not_a_token(self):
+        client = APIClient()
+        client.force_authenticate(self.officer)
+        ticket = client.post(API + 'live/ticket/').json()['ticket']
+        self.assertEqual(self.user_for(ticket=ticket), self.officer)
+        self.assertIsNone(self.user_for(ticket=ticket + 'x'))
+        self.assertIsNone(self.user_for(token=str(AccessToken.for_user(self.officer))))
+
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 31):
+            self.assertIsNone(self.user_for(ticket=ticket))
+
+    def test_ticket_needs_a_user(self):
+        self.assertEqual(APIClient().post(API + 'live/ticket/').status_code, 401)
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from users.models import User
+from .hub import _setting, hub
+
+FEED_ROLES = ['loan_officer', 'region_manager', 'manager', 'superuser']
+TICKET_SALT = 'live.ticket'
+
+
+class StreamTicketView(APIView):
+    """
+    A ticket for opening the feed with ?ticket=, since EventSource cannot
+    send an Authorization header. It names the user and expires after
+    LIVE['TICKET_SECONDS'], so a URL that ends up in a log is soon worthless,
+    unlike the access token itself.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({
+            'ticket': signing.dumps(request.user.pk, salt=TICKET_SALT),
+            'expires_in': _setting('TICKET_SECONDS', 30),
+        })
+
+
+async def authenticate(request):
+    """The user from a JWT in the Authorization header, a stream ticket in the `ticket` query parameter, or the session."""
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    if header:
+        try:
+            return await sync_to_async(auth.get_user)(auth.get_validated_token(auth.get_raw_token(header)))
+        except (InvalidToken, TokenError):
+            return None
+    if 'ticket' in request.GET:
+        try:
+            user_id = signing.loads(request.GET['ticket'], salt=TICKET_SALT, max_age=_setting('TICKET_SECONDS', 30))
+        except signing.BadSignature:
+            return None
+        return await User.objects.filter(pk=user_id, is_active=True).afirst()
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+async def officers_in_scope(user):
+    """Loan officer ids whose events the user may see, or None for all."""
+    if user.role in ['manager', 'superuser']:
+        return None
+    if user.role == 'region_manager':
+        queryset = User.objects.filter(role='loan_officer', region=user.region).values_list('id', flat=True)
+        return {officer_id async for officer_id in queryset}
+    return {user.pk}
+
+
+def _message(event):
+    data = {key: value for key, value in event.items() if key != 'id'}
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream(last_event_id, officer_ids):
+    subscription, backlog = hub.subscribe(last_event_id)
+    heartbeat = _setting('HEARTBEAT_SECONDS', 15)
+    try:
+        yield f"retry: {_setting('RETRY_MS', 3000)}\n\n"
+        if backlog is None:
+            # Events since last_event_id may be gone: the client reloads its lists
+            yield "event: resync\ndata: {}\n\n"
+            backlog = []
+        for event in backlog:
+            if officer_ids is None or event['officer_id'] in officer_ids:
+                yield _message(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the connection and notices clients that left
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                return
+            if officer_ids is None or event['officer_id'] in officer_ids:
+                yield _message(event)
+    finally:
+        subscription.close()
+
+
+async def payment_feed(request):
+    """
+    Server-Sent Events stream of payments and loan status changes: all of
+    them for managers, their region's officers' loans for region managers,
+    their own loans for loan officers. Serve it from the ASGI app.
+    """
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({'detail': "Authentication credentials were not provided."}, status=401)
+    if user.role not in FEED_ROLES:
+        return JsonResponse({'detail': "You do not have permission to perform this action."}, status=403)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    response = StreamingHttpResponse(
+        _stream(last_event_id, await officers_in_scope(user)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
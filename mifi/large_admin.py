@@ -0,0 +1,188 @@
+"""
+Admin changelists for tables with hundreds of thousands of rows.
+
+Django's admin counts every changelist twice with an exact COUNT(*), and
+searches with icontains, which scans the table and every joined one. Here the
+unfiltered count is read from the database's own statistics, filtered counts
+stop at COUNT_LIMIT, and search goes through the full-text index of the
+search app, so a changelist page costs a few indexed queries however big the
+table is. The statistics are those of the last ANALYZE (PostgreSQL's
+autovacuum keeps them current; on SQLite run ANALYZE or PRAGMA optimize
+after bulk loads): until then the unfiltered count is capped as well.
+
+Each shard's loan rows get an admin of their own, ShardAdminSite, in which
+every view runs with the shard pinned. Relations from loan rows to users
+are then on another database: LargeTableAdmin prefetches them instead of
+joining, and matches them by the ids the search finds.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
+from mifi import sharding
+from search.index import search
+
+
+def _setting(name, default):
+    return getattr(settings, 'LARGE_TABLE_ADMIN', {}).get(name, default)
+
+
+def estimated_count(queryset):
+    """Approximate row count of the queryset's table, or None if the backend can't tell."""
+    connection = connections[queryset.db]
+    model = queryset.model
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been vacuumed or analyzed once
+        return row[0] if row and row[0] >= 0 else None
+    if connection.vendor == 'sqlite':
+        # The ids are no guide: a shard's start at its FIRST_ID, and archiving leaves gaps
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                # Not analyzed yet
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [model._meta.db_table])
+            # Each row starts with the entries of one index; partial indexes have fewer than the table
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall() if stat]
+        return max(counts, default=None)
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Exact counts for small results; past COUNT_LIMIT rows, the table estimate
+    when nothing is filtered and COUNT_LIMIT otherwise. Pages past the real
+    end of the results show the admin's "invalid page" notice.
+    """
+
+    @cached_property
+    def count(self):
+        limit = _setting('COUNT_LIMIT', 10000)
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by().values('pk')[:limit].count()
+
+
+# In a search_index, the admin's own model rather than a relation of it
+THIS_MODEL = ''
+
+
+class LargeTableAdmin:
+    """
+    ModelAdmin mixin. `search_index` lists the lookup paths to models indexed
+    by the search app (THIS_MODEL for the model itself); a search matches
+    rows where any of them matches every word as a prefix, or the primary key
+    for a number. Admins without a search_index fall back to search_fields,
+    which should then use '^' or '=' lookups.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_index = ()
+
+    def crossing(self, path):
+        return sharding.crosses(self.model, self.model._meta.get_field(path).related_model)
+
+    def get_list_select_related(self, request):
+        related = super().get_list_select_related(request)
+        if isinstance(related, bool):
+            return related
+        return [path for path in related if not self.crossing(path)]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        crossing = [path for path in self.list_select_related or () if self.crossing(path)]
+        return queryset.prefetch_related(*crossing) if crossing else queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not self.search_index or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+
+        condition = models.Q()
+        for path in self.search_index:
+            if path == THIS_MODEL:
+                model, lookup = queryset.model, 'pk__in'
+            else:
+                model, lookup = queryset.model._meta.get_field(path).related_model, f'{path}__in'
+            matches = search(model._default_manager.all(), search_term).order_by().values('pk')
+            if sharding.crosses(queryset.model, model):
+                matches = list(matches.values_list('pk', flat=True)[:_setting('COUNT_LIMIT', 10000)])
+            condition |= models.Q(**{lookup: matches})
+        if search_term.isdigit():
+            condition |= models.Q(pk=int(search_term))
+        return queryset.filter(condition), False
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset over one page of INLINE_PER_PAGE related rows. The inline
+    sets `page` from its `page_param` query parameter, and `query` to the
+    request's query parameters, which the page links keep (the changelist
+    filters to go back to, other inlines' pages). The change form posts back
+    to the same URL, so the page is the same when the forms are saved.
+    """
+    page_param = 'p'
+    page = 1
+    query = QueryDict()
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            paginator = Paginator(super().get_queryset(), _setting('INLINE_PER_PAGE', 50))
+            self.page_obj = paginator.get_page(self.page)
+            self.page_range = list(paginator.get_elided_page_range(self.page_obj.number))
+            self._queryset = self.page_obj.object_list
+        return self._queryset
+
+    def page_links(self):
+        """(page number or ellipsis, URL of that page or None) for each entry of the page range."""
+        self.get_queryset()
+        links = []
+        for number in self.page_range:
+            url = None
+            if number not in (Paginator.ELLIPSIS, self.page_obj.number):
+                query = self.query.copy()
+                query[self.page_param] = number
+                url = f'?{query.urlencode()}'
+            links.append((number, url))
+        return links
+
+
+class ShardAdminSite(admin.AdminSite):
+    """
+    The admin at admin/<alias>/ for the loan rows on shard `alias`: the
+    ModelAdmins of admin.site, with the shard pinned while each view runs
+    and its response renders.
+    """
+
+    def __init__(self, alias):
+        super().__init__(name=f'admin-{alias}')
+        self.alias = alias
+        self.site_header = f"{admin.site.site_header} ({alias})"
+        self.site_title = f"{admin.site.site_title} ({alias})"
+        for model, model_admin in admin.site._registry.items():
+            self._registry[model] = type(model_admin)(model, self)
+
+    def admin_view(self, view, cacheable=False):
+        view = super().admin_view(view, cacheable)
+
+        @wraps(view)
+        def on_shard(request, *args, **kwargs):
+            with sharding.pinned(self.alias):
+                response = view(request, *args, **kwargs)
+                # A TemplateResponse runs the changelist queries as it renders
+                if hasattr(response, 'render'):
+                    response.render()
+            return response
+        return on_shard
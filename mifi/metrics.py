@@ -0,0 +1,246 @@
+"""
+Prometheus metrics shared across worker processes without an external service.
+
+Each process keeps its counters and histograms in memory and periodically
+writes them to its own JSON file under METRICS['DIR']. A scrape of /metrics
+merges every file in that directory, so the numbers cover all workers behind
+the same host, including ones that have since exited: a scrape folds the
+files of processes that are no longer running into one EXITED_FILE and
+deletes them, so the directory does not grow with every restart.
+"""
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = {
+    'mifi_http_requests_total': "HTTP requests by route, method and status",
+    'mifi_db_queries_total': "SQL queries issued while serving requests, by route",
+    'mifi_payments_posted_total': "Loan payments recorded, by loan kind",
+    'mifi_payment_failures_total': "Loan payment attempts that were rejected or failed, by loan kind",
+    'mifi_upload_bytes_total': "Bytes received in multipart uploads, by route",
+}
+
+HISTOGRAMS = {
+    'mifi_http_request_duration_seconds': ("Request latency by route and method", LATENCY_BUCKETS),
+}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_process_file = f"{os.getpid()}-{int(time.time() * 1000)}.json"
+_last_flush = 0.0
+
+EXITED_FILE = 'exited.json'
+
+
+def _setting(name, default):
+    return getattr(settings, 'METRICS', {}).get(name, default)
+
+
+def enabled():
+    return _setting('ENABLED', True)
+
+
+def metrics_dir():
+    return _setting('DIR', os.path.join(tempfile.gettempdir(), 'mifi-metrics'))
+
+
+def _key(name, labels):
+    return name + json.dumps(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not enabled():
+        return
+    with _lock:
+        _counters[_key(name, labels)] += value
+    flush()
+
+
+def inc_on_commit(name, value=1, **labels):
+    """inc() once the transaction open on 'default' commits, and not at all if it rolls back."""
+    transaction.on_commit(lambda: inc(name, value, **labels))
+
+
+def observe(name, value, **labels):
+    if not enabled():
+        return
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        key = _key(name, labels)
+        state = _histograms.setdefault(key, {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0})
+        state['buckets'][bisect_left(buckets, value)] += 1
+        state['sum'] += value
+        state['count'] += 1
+    flush()
+
+
+def flush(force=False):
+    """Write this process's values to its file, at most every FLUSH_SECONDS."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < _setting('FLUSH_SECONDS', 5):
+        return
+    with _lock:
+        _last_flush = now
+        snapshot = json.dumps({'counters': _counters, 'histograms': _histograms})
+
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _process_file)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as fh:
+        fh.write(snapshot)
+    os.replace(tmp_path, path)
+
+
+atexit.register(flush, force=True)
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(counters, histograms, data):
+    for key, value in data['counters'].items():
+        counters[key] += value
+    for key, state in data['histograms'].items():
+        merged = histograms.setdefault(key, {'buckets': [0] * len(state['buckets']), 'sum': 0.0, 'count': 0})
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], state['buckets'])]
+        merged['sum'] += state['sum']
+        merged['count'] += state['count']
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _retire_exited(directory):
+    """Fold the files of processes that are no longer running into EXITED_FILE."""
+    exited = []
+    for filename in os.listdir(directory):
+        pid = filename.split('-', 1)[0]
+        if filename.endswith('.json') and pid.isdigit() and not _running(int(pid)):
+            exited.append(filename)
+    if not exited:
+        return
+
+    # One scrape at a time, so a file is never added twice
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = os.path.join(directory, EXITED_FILE)
+        counters, histograms = defaultdict(float), {}
+        _merge(counters, histograms, _read(path) or {'counters': {}, 'histograms': {}})
+        exited = [name for name in exited if os.path.exists(os.path.join(directory, name))]
+        for filename in exited:
+            data = _read(os.path.join(directory, filename))
+            if data is not None:
+                _merge(counters, histograms, data)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as fh:
+            fh.write(json.dumps({'counters': counters, 'histograms': histograms}))
+        os.replace(tmp_path, path)
+        for filename in exited:
+            os.remove(os.path.join(directory, filename))
+
+
+def collect():
+    """Merge the files written by every process into one set of values."""
+    flush(force=True)
+    counters = defaultdict(float)
+    histograms = {}
+
+    directory = metrics_dir()
+    _retire_exited(directory)
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        data = _read(os.path.join(directory, filename))
+        if data is not None:
+            _merge(counters, histograms, data)
+
+    return counters, histograms
+
+
+def _split_key(key):
+    name, labels = key.split('[', 1)
+    return name, dict(json.loads('[' + labels))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def render(gauges=None):
+    """Prometheus text exposition format (version 0.0.4)."""
+    counters, histograms = collect()
+    by_name = defaultdict(list)
+    for key, value in counters.items():
+        name, labels = _split_key(key)
+        by_name[name].append((labels, value))
+
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(by_name.get(name, []), key=lambda item: sorted(item[0].items())):
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key in sorted(k for k in histograms if k.startswith(name + '[')):
+            state = histograms[key]
+            _, labels = _split_key(key)
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], state['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {state['sum']:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {state['count']}")
+
+    for name, (help_text, samples) in (gauges or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def observe_request(request, response, duration, sql_count):
+    """Called by ServerTimingMiddleware once per request."""
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match is not None else 'unmatched'
+
+    observe('mifi_http_request_duration_seconds', duration, route=route, method=request.method)
+    inc('mifi_http_requests_total', route=route, method=request.method, status=response.status_code)
+    if sql_count:
+        inc('mifi_db_queries_total', sql_count, route=route)
+    if request.content_type == 'multipart/form-data':
+        inc('mifi_upload_bytes_total', int(request.META.get('CONTENT_LENGTH') or 0), route=route)
@@ -0,0 +1,174 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from mifi import metrics
+
+slow_request_logger = logging.getLogger('mifi.slow_requests')
+
+_local = threading.local()
+
+
+def _setting(name, default):
+    return getattr(settings, 'PERF_INSTRUMENTATION', {}).get(name, default)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.depth = 0
+
+    def record_sql(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.sql_count += 1
+            self.statements[sql] += 1
+
+
+def current_timings():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timed_serializer():
+    """Time the outermost serializer `.data` call of the current request."""
+    timings = current_timings()
+    if timings is None or timings.depth:
+        yield
+        return
+    timings.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer_time += time.perf_counter() - started
+        timings.depth -= 1
+
+
+def _instrument_serializers():
+    # DRF has no hook around `.data`, which is where representation work
+    # happens, so the property is wrapped once per process
+    from rest_framework import serializers
+
+    for cls in (serializers.BaseSerializer, serializers.Serializer, serializers.ListSerializer):
+        original = cls.__dict__['data']
+        if getattr(original.fget, 'instrumented', False):
+            continue
+
+        def data(self, _fget=original.fget):
+            with timed_serializer():
+                return _fget(self)
+
+        data.instrumented = True
+        cls.data = property(data)
+
+
+class ServerTimingMiddleware:
+    """
+    Measures SQL (count and time, on every database the request touches),
+    serializer and render time per request.
+    Staff users get the numbers back in a Server-Timing header; requests
+    slower than PERF_INSTRUMENTATION['SLOW_REQUEST_MS'] are written to the
+    `mifi.slow_requests` logger as JSON with their most repeated statements.
+    Latency, query counts and upload sizes also feed the /metrics endpoint.
+    """
+
+    def __init__(self, get_response):
+        if not _setting('ENABLED', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.slow_request_ms = _setting('SLOW_REQUEST_MS', 500)
+        self.top_statements = _setting('TOP_STATEMENTS', 5)
+        _instrument_serializers()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        _local.timings = timings
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                # Loan queries go to the shards, the ledger and users to 'default'
+                for alias_connection in connections.all():
+                    stack.enter_context(alias_connection.execute_wrapper(timings.record_sql))
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        total = time.perf_counter() - started
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = ', '.join([
+                f'sql;dur={timings.sql_time * 1000:.1f};desc="{timings.sql_count} queries"',
+                f'serializer;dur={timings.serializer_time * 1000:.1f}',
+                f'render;dur={timings.render_time * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ])
+
+        if total * 1000 >= self.slow_request_ms:
+            self.log_slow_request(request, response, timings, total)
+
+        metrics.observe_request(request, response, total, timings.sql_count)
+
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered by the handler straight after this hook
+        timings = current_timings()
+        if timings is not None:
+            render_started = time.perf_counter()
+
+            def record_render(rendered_response):
+                timings.render_time += time.perf_counter() - render_started
+
+            response.add_post_render_callback(record_render)
+        return response
+
+    def log_slow_request(self, request, response, timings, total):
+        user = getattr(request, 'user', None)
+        slow_request_logger.warning(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'total_ms': round(total * 1000, 1),
+            'sql_ms': round(timings.sql_time * 1000, 1),
+            'sql_count': timings.sql_count,
+            'serializer_ms': round(timings.serializer_time * 1000, 1),
+            'render_ms': round(timings.render_time * 1000, 1),
+            'top_statements': [
+                {'count': count, 'sql': sql}
+                for sql, count in timings.statements.most_common(self.top_statements)
+                if count > 1
+            ],
+        }))
+
+
+class RateLimitHeadersMiddleware:
+    """Reports the budget RequestThrottle charged the request to as X-RateLimit-* headers."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            limit, remaining, reset = rate_limit
+            response['X-RateLimit-Limit'] = limit
+            response['X-RateLimit-Remaining'] = remaining
+            response['X-RateLimit-Reset'] = reset
+        return response
@@ -1,6 +1,8 @@
 from pathlib import Path
 from datetime import timedelta
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -23,6 +25,11 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",  # Add this if you might use IP address
 ]
 
+# Idempotency-Key (create requests) is read by the idempotency app, If-Match
+# (loan and membership updates) by core.preconditions
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'if-match')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'ETag']
+
 # These are the critical settings for credentialed requests
 CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = [
@@ -45,7 +52,17 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',  # Default permission
-    ]
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'mifi.throttling.RequestThrottle',
+    ],
+    # Per user, or per IP address before login
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/min',
+        'payments': '120/min',
+        'list': '300/min',
+        'reports': '30/min',
+    },
 }
 
 
@@ -66,10 +83,18 @@ INSTALLED_APPS = [
     'apis',
     'core',
     'users',
-    'reports'
+    'reports',
+    'jobs',
+    'search',
+    'ledger',
+    'live',
+    'outbox',
+    'archive',
+    'idempotency',
 ]
 
 MIDDLEWARE = [
+    'mifi.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -78,6 +103,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mifi.middleware.RateLimitHeadersMiddleware',
 ]
 
 ROOT_URLCONF = 'mifi.urls'
@@ -117,6 +143,21 @@ DATABASES = {
     }
 }
 
+# Loans by region across databases (mifi.sharding): each shard holds the
+# loans of its REGIONS, with ids from FIRST_ID up, and every other region
+# stays on 'default'. `manage.py migrate --database=<alias>` creates a
+# shard's tables and `manage.py move_loans_to_shards` moves the loans already
+# on 'default'. Locally a shard is just another SQLite file:
+#
+#   DATABASES['lusaka'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db_lusaka.sqlite3'}
+#   SHARDING['SHARDS']['lusaka'] = {'REGIONS': ['Lusaka'], 'FIRST_ID': 10 ** 12}
+#
+# mifi/settings_test.py does just that for `manage.py test --settings=mifi.settings_test`.
+SHARDING = {
+    'SHARDS': {},
+}
+DATABASE_ROUTERS = ['mifi.sharding.RegionRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -163,6 +204,153 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Per-request SQL/serializer/render timings (Server-Timing header for staff)
+# and a JSON log of requests slower than SLOW_REQUEST_MS
+PERF_INSTRUMENTATION = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 500,
+    'TOP_STATEMENTS': 5,
+}
+
+# Prometheus text endpoint at /metrics. Each worker process writes its values
+# under DIR, and a scrape merges them all
+METRICS = {
+    'ENABLED': True,
+    'DIR': BASE_DIR / 'var' / 'metrics',
+    'FLUSH_SECONDS': 5,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+# Month-end client statements: zip parts and a manifest per period under DIR
+STATEMENTS = {
+    'DIR': BASE_DIR / 'var' / 'statements',
+}
+
+# Admin changelists on big tables: counts past COUNT_LIMIT rows are estimated,
+# and inlines show INLINE_PER_PAGE rows at a time
+LARGE_TABLE_ADMIN = {
+    'COUNT_LIMIT': 10000,
+    'INLINE_PER_PAGE': 50,
+}
+
+# Throttle counters, shared by the worker processes on a host
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'mifi.throttling.ThrottleCache',
+        'LOCATION': BASE_DIR / 'var' / 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+# Live payment feed (Server-Sent Events, served by the ASGI app). Processes
+# on a host pass events through Unix sockets in SOCKET_DIR; the last BUFFER
+# events can be resumed with Last-Event-ID. Browsers open the stream with a
+# ticket from live/ticket/, good for TICKET_SECONDS
+LIVE = {
+    'SOCKET_DIR': BASE_DIR / 'var' / 'live',
+    'BUFFER': 1000,
+    'QUEUE_SIZE': 200,
+    'HEARTBEAT_SECONDS': 15,
+    'RETRY_MS': 3000,
+    'TICKET_SECONDS': 30,
+}
+
+# Transactional outbox: events for downstream systems, delivered in order by
+# `manage.py dispatch_outbox` (or the outbox.dispatch job) to each sink.
+# Sinks use outbox.sinks.HttpSink (URL, TIMEOUT, HEADERS) or
+# outbox.sinks.FileSink (PATH), optionally limited to TOPICS. An event id
+# the dispatcher passes over is waited for GAP_TIMEOUT_SECONDS, which must be
+# longer than any transaction that writes events
+OUTBOX = {
+    'BATCH_SIZE': 500,
+    'GAP_TIMEOUT_SECONDS': 3600,
+    'RETRY_BACKOFF_SECONDS': 5,
+    'RETRY_BACKOFF_MAX_SECONDS': 600,
+    'LOCK_TIMEOUT_SECONDS': 300,
+    'RETENTION_DAYS': 7,
+    'SINKS': {
+        'archive': {
+            'BACKEND': 'outbox.sinks.FileSink',
+            'PATH': BASE_DIR / 'var' / 'outbox' / 'events.jsonl',
+        },
+        # 'sms': {
+        #     'BACKEND': 'outbox.sinks.HttpSink',
+        #     'URL': 'http://127.0.0.1:8900/events',
+        #     'TOPICS': ['payment.posted', 'member.blocked'],
+        # },
+    },
+}
+
+# Completed loans (by their last change) older than AFTER_MONTHS move to the
+# archive tables, CHUNK_SIZE loans per transaction: `manage.py archive_loans`
+# or the archive.loans job; `manage.py restore_loans` brings them back
+ARCHIVE = {
+    'AFTER_MONTHS': 12,
+    'CHUNK_SIZE': 200,
+}
+
+# Daily interest and penalty accrual (`manage.py accrue_interest` or the
+# ledger.accrue_interest job): one worker runs a date at a time, and a worker
+# that died frees it after LOCK_TIMEOUT_SECONDS
+ACCRUAL = {
+    'LOCK_TIMEOUT_SECONDS': 300,
+}
+
+# Create requests sent with an Idempotency-Key run once per user and key;
+# retries get the stored response for TTL_HOURS (`manage.py
+# purge_idempotency_keys` or the idempotency.purge job clears older keys).
+# A request that died holding a key frees it after LOCK_SECONDS
+IDEMPOTENCY = {
+    'TTL_HOURS': 24,
+    'LOCK_SECONDS': 300,
+}
+
+# POST batch/ runs up to MAX_REQUESTS API calls in one round trip
+BATCH = {
+    'MAX_REQUESTS': 20,
+}
+
+# Loan officer dashboard, cached per officer for CACHE_SECONDS
+DASHBOARD = {
+    'CACHE': 'default',
+    'CACHE_SECONDS': 60,
+}
+
+THROTTLING = {
+    'ENABLED': True,
+    'CACHE': 'throttle',
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'mifi.slow_requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Background jobs (run with `manage.py run_jobs`)
+JOB_QUEUE = {
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF_SECONDS': 30,
+    'RETRY_BACKOFF_MAX_SECONDS': 3600,
+    'LOCK_TIMEOUT_SECONDS': 900,
+}
+
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -0,0 +1,15 @@
+"""
+Settings for the test suite with a second database: the loans of the
+Lusaka region go to the 'lusaka' shard and every other region stays on
+'default', so the tests run across shards the way production does.
+
+    python manage.py test --settings=mifi.settings_test
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES['lusaka'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db_lusaka.sqlite3'}
+SHARDING = {
+    'SHARDS': {
+        'lusaka': {'REGIONS': ['Lusaka'], 'FIRST_ID': 10 ** 12},
+    },
+}
@@ -0,0 +1,339 @@
+"""
+Loans kept on one database per region.
+
+SHARDING['SHARDS'] names the databases (shards) that hold the loans of
+particular regions; loans of every other region stay on 'default'. A loan
+is placed by its loan officer's region, and its payments, memberships and
+collateral go wherever the loan is, so the rows of one loan are always on
+one database and its joins and transactions stay local. Everything else
+(users, the ledger, the outbox, the archive, reports) lives on 'default'
+only, which is why the foreign keys from loan rows to users are not
+enforced by the database.
+
+RegionRouter places new rows, and sends queries reached through an object
+(loan.payments, payment.loan) to that object's database; the models' own
+methods (loan.record_payment(), payment.delete(), the counters) work on
+their row's database the same way. Any other query on a loan table goes
+to the shard pinned for the work in hand: ShardedViewMixin pins the
+user's region for an API request, tasks pin each shard in turn
+(each_shard), and unpinned code reads 'default'. Managers see the loans
+of every region, and a client's loans follow their loan officers' regions
+rather than the client's: for both, lists are run on every shard and
+merged, and a loan they open is looked up on each shard.
+
+Ids on a shard start at its FIRST_ID, so loans and payments have ids that
+are unique across databases: the ledger, archive and outbox refer to them
+by id alone.
+
+Work over the whole portfolio (accrual, the ledger commands, statements,
+archiving, counters) goes through each_shard, the onboarding import writes
+each loan to its officer's shard, and every shard has an admin of its own
+at admin/<alias>/ (mifi.large_admin.ShardAdminSite).
+"""
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from rest_framework.response import Response
+
+MANAGER_ROLES = ['superuser', 'manager', 'region_manager']
+
+_pinned = ContextVar('shard', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, 'SHARDING', {}).get(name, default)
+
+
+def shards():
+    """Every database holding loans: 'default' first, then the shards."""
+    return [DEFAULT_DB_ALIAS, *_setting('SHARDS', {})]
+
+
+def shard_for_region(region):
+    for alias, shard in _setting('SHARDS', {}).items():
+        if region in shard.get('REGIONS', ()):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def home_shard(user):
+    return shard_for_region(getattr(user, 'region', None))
+
+
+def is_manager(user):
+    return getattr(user, 'role', None) in MANAGER_ROLES
+
+
+def reads_every_shard(user):
+    """
+    Whether the loans `user` can see may be on any shard: managers see every
+    region, and a client's loans are on their loan officers' shards. Only a
+    loan officer's loans are all on their home shard.
+    """
+    return len(shards()) > 1 and getattr(user, 'role', None) != 'loan_officer'
+
+
+def is_sharded(model):
+    """Loan rows, which declare in `shard_by` what places them."""
+    return getattr(model, 'shard_by', None) is not None
+
+
+def crosses(model, related_model):
+    """Whether rows of the two models can be on different databases, so no query joins them."""
+    return len(shards()) > 1 and is_sharded(model) != is_sharded(related_model)
+
+
+def current():
+    return _pinned.get() or DEFAULT_DB_ALIAS
+
+
+def database_of(instance, using=None):
+    """The database a loan row is on, or will be saved to (`using`, when save() is given one)."""
+    return using or router.db_for_write(type(instance), instance=instance)
+
+
+@contextmanager
+def pinned(alias):
+    """Send loan queries with no object to go by to `alias` while the block runs."""
+    token = _pinned.set(alias)
+    try:
+        yield alias
+    finally:
+        _pinned.reset(token)
+
+
+def each_shard():
+    """Iterate over shards() with each one pinned while the loop body runs."""
+    for alias in shards():
+        with pinned(alias):
+            yield alias
+
+
+@contextmanager
+def atomic(aliases=None):
+    """
+    transaction.atomic() on 'default' and on the pinned shard (or on each
+    of `aliases`). The block's writes commit together on each database, one
+    database after another: there is no two-phase commit between them.
+    """
+    aliases = aliases or [current()]
+    with ExitStack() as stack:
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *aliases]):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def locate(model, pk):
+    """The database holding `model` row `pk`, or None."""
+    for alias in shards():
+        if model._base_manager.using(alias).filter(pk=pk).exists():
+            return alias
+    return None
+
+
+def _sort_key(name):
+    path = name.lstrip('-').replace('__', '.').split('.')
+
+    def key(row):
+        for attr in path:
+            row = row[attr] if isinstance(row, dict) else getattr(row, attr)
+        # NULLs first, as the databases sort them ascending
+        return row is not None, row
+    return key
+
+
+def merged(querysets):
+    """The rows of one query run on several databases, in the query's order."""
+    rows = [row for queryset in querysets for row in queryset]
+    if len(querysets) > 1:
+        query = querysets[0].query
+        ordering = [name for name in (query.order_by or query.get_meta().ordering) if isinstance(name, str)]
+        # Sorting by the last key first leaves the rows ordered by all of them
+        for name in reversed(ordering):
+            rows.sort(key=_sort_key(name), reverse=name.startswith('-'))
+    return rows
+
+
+def prefetch_across(rows, names):
+    """
+    Fill the many-to-many relations `names` of `rows`, whose far side is on
+    another database: prefetch_related would join the two tables. The
+    through rows are read where `rows` are and the related rows where
+    they are.
+    """
+    if not rows or not names:
+        return
+    by_database = defaultdict(list)
+    for row in rows:
+        by_database[row._state.db].append(row)
+    meta = rows[0]._meta
+    for name in names:
+        field = meta.get_field(name)
+        through = field.remote_field.through._meta
+        source = through.get_field(field.m2m_field_name()).attname
+        target = through.get_field(field.m2m_reverse_field_name()).attname
+        for alias, group in by_database.items():
+            pairs = list(
+                through.model._base_manager.using(alias)
+                .filter(**{f'{source}__in': [row.pk for row in group]})
+                .order_by('pk').values_list(source, target)
+            )
+            related = field.related_model._default_manager.in_bulk({target_id for _, target_id in pairs})
+            linked = defaultdict(list)
+            for source_id, target_id in pairs:
+                if target_id in related:
+                    linked[source_id].append(related[target_id])
+            for row in group:
+                # What prefetch_related would have left on the row
+                queryset = getattr(row, name).all()
+                queryset._result_cache = linked[row.pk]
+                queryset._prefetch_done = True
+                row.__dict__.setdefault('_prefetched_objects_cache', {})[name] = queryset
+
+
+class RegionRouter:
+    """Loan rows on their region's shard; every other model on 'default'."""
+
+    def placement(self, instance):
+        field = instance._meta.get_field(instance.shard_by)
+        if field.is_cached(instance):
+            owner = field.get_cached_value(instance)
+        elif field.related_model is not None and not is_sharded(field.related_model):
+            owner = getattr(instance, instance.shard_by)
+        else:
+            # A loan that is not loaded yet: whichever shard the work is on
+            return current()
+        if owner is None:
+            return current()
+        if is_sharded(type(owner)):
+            return owner._state.db or self.placement(owner)
+        return shard_for_region(getattr(owner, 'region', None))
+
+    def route(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)):
+            if instance._state.adding:
+                return self.placement(instance)
+            return instance._state.db
+        return current()
+
+    db_for_read = route
+    db_for_write = route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            # A new row's database is only a guess (e.g. from a user assigned
+            # first) until save() places it by its owner
+            return obj1._state.db == obj2._state.db or obj1._state.adding or obj2._state.adding
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in _setting('SHARDS', {}):
+            return None
+        if model_name is None:
+            return False
+        try:
+            return is_sharded(apps.get_model(app_label, model_name))
+        except LookupError:
+            # Dropped since: only its own migrations refer to it
+            return False
+
+
+def start_ids(using, **kwargs):
+    """post_migrate: start the ids of a shard's tables at its FIRST_ID."""
+    first_id = _setting('SHARDS', {}).get(using, {}).get('FIRST_ID')
+    if not first_id:
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in apps.get_models():
+            if not is_sharded(model):
+                continue
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)", [table, table]
+                )
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s", [first_id - 1, table, first_id - 1])
+            elif connection.vendor == 'postgresql':
+                column = model._meta.pk.column
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), GREATEST(%s, "
+                    f"(SELECT COALESCE(MAX({connection.ops.quote_name(column)}), 0) FROM {connection.ops.quote_name(table)})))",
+                    [table, column, first_id - 1]
+                )
+            else:
+                raise ImproperlyConfigured(f"FIRST_ID is not supported on {connection.vendor} databases.")
+
+
+def across(model, serializer):
+    """The many-to-many relations `serializer` renders that prefetch_related cannot fetch."""
+    sources = {field.source for field in serializer.fields.values() if not field.write_only}
+    return [
+        field.name for field in model._meta.many_to_many
+        if field.name in sources and crosses(model, field.related_model)
+    ]
+
+
+class ShardedSerializerMixin:
+    """ModelSerializers of loan rows: see prefetch_across. A list view fills the relations for all its rows first."""
+
+    def to_representation(self, instance):
+        cached = getattr(instance, '_prefetched_objects_cache', {})
+        prefetch_across([instance], [name for name in across(type(instance), self) if name not in cached])
+        return super().to_representation(instance)
+
+
+class ShardedViewMixin:
+    """
+    Viewsets over loan rows: the request runs on the user's shard. For users
+    who read every shard (managers and clients), a request about one loan
+    runs on the shard holding it (see `shard_lookup`) and a list is run on
+    every shard.
+    """
+    # (URL keyword, loan model): the loan a request is about
+    shard_lookup = None
+    shard = None
+    _shard_token = None
+
+    def get_shard_lookup(self):
+        return self.shard_lookup
+
+    def dispatch(self, request, *args, **kwargs):
+        # initial() pins the shard once the user is known; whatever happens after, the pin goes with the request
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._shard_token is not None:
+                _pinned.reset(self._shard_token)
+                self._shard_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.shard = home_shard(request.user)
+        lookup = self.get_shard_lookup()
+        if reads_every_shard(request.user) and lookup and self.kwargs.get(lookup[0]) is not None:
+            self.shard = locate(lookup[1], self.kwargs[lookup[0]]) or self.shard
+        self._shard_token = _pinned.set(self.shard)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if reads_every_shard(request.user):
+            rows = merged([queryset.using(alias) for alias in shards()])
+        else:
+            rows = queryset
+        page = self.paginate_queryset(rows)
+        rows = list(rows if page is None else page)
+        serializer = self.get_serializer(rows, many=True)
+        prefetch_across(rows, across(queryset.model, serializer.child))
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
@@ -0,0 +1,171 @@
+"""
+Sparse fieldsets and on-demand expansion for read requests.
+
+`?fields=id,amount,payments.amount` keeps only the named fields (a dotted
+name reaches into a nested object) and `?expand=recipient,payments.member`
+renders the named relations as nested objects. Once a client sends either
+parameter, every relation it did not expand is rendered as its id (or list
+of ids), which needs no join: a foreign key's id is already on the row and
+a to-many relation is prefetched as bare ids. Without either parameter the
+response keeps its full shape.
+
+SparseSerializerMixin prunes a serializer's fields to the requested shape;
+SparseQuerysetMixin then derives select_related/prefetch_related from the
+fields that are left, so a viewset queries exactly what it will serialize.
+Only GET and HEAD are shaped: the fields of a write are its input too.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from . import sharding
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def parse(value):
+    """'id,payments.amount,payments.member' -> {'id': {}, 'payments': {'amount': {}, 'member': {}}}"""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def requested_shape(request):
+    """(fields tree or None for all, expand tree) from the query string, or None for the full shape."""
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = request.query_params
+    if FIELDS_PARAM not in params and EXPAND_PARAM not in params:
+        return None
+    only = parse(params[FIELDS_PARAM]) if params.get(FIELDS_PARAM) else None
+    return only, parse(params.get(EXPAND_PARAM))
+
+
+def _relation(model, source):
+    if model is None or not source or source == '*' or '.' in source:
+        return None
+    try:
+        field = model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def _nested(field):
+    return field.child if isinstance(field, serializers.ListSerializer) else field
+
+
+def _ids(field, relation):
+    """The id-only stand-in for an unexpanded nested serializer."""
+    many = relation.one_to_many or relation.many_to_many
+    return serializers.PrimaryKeyRelatedField(read_only=True, many=many, source=field.source)
+
+
+class SparseSerializerMixin:
+    """
+    ModelSerializers: drop the fields the request did not ask for and
+    collapse unexpanded relations to ids. The root serializer reads the
+    request; nested ones are handed their part of the shape by their parent.
+    """
+    sparse_shape = None
+
+    def _root_shape(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None
+        return requested_shape(self.context.get('request'))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        shape = self.sparse_shape or self._root_shape()
+        if shape is None:
+            return fields
+        only, expand = shape
+        model = getattr(getattr(self, 'Meta', None), 'model', None)
+
+        for name in list(fields):
+            field = fields[name]
+            if field.write_only:
+                continue
+            if only is not None and name not in only:
+                del fields[name]
+                continue
+            nested = _nested(field)
+            if not isinstance(nested, serializers.BaseSerializer):
+                continue
+            sub_fields = (only or {}).get(name)
+            if name in expand or sub_fields:
+                if isinstance(nested, SparseSerializerMixin):
+                    nested.sparse_shape = (sub_fields or None, expand.get(name, {}))
+                continue
+            relation = _relation(model, field.source or name)
+            if relation is not None:
+                fields[name] = _ids(field, relation)
+        return fields
+
+
+def related_lookups(serializer, model, prefix=''):
+    """
+    (select_related, prefetch_related) lookups covering the relations that
+    `serializer` renders. A to-many relation is prefetched with a queryset
+    shaped the same way, so the foreign keys below it are joined into the
+    prefetch query rather than prefetched one level further down.
+    """
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        relation = _relation(model, field.source)
+        if relation is None:
+            continue
+        path = prefix + field.source
+        many = relation.one_to_many or relation.many_to_many
+        related = relation.related_model._default_manager
+        nested = _nested(field)
+        if sharding.crosses(model, relation.related_model):
+            # On another database, so never joined: a foreign key is prefetched
+            # and a many-to-many filled in by sharding.prefetch_across
+            if isinstance(nested, serializers.BaseSerializer) and not many:
+                prefetch.append(Prefetch(path, queryset=shape_queryset(related.all(), nested)))
+            continue
+        if isinstance(nested, serializers.BaseSerializer):
+            if many:
+                prefetch.append(Prefetch(path, queryset=shape_queryset(related.all(), nested)))
+            else:
+                select.append(path)
+                inner_select, inner_prefetch = related_lookups(nested, relation.related_model, path + '__')
+                select += inner_select
+                prefetch += inner_prefetch
+        elif many:
+            # Ids only: no columns beyond what the prefetch matches rows on
+            columns = ['pk'] + ([relation.field.attname] if relation.one_to_many else [])
+            prefetch.append(Prefetch(path, queryset=related.only(*columns)))
+    return select, prefetch
+
+
+def shape_queryset(queryset, serializer):
+    """`queryset` with the joins and prefetches `serializer` will need, and no others."""
+    select, prefetch = related_lookups(serializer, queryset.model)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class SparseQuerysetMixin:
+    """Generic viewsets: fetch the relations the (possibly sparse) serializer renders."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        return shape_queryset(queryset, self.get_serializer())
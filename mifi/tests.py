@@ -0,0 +1,329 @@
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import viewsets
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from archive.models import ArchivedLoan
+from archive.store import archive_completed, restore_loans
+from core.models import IndividualLoan, IndividualLoanPayment
+from core.tests import make_group_loan, make_individual_loan, make_user
+from core.views import IndividualLoanViewSet
+from ledger.accrual import accrue
+from mifi import metrics, sharding
+from mifi.large_admin import estimated_count
+from users.models import User
+
+SHARDS = getattr(settings, 'SHARDING', {}).get('SHARDS', {})
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        settings = override_settings(METRICS={'DIR': self.dir})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def counter(self, name, **labels):
+        counters, _ = metrics.collect()
+        return counters.get(metrics._key(name, labels), 0)
+
+    def write(self, filename, value):
+        key = metrics._key('mifi_payments_posted_total', {'kind': 'test'})
+        with open(os.path.join(self.dir, filename), 'w') as fh:
+            json.dump({'counters': {key: value}, 'histograms': {}}, fh)
+
+    def test_exited_processes_are_folded_into_one_file(self):
+        dead_pid = 2 ** 22 + 1
+        self.write(f'{dead_pid}-1.json', 2)
+        self.write(f'{dead_pid}-2.json', 3)
+        self.assertEqual(self.counter('mifi_payments_posted_total', kind='test'), 5)
+        self.assertNotIn(f'{dead_pid}-1.json', os.listdir(self.dir))
+        self.assertIn(metrics.EXITED_FILE, os.listdir(self.dir))
+
+        self.write(f'{dead_pid}-3.json', 1)
+        self.assertEqual(self.counter('mifi_payments_posted_total', kind='test'), 6)
+        self.assertEqual(self.counter('mifi_payments_posted_total', kind='test'), 6)
+
+    def test_running_processes_keep_their_files(self):
+        self.write(f'{os.getppid()}-1.json', 4)
+        self.assertEqual(self.counter('mifi_payments_posted_total', kind='test'), 4)
+        self.assertIn(f'{os.getppid()}-1.json', os.listdir(self.dir))
+
+    def test_counts_only_committed_work(self):
+        before = self.counter('mifi_payments_posted_total', kind='commit')
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    metrics.inc_on_commit('mifi_payments_posted_total', kind='commit')
+                    raise ValueError
+            except ValueError:
+                pass
+            metrics.inc_on_commit('mifi_payments_posted_total', kind='commit')
+        self.assertEqual(self.counter('mifi_payments_posted_total', kind='commit'), before + 1)
+
+
+class ThrottleTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            CACHES={'throttle': {'BACKEND': 'mifi.throttling.ThrottleCache', 'LOCATION': directory.name}},
+            THROTTLING={'ENABLED': True, 'CACHE': 'throttle'},
+            REST_FRAMEWORK={**api_settings.user_settings, 'DEFAULT_THROTTLE_RATES': {'list': '3/min'}},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_concurrent_increments_are_not_lost(self):
+        cache = caches['throttle']
+        cache.add('counter', 0)
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda _: cache.incr('counter'), range(200)))
+        self.assertEqual(cache.get('counter'), 200)
+        self.assertFalse(cache.add('counter', 0))
+
+    def test_budget_is_enforced_with_headers(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='manager@example.com', nrc_number='000001/10/1', first_name='Ana', last_name='Phiri', role='manager'
+        ))
+        responses = [client.get('/api/test/v1/individual/') for _ in range(4)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 429])
+        self.assertEqual([r['X-RateLimit-Remaining'] for r in responses], ['2', '1', '0', '0'])
+        self.assertIn('Retry-After', responses[3])
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class ServerTimingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        officers = [make_user('loan_officer', region) for region in ('Home region outside every shard', 'Lusaka')]
+        for officer in officers:
+            make_individual_loan(officer)
+        self.client = APIClient()
+
+    def get(self, user):
+        self.client.force_authenticate(user)
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in sharding.shards()]
+            response = self.client.get('/api/test/v1/individual/')
+        self.assertEqual(response.status_code, 200)
+        return response, sum(len(queries) for queries in captured)
+
+    def test_staff_see_the_queries_of_every_database(self):
+        response, queries = self.get(make_user('manager', is_staff=True))
+        timings = dict(re.findall(r'(\w+);dur=[\d.]+(?:;desc="(\d+) queries")?', response['Server-Timing']))
+        self.assertEqual(set(timings), {'sql', 'serializer', 'render', 'total'})
+        self.assertEqual(int(timings['sql']), queries)
+
+    def test_other_users_get_no_header(self):
+        response, _ = self.get(make_user('manager'))
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class SparseFieldsTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        # Loans and users both on 'default', where assertNumQueries counts
+        officer = make_user('loan_officer', 'Home region outside every shard')
+        self.loans = [make_individual_loan(officer) for _ in range(3)]
+        self.payments = {loan.pk: loan.make_normal_payment(Decimal('10.00'), officer) for loan in self.loans}
+        self.client = APIClient()
+        self.client.force_authenticate(officer)
+
+    def get(self, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/test/v1/individual/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_fields_leave_out_the_relations_they_do_not_name(self):
+        rows = self.get(1, fields='id,amount')
+        self.assertEqual(rows[0], {'id': self.loans[-1].pk, 'amount': '1000.00'})
+
+    def test_unexpanded_relations_are_ids(self):
+        newest = self.loans[-1]
+        rows = self.get(2, fields='id,payments,recipient')
+        self.assertEqual(
+            rows[0], {'id': newest.pk, 'payments': [self.payments[newest.pk].pk], 'recipient': newest.recipient_id}
+        )
+
+    def test_expanded_relations_are_fetched_once_for_the_page(self):
+        # A join, or a prefetch when the users may be on another database than the loans
+        rows = self.get(1 + sharding.crosses(IndividualLoan, User), fields='id,recipient.first_name', expand='recipient')
+        self.assertEqual(rows[0]['recipient'], {'first_name': self.loans[-1].recipient.first_name})
+
+        rows = self.get(
+            2 + sharding.crosses(IndividualLoanPayment, User),
+            fields='id,payments.amount,payments.recorded_by.last_name', expand='payments.recorded_by',
+        )
+        recorded_by = {'last_name': self.loans[-1].loan_officer.last_name}
+        self.assertEqual(rows[0]['payments'], [{'amount': '10.00', 'recorded_by': recorded_by}])
+
+
+@override_settings(LARGE_TABLE_ADMIN={'INLINE_PER_PAGE': 2})
+class LargeTableAdminTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(
+            email='admin@example.com', password=None, nrc_number='000000/10/1', first_name='Ana', last_name='Phiri'
+        ))
+
+    def test_inline_page_links_keep_the_query(self):
+        officer = make_user('loan_officer', 'Home region outside every shard')
+        group = make_group_loan(officer, [make_user() for _ in range(5)])
+        response = self.client.get(
+            f'/admin/core/grouploan/{group.pk}/change/',
+            {'_changelist_filters': 'status__exact=active', 'groupmemberstatus_page': 2},
+        )
+        self.assertEqual(response.status_code, 200)
+        links = re.findall(r'<a href="(\?[^"]*groupmemberstatus_page=\d+[^"]*)"', response.content.decode())
+        self.assertEqual(links, [
+            '?_changelist_filters=status__exact%3Dactive&amp;groupmemberstatus_page=1',
+            '?_changelist_filters=status__exact%3Dactive&amp;groupmemberstatus_page=3',
+        ])
+
+    def test_search_matches_the_model_itself_and_its_relations(self):
+        officer = make_user('loan_officer', 'Home region outside every shard')
+        loans = [make_individual_loan(officer, recipient=make_user(first_name=name)) for name in ('Kondwani', 'Temwani')]
+
+        def found(term):
+            response = self.client.get('/admin/core/individualloan/', {'q': term})
+            return sorted(loan.pk for loan in response.context['cl'].result_list)
+
+        self.assertEqual(found('kondw'), [loans[0].pk])
+        self.assertEqual(found('mwila'), sorted(loan.pk for loan in loans))
+
+
+@override_settings(SHARDING={'SHARDS': {'copperbelt': {'REGIONS': ['Copperbelt']}}}, THROTTLING={'ENABLED': False})
+class ShardRoutingTests(SimpleTestCase):
+    def test_loan_rows_follow_the_loan_officer(self):
+        loan = IndividualLoan(loan_officer=User(region='Copperbelt'))
+        self.assertEqual(router.db_for_write(IndividualLoan, instance=loan), 'copperbelt')
+        self.assertEqual(router.db_for_write(IndividualLoan, instance=IndividualLoan(loan_officer=User(region='Lusaka'))), DEFAULT_DB_ALIAS)
+
+        loan._state.adding, loan._state.db = False, 'copperbelt'
+        self.assertEqual(router.db_for_write(IndividualLoanPayment, instance=IndividualLoanPayment(loan=loan)), 'copperbelt')
+
+    def test_queries_without_an_object_go_to_the_pinned_shard(self):
+        self.assertEqual(router.db_for_read(IndividualLoan), DEFAULT_DB_ALIAS)
+        with sharding.pinned('copperbelt'):
+            self.assertEqual(router.db_for_read(IndividualLoan), 'copperbelt')
+            self.assertEqual(router.db_for_read(User), DEFAULT_DB_ALIAS)
+        self.assertEqual(sharding.current(), DEFAULT_DB_ALIAS)
+
+    def test_shards_hold_loan_tables_only(self):
+        self.assertTrue(router.allow_migrate('copperbelt', 'core', model_name='individualloanpayment'))
+        self.assertFalse(router.allow_migrate('copperbelt', 'users', model_name='user'))
+        self.assertFalse(router.allow_migrate('copperbelt', 'core'))
+
+    def test_merged_keeps_the_query_order(self):
+        querysets = [mock.Mock(query=mock.Mock(order_by=['-created_at', 'id'])), mock.Mock()]
+        querysets[0].__iter__ = lambda self: iter([{'created_at': 3, 'id': 1}, {'created_at': 1, 'id': 4}])
+        querysets[1].__iter__ = lambda self: iter([{'created_at': 3, 'id': 2}, {'created_at': 2, 'id': 3}])
+        self.assertEqual([row['id'] for row in sharding.merged(querysets)], [1, 2, 3, 4])
+
+    def test_pin_is_reset_when_the_view_fails(self):
+        class FailingViewSet(sharding.ShardedViewMixin, viewsets.ViewSet):
+            def list(self, request):
+                raise RuntimeError
+
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, User(role='loan_officer', region='Copperbelt'))
+        with self.assertRaises(RuntimeError):
+            FailingViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(sharding.current(), DEFAULT_DB_ALIAS)
+
+
+@skipUnless(SHARDS, "needs a shard: run with --settings=mifi.settings_test")
+@override_settings(THROTTLING={'ENABLED': False})
+class ShardedPortfolioTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alias, shard = next(iter(SHARDS.items()))
+        self.home = make_user('loan_officer', 'Home region outside every shard')
+        self.away = make_user('loan_officer', shard['REGIONS'][0])
+        self.loans = [make_individual_loan(officer) for officer in (self.home, self.away, self.home)]
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('manager'))
+
+    def test_loans_are_placed_by_region(self):
+        self.assertEqual([loan._state.db for loan in self.loans], [DEFAULT_DB_ALIAS, self.alias, DEFAULT_DB_ALIAS])
+        self.assertTrue(IndividualLoan.objects.using(self.alias).filter(pk=self.loans[1].pk).exists())
+
+    def test_clients_see_their_loans_on_their_officers_shard(self):
+        client = make_user('clients', 'Home region outside every shard')
+        loan = make_individual_loan(self.away, recipient=client)
+        group = make_group_loan(self.away, [client])
+        self.client.force_authenticate(client)
+
+        self.assertEqual([row['id'] for row in self.client.get('/api/test/v1/individual/').json()], [loan.pk])
+        self.assertEqual(self.client.get(f'/api/test/v1/individual/{loan.pk}/').status_code, 200)
+        self.assertEqual([row['id'] for row in self.client.get('/api/test/v1/group/').json()], [group.pk])
+        found = self.client.get('/api/test/v1/search/', {'q': 'mwila', 'type': 'individual'}).json()
+        self.assertEqual([row['id'] for row in found['results']['individual_loans']], [loan.pk])
+
+    def test_manager_lists_are_merged_then_paginated(self):
+        expected = [loan.pk for loan in sorted(self.loans, key=lambda loan: loan.created_at, reverse=True)]
+        self.assertEqual([row['id'] for row in self.client.get('/api/test/v1/individual/').json()], expected)
+
+        with mock.patch.object(IndividualLoanViewSet, 'pagination_class', LimitOffsetPagination):
+            page = self.client.get('/api/test/v1/individual/', {'limit': 2, 'offset': 1}).json()
+        self.assertEqual(page['count'], 3)
+        self.assertEqual([row['id'] for row in page['results']], expected[1:])
+
+    def test_accrual_charges_every_shard(self):
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        for alias in sharding.shards():
+            IndividualLoan.objects.using(alias).update(interest_rate=Decimal('36.50'), repayment_frequency='daily')
+        self.assertEqual(accrue(tomorrow).loans, 3)
+        for loan in self.loans:
+            self.assertEqual(IndividualLoan.objects.using(loan._state.db).get(pk=loan.pk).total_due, Decimal('1001.00'))
+
+    def test_search_finds_loans_on_every_shard(self):
+        found = self.client.get('/api/test/v1/search/', {'q': 'mwila', 'type': 'individual'}).json()
+        self.assertEqual({row['id'] for row in found['results']['individual_loans']}, {loan.pk for loan in self.loans})
+
+    def test_archived_loans_are_restored_to_their_shard(self):
+        IndividualLoan.objects.using(self.alias).filter(pk=self.loans[1].pk).update(
+            status='completed', updated_at=timezone.now() - timedelta(days=400)
+        )
+        self.assertEqual(archive_completed(months=12)['core.IndividualLoan'], 1)
+        self.assertFalse(IndividualLoan.objects.using(self.alias).filter(pk=self.loans[1].pk).exists())
+        self.assertTrue(ArchivedLoan.objects.filter(object_id=self.loans[1].pk).exists())
+
+        self.assertEqual(restore_loans(IndividualLoan, [self.loans[1].pk]), 1)
+        self.assertTrue(IndividualLoan.objects.using(self.alias).filter(pk=self.loans[1].pk).exists())
+
+    def test_estimated_count_reads_the_statistics_not_the_ids(self):
+        queryset = IndividualLoan.objects.using(self.alias).all()
+        # The shard's one loan has an id past FIRST_ID
+        self.assertIsNone(estimated_count(queryset))
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_count(queryset), 1)
@@ -0,0 +1,140 @@
+"""
+Request budgets per user, or per IP address for anonymous requests.
+
+Each request counts against at most one scope: the view's throttle_scope
+(the token endpoint, reports), its write_throttle_scope for POST, PUT,
+PATCH and DELETE (payments), or 'list' for any other list read. Rates are
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], so a flood of list reads cannot
+use up the budget for posting payments. The counters live in a file cache
+that every worker process on the host shares.
+
+A budget is a count per fixed window of the rate's duration, kept with
+cache.add() and cache.incr(), which ThrottleCache makes atomic across
+processes. Fixed windows let a client spend up to twice the rate across a
+window boundary, in exchange for one counter per client instead of a
+timestamp per request.
+"""
+import os
+import pickle
+import random
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+def _setting(name, default):
+    return getattr(settings, 'THROTTLING', {}).get(name, default)
+
+
+class ThrottleCache(FileBasedCache):
+    """
+    FileBasedCache that counts its entries on a sample of writes. The stock
+    backend lists the whole directory on every set, which costs more than
+    the request itself once there is a file per active user.
+
+    Its add() and incr() hold a lock file shared by every process, so
+    concurrent requests cannot both create a counter or lose an increment.
+    """
+    cull_sample = 0.01
+    lock_stripes = 64
+
+    def _cull(self):
+        if random.random() < self.cull_sample:
+            super()._cull()
+
+    @contextmanager
+    def _locked(self, fname):
+        stripe = int(os.path.basename(fname)[:8], 16) % self.lock_stripes
+        self._createdir()
+        with open(os.path.join(self._dir, f'lock-{stripe}'), 'ab') as fh:
+            locks.lock(fh, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(fh)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked(self._key_to_file(key, version)):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        fname = self._key_to_file(key, version)
+        with self._locked(fname):
+            try:
+                with open(fname, 'rb') as f:
+                    expiry = pickle.load(f)
+                    value = pickle.loads(zlib.decompress(f.read()))
+            except FileNotFoundError:
+                expiry = value = None
+            now = time.time()
+            if value is None or (expiry is not None and expiry < now):
+                raise ValueError(f"Key '{key}' not found")
+            value += delta
+            self.set(key, value, None if expiry is None else expiry - now, version)
+        return value
+
+
+class RequestThrottle(SimpleRateThrottle):
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+
+    def __init__(self):
+        # The scope, and so the rate, depends on the request
+        pass
+
+    def get_scope(self, request, view):
+        if getattr(view, 'throttle_scope', None):
+            return view.throttle_scope
+        if request.method not in SAFE_METHODS:
+            return getattr(view, 'write_throttle_scope', None)
+        if getattr(view, 'action', None) == 'list':
+            return 'list'
+        return None
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user{request.user.pk}'
+        else:
+            ident = f'ip{self.get_ident(request)}'
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        if not _setting('ENABLED', True):
+            return True
+        self.scope = self.get_scope(request, view)
+        # Read at request time, not import time, so settings overrides apply
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        self.cache = caches[_setting('CACHE', 'default')]
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.key = self.get_cache_key(request, view)
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        self.reset = (window + 1) * self.duration - self.now
+        key = f'{self.key}_{window}'
+        count = 1
+        if not self.cache.add(key, count, self.duration + 1):
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                # Expired between the two calls
+                self.cache.add(key, count, self.duration + 1)
+
+        allowed = count <= self.num_requests
+        remaining = max(self.num_requests - count, 0)
+        # Read back by RateLimitHeadersMiddleware
+        request._request.rate_limit = (self.num_requests, remaining, max(int(self.reset + 0.999), 1))
+        return allowed
+
+    def wait(self):
+        return self.reset
@@ -2,11 +2,16 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 
-from mifi import settings
+from mifi import settings, sharding
+from mifi.large_admin import ShardAdminSite
+from mifi.views import metrics_view
 
 urlpatterns = [
+    # Before admin/, whose catch-all view would answer for them
+    *[path(f'admin/{alias}/', ShardAdminSite(alias).urls) for alias in sharding.shards()[1:]],
     path('admin/', admin.site.urls),
-    path('api/test/v1/', include('apis.urls'))
+    path('api/test/v1/', include('apis.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
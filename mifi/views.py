@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+from jobs.queue import queue_depth
+from mifi import metrics
+
+
+@require_GET
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS', {}).get('ALLOWED_IPS', []):
+        return HttpResponseForbidden()
+
+    gauges = {
+        'mifi_job_queue_depth': (
+            "Queued background jobs by task",
+            [({'task': name}, count) for name, count in sorted(queue_depth().items())],
+        ),
+    }
+    return HttpResponse(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,29 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import OutboxEvent, SinkCursor
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'key', 'created_at')
+    list_filter = ('topic',)
+    search_fields = ('=key',)
+    readonly_fields = ('topic', 'key', 'payload', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SinkCursor)
+class SinkCursorAdmin(admin.ModelAdmin):
+    list_display = ('name', 'position', 'delivered', 'attempts', 'next_attempt_at', 'locked_by', 'updated_at')
+    readonly_fields = ('delivered', 'last_error', 'locked_by', 'locked_at', 'updated_at')
+    actions = ['retry_now']
+
+    @admin.action(description="Retry selected sinks now")
+    def retry_now(self, request, queryset):
+        updated = queryset.update(next_attempt_at=timezone.now(), attempts=0)
+        self.message_user(request, f"{updated} sinks will be retried on the next pass.")
@@ -0,0 +1,123 @@
+"""
+Delivering the outbox to its sinks.
+
+Each sink has a cursor: the id of the last event it has been given. A pass
+claims the cursor (so two dispatchers never feed the same sink), reads the
+following events in id order, BATCH_SIZE at a time, and moves the cursor
+only once the sink has taken a batch. A failing sink keeps its place and
+is retried with exponential backoff while the other sinks carry on, so
+every sink sees every event in order, at least once.
+
+Ids are handed out before commit, so a transaction still open when the
+cursor moves past its event commits it behind the cursor. The ids a batch
+skips over are kept on the cursor as gaps, and each pass first delivers the
+events that have since turned up in them; a gap is given up after
+GAP_TIMEOUT_SECONDS, by when its transaction must have rolled back. Such a
+late event reaches the sink after events with higher ids that committed
+before it.
+"""
+import logging
+import traceback
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from .models import OutboxEvent, SinkCursor
+from .sinks import configured_sinks
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, 'OUTBOX', {}).get(name, default)
+
+
+def backoff(attempts):
+    base = _setting('RETRY_BACKOFF_SECONDS', 5)
+    cap = _setting('RETRY_BACKOFF_MAX_SECONDS', 600)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+
+def claim(sink, worker_id):
+    """Lock the sink's cursor for this worker if it is due; returns the cursor or None."""
+    SinkCursor.objects.get_or_create(name=sink.name)
+    now = timezone.now()
+    stale = now - timedelta(seconds=_setting('LOCK_TIMEOUT_SECONDS', 300))
+    claimed = SinkCursor.objects.filter(name=sink.name, next_attempt_at__lte=now).filter(
+        Q(locked_by__isnull=True) | Q(locked_at__lt=stale)
+    ).update(locked_by=worker_id, locked_at=now)
+    return SinkCursor.objects.get(name=sink.name) if claimed else None
+
+
+def deliver(sink, cursor, max_batches):
+    """Feed the sink batches until it is caught up or fails. Returns the number of events delivered."""
+    batch_size = _setting('BATCH_SIZE', 500)
+    now = timezone.now()
+    waited = now - timedelta(seconds=_setting('GAP_TIMEOUT_SECONDS', 3600))
+    # JSON keys are strings
+    gaps = {int(pk): since for pk, since in cursor.gaps.items() if datetime.fromisoformat(since) > waited}
+    fields = ('id', 'topic', 'key', 'payload', 'created_at')
+    delivered = 0
+    for _ in range(max_batches):
+        late = list(OutboxEvent.objects.filter(id__in=gaps).order_by('id').values(*fields)[:batch_size]) if gaps else []
+        batch = list(OutboxEvent.objects.filter(id__gt=cursor.position).order_by('id').values(*fields)[:batch_size])
+        if not late and not batch:
+            break
+        events = [event for event in late + batch if sink.accepts(event)]
+        try:
+            if events:
+                sink.deliver(events)
+        except Exception:
+            cursor.attempts += 1
+            logger.warning("Outbox sink %s failed on attempt %s", sink.name, cursor.attempts, exc_info=True)
+            SinkCursor.objects.filter(pk=cursor.pk).update(
+                attempts=cursor.attempts,
+                next_attempt_at=timezone.now() + backoff(cursor.attempts),
+                last_error=traceback.format_exc(),
+            )
+            break
+
+        for event in late:
+            del gaps[event['id']]
+        if batch:
+            seen = {event['id'] for event in batch}
+            gaps.update({pk: now.isoformat() for pk in range(cursor.position + 1, batch[-1]['id']) if pk not in seen})
+            cursor.position = batch[-1]['id']
+        delivered += len(events)
+        SinkCursor.objects.filter(pk=cursor.pk).update(
+            position=cursor.position, gaps=gaps, delivered=F('delivered') + len(events), attempts=0,
+            last_error=None, updated_at=timezone.now(),
+        )
+        if len(batch) < batch_size:
+            break
+    return delivered
+
+
+def dispatch(worker_id, names=None, max_batches=20):
+    """One pass over the configured sinks; returns {sink name: events delivered} for the sinks it ran."""
+    results = {}
+    for sink in configured_sinks(names):
+        cursor = claim(sink, worker_id)
+        if cursor is None:
+            continue
+        try:
+            results[sink.name] = deliver(sink, cursor, max_batches)
+        finally:
+            SinkCursor.objects.filter(pk=cursor.pk, locked_by=worker_id).update(locked_by=None, locked_at=None)
+    return results
+
+
+def purge():
+    """Delete events every configured sink has had for longer than RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=_setting('RETENTION_DAYS', 7))
+    events = OutboxEvent.objects.filter(created_at__lt=cutoff)
+    names = [sink.name for sink in configured_sinks()]
+    if names:
+        position = SinkCursor.objects.filter(name__in=names).aggregate(position=Min('position'))['position']
+        if position is None or SinkCursor.objects.filter(name__in=names).count() < len(names):
+            # A sink that has never run still needs everything
+            return 0
+        events = events.filter(id__lte=position)
+    return events.delete()[0]
@@ -0,0 +1,79 @@
+"""
+Writing to the outbox. Call these inside the transaction that makes the
+change: the events then commit or roll back with it, and the dispatcher
+delivers them afterwards without the request waiting on any downstream
+system.
+"""
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+LOAN_KINDS = {'individualloan': 'individual', 'grouploan': 'group'}
+
+
+def emit(topic, key, payload):
+    return OutboxEvent.objects.create(topic=topic, key=key, payload=payload)
+
+
+def emit_many(topic, rows, batch_size=1000):
+    """`rows` is [(key, payload)]; one INSERT per batch."""
+    now = timezone.now()
+    return OutboxEvent.objects.bulk_create(
+        [OutboxEvent(topic=topic, key=key, payload=payload, created_at=now) for key, payload in rows],
+        batch_size=batch_size,
+    )
+
+
+def _loan_key(loan):
+    return f"{LOAN_KINDS[loan._meta.model_name]}_loan:{loan.pk}"
+
+
+def loans_created(loans):
+    emit_many('loan.created', [
+        (_loan_key(loan), {
+            'loan_type': LOAN_KINDS[loan._meta.model_name],
+            'loan_id': loan.pk,
+            'amount': str(loan.amount),
+            'start_date': str(loan.start_date),
+            'end_date': str(loan.end_date),
+            'officer_id': loan.loan_officer_id,
+            'recipient_id': getattr(loan, 'recipient_id', None),
+            'group_name': getattr(loan, 'group_name', None),
+        })
+        for loan in loans
+    ])
+
+
+def payments_posted(loan, payments):
+    emit_many('payment.posted', [
+        (_loan_key(loan), {
+            'loan_type': LOAN_KINDS[loan._meta.model_name],
+            'loan_id': loan.pk,
+            'payment_id': payment.pk,
+            'member_id': getattr(payment, 'member_id', None),
+            'amount': str(payment.amount),
+            'payment_type': payment.payment_type,
+            'payment_date': payment.payment_date.isoformat() if payment.payment_date else None,
+            'recorded_by': payment.recorded_by_id,
+        })
+        for payment in payments
+    ])
+
+
+def members_blocked(memberships, blocked, user=None):
+    """`memberships` is [(group_loan_id, member_id)], all now blocked or unblocked."""
+    emit_many('member.blocked' if blocked else 'member.unblocked', [
+        (f"group_loan:{group_loan_id}", {
+            'group_loan_id': group_loan_id,
+            'member_id': member_id,
+            'by': user.pk if user else None,
+        })
+        for group_loan_id, member_id in memberships
+    ])
+
+
+def users_created(users):
+    emit_many('user.created', [
+        (f"user:{user.pk}", {'user_id': user.pk, 'role': user.role, 'region': user.region})
+        for user in users
+    ])
@@ -0,0 +1,39 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+
+from outbox.dispatch import dispatch, purge
+
+
+class Command(BaseCommand):
+    help = "Deliver outbox events to the sinks in OUTBOX['SINKS'], in order and in batches, with retries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', action='append', help="Only dispatch to this sink (repeatable)")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when every sink is caught up")
+        parser.add_argument('--once', action='store_true', help="Make one pass and exit instead of polling forever")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        passes = 0
+        while not stop.is_set():
+            delivered = dispatch(worker_id, names=options['sink'])
+            for name, count in delivered.items():
+                if count:
+                    self.stdout.write(f"{name}: delivered {count} events")
+            passes += 1
+            if passes % 600 == 1:
+                purged = purge()
+                if purged:
+                    self.stdout.write(f"Purged {purged} delivered events")
+            if options['once']:
+                break
+            if not any(delivered.values()):
+                stop.wait(options['poll_interval'])
@@ -0,0 +1,68 @@
+import json
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Local stand-in for a downstream HTTP sink: accepts the batches HttpSink posts, prints a line "
+        "per batch and reports events that arrive out of order or twice. Use --fail-rate to test retries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--fail-rate', type=float, default=0.0, help="Share of batches answered with a 503")
+        parser.add_argument('--output', help="Also append every event to this JSON-lines file")
+
+    def handle(self, *args, **options):
+        command = self
+        last_ids = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if random.random() < options['fail_rate']:
+                    self.send_response(503)
+                    self.end_headers()
+                    command.stdout.write(f"Refused batch {self.headers.get('X-Outbox-Batch')}")
+                    return
+                try:
+                    batch = json.loads(body)
+                    events = batch['events']
+                except (ValueError, KeyError):
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                sink = batch.get('sink', '')
+                last = last_ids.get(sink, 0)
+                repeated = sum(1 for event in events if event['id'] <= last)
+                ids = [event['id'] for event in events]
+                if ids != sorted(ids):
+                    command.stderr.write(f"{sink}: batch {ids[0]}-{ids[-1]} is out of order")
+                last_ids[sink] = max(last, ids[-1])
+                if options['output']:
+                    with open(options['output'], 'a') as fh:
+                        fh.writelines(json.dumps(event) + '\n' for event in events)
+
+                self.send_response(204)
+                self.end_headers()
+                command.stdout.write(
+                    f"{sink}: {len(events)} events {ids[0]}-{ids[-1]}"
+                    + (f" ({repeated} already seen)" if repeated else "")
+                )
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        self.stdout.write(f"Listening on http://{options['host']}:{options['port']}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
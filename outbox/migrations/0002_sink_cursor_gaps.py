@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('outbox', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sinkcursor',
+            name='gaps',
+            field=models.JSONField(blank=True, default=dict, help_text='Ids below the position with no event yet, and when they were first passed over'),
+        ),
+    ]
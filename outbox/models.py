@@ -0,0 +1,33 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxEvent(models.Model):
+    """A change for downstream systems, written in the same transaction as the change itself."""
+    topic = models.CharField(max_length=50, help_text="e.g. payment.posted")
+    key = models.CharField(max_length=64, help_text="What the event is about, e.g. individual_loan:42")
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.topic} {self.key} #{self.pk}"
+
+
+class SinkCursor(models.Model):
+    """How far one sink has got through the outbox, and its retry state."""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0, help_text="Id of the last event delivered or skipped")
+    gaps = models.JSONField(
+        default=dict, blank=True,
+        help_text="Ids below the position with no event yet, and when they were first passed over"
+    )
+    delivered = models.BigIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0, help_text="Failed deliveries in a row")
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
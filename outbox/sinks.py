@@ -0,0 +1,68 @@
+"""
+Where outbox events go. A sink is configured under OUTBOX['SINKS'] by
+name, with a BACKEND and its own options; TOPICS, when given, limits the
+events it receives. deliver() gets one ordered batch and must raise if
+any of it did not arrive, in which case the whole batch is retried.
+"""
+import json
+import os
+import urllib.request
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+class Sink:
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.topics = set(options.get('TOPICS') or ())
+
+    def accepts(self, event):
+        return not self.topics or event['topic'] in self.topics
+
+    def deliver(self, events):
+        raise NotImplementedError
+
+
+class HttpSink(Sink):
+    """POSTs {"sink": name, "events": [...]} as JSON to URL; any non-2xx response is a failure."""
+
+    def deliver(self, events):
+        body = json.dumps({'sink': self.name, 'events': events}, cls=DjangoJSONEncoder).encode()
+        request = urllib.request.Request(
+            self.options['URL'],
+            data=body,
+            method='POST',
+            headers={
+                'Content-Type': 'application/json',
+                # Receivers can drop a batch they have already applied
+                'X-Outbox-Batch': f"{events[0]['id']}-{events[-1]['id']}",
+                **self.options.get('HEADERS', {}),
+            },
+        )
+        # urlopen raises HTTPError for 4xx and 5xx
+        with urllib.request.urlopen(request, timeout=self.options.get('TIMEOUT', 10)) as response:
+            response.read()
+
+
+class FileSink(Sink):
+    """Appends one JSON line per event to PATH and fsyncs before reporting success."""
+
+    def deliver(self, events):
+        path = self.options['PATH']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a') as fh:
+            fh.writelines(json.dumps(event, cls=DjangoJSONEncoder) + '\n' for event in events)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def configured_sinks(names=None):
+    sinks = getattr(settings, 'OUTBOX', {}).get('SINKS', {})
+    return [
+        import_string(options['BACKEND'])(name, options)
+        for name, options in sinks.items()
+        if names is None or name in names
+    ]
@@ -0,0 +1,11 @@
+import os
+import socket
+
+from jobs.queue import task
+from .dispatch import dispatch, purge
+
+
+@task('outbox.dispatch')
+def dispatch_outbox(sinks=None):
+    delivered = dispatch(f"{socket.gethostname()}:{os.getpid()}:job", names=sinks)
+    return {'delivered': delivered, 'purged': purge()}
@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .dispatch import claim, dispatch, purge
+from .models import OutboxEvent, SinkCursor
+from .sinks import Sink, configured_sinks
+
+
+class ListSink(Sink):
+    """Keeps what it is given; fails while `failing` is set."""
+    received = []
+    failing = False
+
+    def deliver(self, events):
+        if ListSink.failing:
+            raise ConnectionError("sink down")
+        ListSink.received.extend(event['id'] for event in events)
+
+
+@override_settings(OUTBOX={
+    'BATCH_SIZE': 2,
+    'RETRY_BACKOFF_SECONDS': 5,
+    'GAP_TIMEOUT_SECONDS': 3600,
+    'RETENTION_DAYS': 7,
+    'SINKS': {
+        'all': {'BACKEND': 'outbox.tests.ListSink'},
+        'payments': {'BACKEND': 'outbox.tests.ListSink', 'TOPICS': ['payment.posted']},
+    },
+})
+class DispatchTests(TestCase):
+    def setUp(self):
+        ListSink.received = []
+        ListSink.failing = False
+
+    def emit(self, topic='loan.created', **fields):
+        return OutboxEvent.objects.create(topic=topic, key='individual_loan:1', **fields).pk
+
+    def test_delivers_in_order_in_batches(self):
+        ids = [self.emit(), self.emit('payment.posted'), self.emit(), self.emit('payment.posted'), self.emit()]
+        self.assertEqual(dispatch('worker', names=['all']), {'all': 5})
+        self.assertEqual(ListSink.received, ids)
+
+        # Events the sink doesn't take still move its cursor
+        ListSink.received = []
+        self.assertEqual(dispatch('worker', names=['payments']), {'payments': 2})
+        self.assertEqual(ListSink.received, [ids[1], ids[3]])
+        self.assertEqual(SinkCursor.objects.get(name='payments').position, ids[-1])
+        self.assertEqual(dispatch('worker'), {'all': 0, 'payments': 0})
+
+    def test_failing_sink_keeps_its_place_and_backs_off(self):
+        first = self.emit()
+        ListSink.failing = True
+        with self.assertLogs('outbox.dispatch', 'WARNING'):
+            self.assertEqual(dispatch('worker', names=['all']), {'all': 0})
+        cursor = SinkCursor.objects.get(name='all')
+        self.assertEqual((cursor.position, cursor.attempts), (0, 1))
+        self.assertGreater(cursor.next_attempt_at, timezone.now() + timedelta(seconds=4))
+        self.assertIn("sink down", cursor.last_error)
+
+        # Not retried before its backoff is up
+        ListSink.failing = False
+        self.assertEqual(dispatch('worker', names=['all']), {})
+        SinkCursor.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatch('worker', names=['all']), {'all': 1})
+        cursor.refresh_from_db()
+        self.assertEqual((cursor.position, cursor.attempts, cursor.last_error), (first, 0, None))
+
+    def test_one_worker_holds_a_sink(self):
+        sink = configured_sinks(['all'])[0]
+        self.assertIsNotNone(claim(sink, 'one'))
+        self.assertIsNone(claim(sink, 'two'))
+        # A worker that died is taken over once its lock is stale
+        SinkCursor.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim(sink, 'two').locked_by, 'two')
+
+    def test_event_committed_behind_the_cursor_is_delivered(self):
+        first = self.emit()
+        # Its id was taken by a transaction that has not committed yet
+        late = first + 1
+        third = self.emit(id=late + 1)
+        dispatch('worker', names=['all'])
+        self.assertEqual(ListSink.received, [first, third])
+        self.assertEqual(list(SinkCursor.objects.get(name='all').gaps), [str(late)])
+
+        self.emit(id=late)
+        fourth = self.emit()
+        dispatch('worker', names=['all'])
+        self.assertEqual(ListSink.received, [first, third, late, fourth])
+        self.assertEqual(SinkCursor.objects.get(name='all').gaps, {})
+
+    def test_gap_is_given_up_after_the_timeout(self):
+        first = self.emit()
+        self.emit(id=first + 2)
+        dispatch('worker', names=['all'])
+        SinkCursor.objects.update(gaps={str(first + 1): (timezone.now() - timedelta(hours=2)).isoformat()})
+        self.emit(id=first + 1)
+        self.emit()
+        dispatch('worker', names=['all'])
+        self.assertNotIn(first + 1, ListSink.received)
+        self.assertEqual(SinkCursor.objects.get(name='all').gaps, {})
+
+    def test_purge_keeps_what_a_sink_still_needs(self):
+        old = timezone.now() - timedelta(days=8)
+        ids = [self.emit(created_at=old), self.emit(created_at=old), self.emit()]
+        # 'payments' has never run
+        dispatch('worker', names=['all'])
+        self.assertEqual(purge(), 0)
+
+        SinkCursor.objects.create(name='payments', position=ids[0])
+        self.assertEqual(purge(), 1)
+        self.assertEqual(list(OutboxEvent.objects.values_list('pk', flat=True).order_by('pk')), ids[1:])
@@ -0,0 +1,43 @@
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reports import statements
+
+
+class Command(BaseCommand):
+    help = (
+        "Render HTML and PDF statements for every client with a loan running in the month into zip parts "
+        "under STATEMENTS['DIR']/<month>/. An interrupted run carries on from its manifest when re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="YYYY-MM (default: last month)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Clients per query batch and zip part")
+        parser.add_argument('--workers', type=int, help="Rendering processes (default: CPU count)")
+        parser.add_argument('--output', help="Directory to write to instead of STATEMENTS['DIR']/<month>")
+        parser.add_argument('--restart', action='store_true', help="Discard earlier output for the month first")
+
+    def handle(self, *args, **options):
+        month = options['month'] or statements.last_month()
+        try:
+            period_start, period_end = statements.month_bounds(month)
+        except ValueError:
+            raise CommandError("--month must be YYYY-MM")
+
+        directory = options['output'] or statements.output_dir(month)
+        if options['restart']:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        started = timezone.now()
+        manifest = statements.generate(
+            period_start, period_end, directory,
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            progress=lambda manifest: self.stdout.write(f"{manifest.statements} statements written"),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{manifest.statements} statements for {month} in {len(manifest.data['parts'])} parts under "
+            f"{directory} ({(timezone.now() - started).total_seconds():.1f}s)"
+        ))
@@ -0,0 +1,66 @@
+"""
+A minimal PDF writer for plain-text documents such as client statements:
+A4 pages of Helvetica lines, using only the standard fonts every PDF reader
+ships with, so no rendering library is needed.
+"""
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 50
+FONT_SIZE = 9
+LEADING = 12
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+
+def _escape(text):
+    text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return text.encode('latin-1', 'replace')
+
+
+def _page_stream(lines):
+    ops = [b'BT', b'/F1 %d Tf' % FONT_SIZE, b'%d TL' % LEADING, b'%d %d Td' % (MARGIN, PAGE_HEIGHT - MARGIN)]
+    for line in lines:
+        bold = line.startswith('# ')
+        if bold:
+            ops.append(b'/F2 %d Tf' % FONT_SIZE)
+            line = line[2:]
+        ops.append(b'(' + _escape(line) + b') Tj T*')
+        if bold:
+            ops.append(b'/F1 %d Tf' % FONT_SIZE)
+    ops.append(b'ET')
+    return b'\n'.join(ops)
+
+
+def render_text(lines, title=''):
+    """
+    Lay `lines` out on as many pages as they need and return the PDF bytes.
+    Lines starting with '# ' are set in bold.
+    """
+    pages = [lines[start:start + LINES_PER_PAGE] for start in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+
+    # 1 catalog, 2 page tree, 3-4 fonts, 5 info, then a page and its content stream per page
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % (6 + 2 * n) for n in range(len(pages))), len(pages)
+        ),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        b'<< /Title (' + _escape(title) + b') >>',
+    ]
+    for n, page in enumerate(pages):
+        stream = _page_stream(page)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+            b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>' % (PAGE_WIDTH, PAGE_HEIGHT, 7 + 2 * n)
+        )
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
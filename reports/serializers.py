@@ -6,31 +6,59 @@ from .models import (
     ActiveLoansReport
 )
 from users.serializers import UserSerializer
+from jobs.models import Job
+from mifi.sparse import SparseSerializerMixin
 
-class PaymentsCollectedReportSerializer(serializers.ModelSerializer):
+class PaymentsCollectedReportSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     generated_by = UserSerializer(read_only=True)
     
     class Meta:
         model = PaymentsCollectedReport
         fields = '__all__'
 
-class ActiveGroupsReportSerializer(serializers.ModelSerializer):
+class ActiveGroupsReportSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     generated_by = UserSerializer(read_only=True)
     
     class Meta:
         model = ActiveGroupsReport
         fields = '__all__'
 
-class AmountLoanedReportSerializer(serializers.ModelSerializer):
+class AmountLoanedReportSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     generated_by = UserSerializer(read_only=True)
     
     class Meta:
         model = AmountLoanedReport
         fields = '__all__'
 
-class ActiveLoansReportSerializer(serializers.ModelSerializer):
+class ActiveLoansReportSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     generated_by = UserSerializer(read_only=True)
     
     class Meta:
         model = ActiveLoansReport
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class ReportRequestSerializer(serializers.Serializer):
+    REPORTS = (
+        ('payments_collected', 'Payments Collected'),
+        ('active_groups', 'Active Groups'),
+        ('amount_loaned', 'Amount Loaned'),
+        ('active_loans', 'Active Loans'),
+    )
+
+    report = serializers.ChoiceField(choices=REPORTS)
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if data['report'] == 'payments_collected':
+            if not data.get('start_date') or not data.get('end_date'):
+                raise serializers.ValidationError("start_date and end_date are required for payments_collected")
+            if data['end_date'] < data['start_date']:
+                raise serializers.ValidationError("End date must be after start date.")
+        return data
+
+class ReportJobSerializer(SparseSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'status', 'attempts', 'result', 'last_error', 'created_at', 'finished_at']
+        read_only_fields = fields
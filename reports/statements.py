@@ -0,0 +1,312 @@
+"""
+Month-end client statements.
+
+The parent process reads clients in primary-key batches and prefetches each
+batch's loans and payments in a handful of queries on each shard. The batch goes to a
+process pool as plain data; workers render every statement to HTML and PDF
+and hand the bytes back. The parent writes each batch as a numbered zip
+part next to a manifest. A part is only listed in the manifest once its
+file is complete, so a run that stopped part-way resumes after the last
+listed client. Only a few batches are ever in flight, which keeps memory
+flat however many clients there are.
+
+Balances are the journal's at the end of the period, so a statement
+regenerated for a closed month shows what was owed then, whatever has been
+paid since; the status is worked out from them the way the loans' own is.
+"""
+import json
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from core.models import GroupLoan, GroupLoanPayment, GroupMemberStatus, IndividualLoan, IndividualLoanPayment
+from ledger import journal
+from mifi import sharding
+from users.models import User
+from . import pdf
+
+LOAN_FIELDS = [
+    'id', 'amount', 'interest_rate', 'repayment_frequency', 'start_date', 'end_date', 'status',
+    'total_due', 'total_paid',
+]
+
+
+def month_bounds(month):
+    """First and last day of a YYYY-MM month."""
+    start = date.fromisoformat(f"{month}-01")
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def last_month():
+    return f"{timezone.localdate().replace(day=1) - timedelta(days=1):%Y-%m}"
+
+
+def output_dir(period):
+    return os.path.join(getattr(settings, 'STATEMENTS', {}).get('DIR', 'statements'), period)
+
+
+def _running(period_start, period_end):
+    # Loans that ran during the period, plus any still open from before it
+    return Q(start_date__lte=period_end) & (Q(end_date__gte=period_start) | Q(status__in=['active', 'overdue']))
+
+
+def clients(period_start, period_end):
+    running = _running(period_start, period_end)
+    queryset = User.objects.filter(role='clients')
+    if sharding.crosses(IndividualLoan, User):
+        # No join reaches the shards; client_batches leaves out clients without loans
+        return queryset.order_by('pk')
+    return queryset.filter(
+        Exists(IndividualLoan.objects.filter(running, recipient=OuterRef('pk')))
+        | Exists(GroupMemberStatus.objects.filter(
+            member=OuterRef('pk'),
+            group_loan__in=GroupLoan.objects.filter(running),
+        ))
+    ).order_by('pk')
+
+
+def _as_of(model, loans, period_end):
+    """
+    Set the balances and status of `loans` ({id: loan}) to what they were at
+    the end of `period_end`. Loans not journaled yet keep their current ones.
+    """
+    for loan_id, totals in journal.balances(model, list(loans), period_end).items():
+        loan = loans[loan_id]
+        loan['total_due'], loan['total_paid'] = totals['total_due'], totals['total_paid']
+        if loan['status'] != 'pending':
+            # As mark_overdue_loans and record_payment set it
+            if loan['total_due'] <= 0:
+                loan['status'] = 'completed'
+            else:
+                loan['status'] = 'overdue' if loan['end_date'] < period_end else 'active'
+
+
+def _individual_loans(loans, ids, running, period_end):
+    individual = {
+        loan['id']: dict(loan, kind='individual', title=f"Loan {loan['id']}", payments=[])
+        for loan in IndividualLoan.objects.filter(running, recipient_id__in=ids)
+        .order_by('start_date', 'id').values('recipient_id', *LOAN_FIELDS)
+    }
+    for payment in IndividualLoanPayment.objects.filter(
+        loan_id__in=individual, payment_date__date__lte=period_end
+    ).order_by('payment_date', 'id').values_list('loan_id', 'payment_date', 'payment_type', 'amount'):
+        individual[payment[0]]['payments'].append(payment[1:])
+    _as_of(IndividualLoan, individual, period_end)
+    for loan in individual.values():
+        loans[loan.pop('recipient_id')].append(loan)
+
+
+def _group_loans(loans, ids, running, period_end):
+    memberships = list(
+        GroupMemberStatus.objects.filter(member_id__in=ids, group_loan__in=GroupLoan.objects.filter(running))
+        .values_list('member_id', 'group_loan_id')
+    )
+    groups = {
+        loan['id']: loan
+        for loan in GroupLoan.objects.filter(id__in={group_id for _, group_id in memberships})
+        .values('group_name', *LOAN_FIELDS)
+    }
+    group_payments = {}
+    for payment in GroupLoanPayment.objects.filter(
+        loan_id__in=groups, member_id__in=ids, payment_date__date__lte=period_end
+    ).order_by('payment_date', 'id').values_list('loan_id', 'member_id', 'payment_date', 'payment_type', 'amount'):
+        group_payments.setdefault(payment[:2], []).append(payment[2:])
+    _as_of(GroupLoan, groups, period_end)
+    for member_id, group_id in memberships:
+        loan = dict(groups[group_id], kind='group', payments=group_payments.get((group_id, member_id), []))
+        loan['title'] = f"Group loan {loan['id']} - {loan.pop('group_name')}"
+        loans[member_id].append(loan)
+
+
+def client_batches(period_start, period_end, batch_size, after=0):
+    """Yield lists of statement data, one dict per client, in client order."""
+    running = _running(period_start, period_end)
+    queryset = clients(period_start, period_end).values_list(
+        'id', 'first_name', 'last_name', 'email', 'nrc_number', 'phone_number'
+    )
+    while True:
+        batch = list(queryset.filter(pk__gt=after)[:batch_size])
+        if not batch:
+            return
+        after = batch[-1][0]
+        ids = [row[0] for row in batch]
+        loans = {client_id: [] for client_id in ids}
+        # A client's loans may be on several shards; each shard's rows are local to it
+        for alias in sharding.each_shard():
+            _individual_loans(loans, ids, running, period_end)
+        for alias in sharding.each_shard():
+            _group_loans(loans, ids, running, period_end)
+
+        documents = [
+            {
+                'client': {
+                    'id': client_id,
+                    'name': f"{first_name} {last_name}".strip() or email,
+                    'nrc_number': nrc_number,
+                    'phone_number': phone_number,
+                },
+                'loans': loans[client_id],
+            }
+            for client_id, first_name, last_name, email, nrc_number, phone_number in batch
+            if loans[client_id]
+        ]
+        if documents:
+            yield documents
+
+
+def _setup_worker():
+    # Spawned or forkserver workers start without Django configured
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def _schedule(loan):
+    model = IndividualLoan if loan['kind'] == 'individual' else GroupLoan
+    instance = model(**{field: loan[field] for field in LOAN_FIELDS})
+    return instance.get_payment_schedule()
+
+
+def _prepare(loan):
+    # Plain strings render several times faster than dates and decimals,
+    # which the template engine would localize one by one
+    loan['schedule'] = [(due_date.isoformat(), str(amount)) for due_date, amount in _schedule(loan)]
+    loan['payments'] = [
+        (timezone.localdate(paid_at).isoformat(), payment_type, str(amount))
+        for paid_at, payment_type, amount in loan['payments']
+    ]
+    for field in LOAN_FIELDS:
+        loan[field] = str(loan[field])
+
+
+def statement_lines(context):
+    """The statement as text lines for the PDF; '# ' marks headings."""
+    client = context['client']
+    lines = [
+        f"# Loan statement for {context['period']}",
+        client['name'],
+        f"NRC {client['nrc_number']}",
+        f"Statement date {context['period_end']}",
+        '',
+    ]
+    for loan in context['loans']:
+        lines += [
+            f"# {loan['title']}",
+            f"Amount {loan['amount']}   Interest {loan['interest_rate']}% a year   Repayment {loan['repayment_frequency']}",
+            f"Term {loan['start_date']} to {loan['end_date']}   Status {loan['status']}",
+            f"Total paid {loan['total_paid']}   Outstanding {loan['total_due']}",
+            '# Schedule',
+        ]
+        lines += [f"  {due_date}  {amount:>12}" for due_date, amount in loan['schedule']]
+        lines.append('# Payments')
+        lines += [
+            f"  {paid_on}  {payment_type:<10} {amount:>12}"
+            for paid_on, payment_type, amount in loan['payments']
+        ] or ['  No payments']
+        lines.append('')
+    return lines
+
+
+def render_batch(period, period_end, documents):
+    """Worker side: [(client_id, html, pdf)] for one batch of statement data."""
+    rendered = []
+    for document in documents:
+        for loan in document['loans']:
+            _prepare(loan)
+        context = dict(document, period=period, period_end=period_end.isoformat())
+        rendered.append((
+            document['client']['id'],
+            render_to_string('reports/statement.html', context).encode(),
+            pdf.render_text(statement_lines(context), title=f"Statement {period} - {document['client']['name']}"),
+        ))
+    return rendered
+
+
+class Manifest:
+    """Which zip parts of a run are complete, rewritten atomically after each part."""
+
+    def __init__(self, directory, period):
+        self.path = os.path.join(directory, 'manifest.json')
+        self.data = {'period': period, 'parts': [], 'complete': False}
+        if os.path.exists(self.path):
+            with open(self.path) as fh:
+                self.data = json.load(fh)
+
+    @property
+    def last_client(self):
+        return self.data['parts'][-1]['last_client'] if self.data['parts'] else 0
+
+    @property
+    def statements(self):
+        return sum(part['statements'] for part in self.data['parts'])
+
+    def add_part(self, filename, first_client, last_client, statements):
+        self.data['parts'].append({
+            'file': filename, 'first_client': first_client, 'last_client': last_client, 'statements': statements,
+        })
+        self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.data, fh, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _write_part(directory, manifest, rendered):
+    filename = f"part-{len(manifest.data['parts']) + 1:05d}.zip"
+    path = os.path.join(directory, filename)
+    with zipfile.ZipFile(path + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for client_id, html, pdf_bytes in rendered:
+            archive.writestr(f"{client_id}/statement-{manifest.data['period']}.html", html)
+            archive.writestr(f"{client_id}/statement-{manifest.data['period']}.pdf", pdf_bytes)
+    os.replace(path + '.tmp', path)
+    manifest.add_part(filename, rendered[0][0], rendered[-1][0], len(rendered))
+
+
+def generate(period_start, period_end, directory=None, batch_size=500, workers=None, progress=None):
+    """
+    Write statements for every client with a loan running between the two
+    dates. Returns the manifest; calling again after a failure carries on
+    from the last finished part.
+    """
+    period = f"{period_end:%Y-%m}"
+    directory = directory or output_dir(period)
+    os.makedirs(directory, exist_ok=True)
+    manifest = Manifest(directory, period)
+    if manifest.data['complete']:
+        return manifest
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker)
+    in_flight = deque()
+    window = 2 * workers
+    try:
+        for documents in client_batches(period_start, period_end, batch_size, after=manifest.last_client):
+            in_flight.append(pool.submit(render_batch, period, period_end, documents))
+            if len(in_flight) >= window:
+                _write_part(directory, manifest, in_flight.popleft().result())
+                if progress:
+                    progress(manifest)
+        while in_flight:
+            _write_part(directory, manifest, in_flight.popleft().result())
+            if progress:
+                progress(manifest)
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+    manifest.data['complete'] = True
+    manifest.save()
+    return manifest
@@ -0,0 +1,118 @@
+from datetime import date
+from decimal import Decimal
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Q, Sum
+from archive.models import ArchivedLoan, ArchivedPayment
+from core.models import GroupLoan, GroupLoanPayment, IndividualLoan, IndividualLoanPayment
+from jobs.queue import task
+from mifi import sharding
+from . import statements
+from .models import ActiveGroupsReport, ActiveLoansReport, AmountLoanedReport, PaymentsCollectedReport
+
+
+def _fanned_out(queryset, **aggregates):
+    """
+    queryset.aggregate() for counts and sums, added up over every shard when
+    the rows are loan rows.
+    """
+    totals = dict.fromkeys(aggregates)
+    aliases = sharding.shards() if sharding.is_sharded(queryset.model) else [queryset.db]
+    for alias in aliases:
+        for name, value in queryset.using(alias).aggregate(**aggregates).items():
+            if value is not None:
+                totals[name] = value if totals[name] is None else totals[name] + value
+    return totals
+
+
+def _total(queryset, field):
+    return _fanned_out(queryset, total=Sum(field))['total'] or Decimal('0.00')
+
+
+def _archived(model):
+    """Completed loans of `model` moved out of the hot tables; reports count them too."""
+    return ArchivedLoan.objects.filter(content_type=ContentType.objects.get_for_model(model))
+
+
+@task('reports.payments_collected')
+def generate_payments_collected(start_date, end_date, generated_by_id=None):
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    total = Decimal('0.00')
+    count = 0
+    for model in (IndividualLoanPayment, GroupLoanPayment, ArchivedPayment):
+        row = _fanned_out(model.objects.filter(
+            payment_date__date__gte=start_date,
+            payment_date__date__lte=end_date
+        ), total=Sum('amount'), count=Count('id'))
+        total += row['total'] or Decimal('0.00')
+        count += row['count']
+
+    report = PaymentsCollectedReport.objects.create(
+        name=f"Payments collected {start_date} to {end_date}",
+        generated_by_id=generated_by_id,
+        start_date=start_date,
+        end_date=end_date,
+        total_payments=total,
+        payment_count=count,
+    )
+    return {'report_id': report.id}
+
+
+@task('reports.active_groups')
+def generate_active_groups(generated_by_id=None):
+    counts = _fanned_out(
+        GroupLoan.objects.all(),
+        total=Count('id'),
+        active=Count('id', filter=Q(status='active')),
+    )
+    report = ActiveGroupsReport.objects.create(
+        name="Active groups",
+        generated_by_id=generated_by_id,
+        total_groups=counts['total'] + _archived(GroupLoan).count(),
+        active_groups=counts['active'],
+    )
+    return {'report_id': report.id}
+
+
+@task('reports.amount_loaned')
+def generate_amount_loaned(generated_by_id=None):
+    individual = _total(IndividualLoan.objects.all(), 'amount') + _total(_archived(IndividualLoan), 'amount')
+    group = _total(GroupLoan.objects.all(), 'amount') + _total(_archived(GroupLoan), 'amount')
+    report = AmountLoanedReport.objects.create(
+        name="Amount loaned",
+        generated_by_id=generated_by_id,
+        total_amount=individual + group,
+        individual_loans_amount=individual,
+        group_loans_amount=group,
+    )
+    return {'report_id': report.id}
+
+
+@task('reports.active_loans')
+def generate_active_loans(generated_by_id=None):
+    totals = {'total': 0, 'active': 0, 'overdue': 0}
+    for model in (IndividualLoan, GroupLoan):
+        counts = _fanned_out(
+            model.objects.all(),
+            total=Count('id'),
+            active=Count('id', filter=Q(status='active')),
+            overdue=Count('id', filter=Q(status='overdue')),
+        )
+        for key in totals:
+            totals[key] += counts[key]
+        totals['total'] += _archived(model).count()
+
+    report = ActiveLoansReport.objects.create(
+        name="Active loans",
+        generated_by_id=generated_by_id,
+        total_loans=totals['total'],
+        active_loans=totals['active'],
+        overdue_loans=totals['overdue'],
+    )
+    return {'report_id': report.id}
+
+
+@task('reports.client_statements')
+def generate_client_statements(month=None):
+    month = month or statements.last_month()
+    manifest = statements.generate(*statements.month_bounds(month))
+    return {'month': month, 'statements': manifest.statements, 'parts': len(manifest.data['parts'])}
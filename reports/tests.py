@@ -1,3 +1,60 @@
+from datetime import timedelta
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils import timezone
+
+from core.tests import make_group_loan, make_individual_loan, make_user
+from ledger import journal
+from . import statements
+
+
+class StatementTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        today = timezone.localdate()
+        self.period_start, self.period_end = today - timedelta(days=10), today - timedelta(days=1)
+        self.officer = make_user('loan_officer')
+        self.client_user = make_user()
+        self.loan = make_individual_loan(self.officer, self.client_user, start_date=today - timedelta(days=20))
+        self.group = make_group_loan(self.officer, [self.client_user, make_user()], start_date=today - timedelta(days=20))
+
+    def statement(self):
+        [documents] = statements.client_batches(self.period_start, self.period_end, batch_size=10)
+        [document] = [document for document in documents if document['client']['id'] == self.client_user.pk]
+        return {loan['kind']: loan for loan in document['loans']}
+
+    def test_closed_period_shows_the_balances_at_its_end(self):
+        journal.post_charge(self.loan, 'interest', Decimal('12.50'), effective_date=self.period_end)
+        before = self.statement()
+        self.assertEqual(
+            (before['individual']['total_due'], before['individual']['total_paid'], before['individual']['status']),
+            (Decimal('1012.50'), Decimal('0.00'), 'active')
+        )
+
+        # Paid off after the period closed
+        self.loan.make_normal_payment(Decimal('1012.50'), self.officer)
+        self.group.make_normal_payment(Decimal('100.00'), self.officer, self.client_user)
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.status, 'completed')
+
+        again = self.statement()
+        self.assertEqual(again['individual'], before['individual'])
+        self.assertEqual((again['group']['total_due'], again['group']['payments']), (Decimal('1000.00'), []))
+
+        [(_, html, _)] = statements.render_batch('period', self.period_end, [{
+            'client': {'id': self.client_user.pk, 'name': 'Client', 'nrc_number': '', 'phone_number': ''},
+            'loans': [again['individual']],
+        }])
+        self.assertIn(b'<tr><th>Outstanding</th><td class="amount">1012.50</td></tr>', html)
 
-# Create your tests here.
+    def test_balances_start_from_a_snapshot_of_the_day(self):
+        journal.post_charge(self.loan, 'interest', Decimal('2.00'), effective_date=self.period_end)
+        journal.take_snapshots(self.period_end)
+        # Back-dated after the snapshot was taken, and dated after the period
+        journal.post_charge(self.loan, 'penalty', Decimal('0.30'), effective_date=self.period_start)
+        journal.post_charge(self.loan, 'penalty', Decimal('5.00'))
+        totals = journal.balances(type(self.loan), [self.loan.pk], self.period_end)[self.loan.pk]
+        self.assertEqual(totals, journal.balance(self.loan, as_of=self.period_end))
+        self.assertEqual(totals['total_due'], Decimal('1002.30'))
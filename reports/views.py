@@ -1,5 +1,10 @@
-from rest_framework import viewsets
+from django.shortcuts import get_object_or_404
+from rest_framework import status, viewsets
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from jobs import queue
+from jobs.models import Job
+from mifi.sparse import SparseQuerysetMixin
 from .models import (
     PaymentsCollectedReport,
     ActiveGroupsReport,
@@ -10,26 +15,54 @@ from .serializers import (
     PaymentsCollectedReportSerializer,
     ActiveGroupsReportSerializer,
     AmountLoanedReportSerializer,
-    ActiveLoansReportSerializer
+    ActiveLoansReportSerializer,
+    ReportJobSerializer,
+    ReportRequestSerializer
 )
 from users.permissions import IsRegionManagerOrHigher
 
-class PaymentsCollectedViewSet(viewsets.ModelViewSet):
+class PaymentsCollectedViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = PaymentsCollectedReport.objects.all()
     serializer_class = PaymentsCollectedReportSerializer
     permission_classes = [IsAuthenticated, IsRegionManagerOrHigher]
+    throttle_scope = 'reports'
 
-class ActiveGroupsViewSet(viewsets.ModelViewSet):
+class ActiveGroupsViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = ActiveGroupsReport.objects.all()
     serializer_class = ActiveGroupsReportSerializer
     permission_classes = [IsAuthenticated, IsRegionManagerOrHigher]
+    throttle_scope = 'reports'
 
-class AmountLoanedViewSet(viewsets.ModelViewSet):
+class AmountLoanedViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = AmountLoanedReport.objects.all()
     serializer_class = AmountLoanedReportSerializer
     permission_classes = [IsAuthenticated, IsRegionManagerOrHigher]
+    throttle_scope = 'reports'
 
-class ActiveLoansViewSet(viewsets.ModelViewSet):
+class ActiveLoansViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = ActiveLoansReport.objects.all()
     serializer_class = ActiveLoansReportSerializer
-    permission_classes = [IsAuthenticated, IsRegionManagerOrHigher]
\ No newline at end of file
+    permission_classes = [IsAuthenticated, IsRegionManagerOrHigher]
+    throttle_scope = 'reports'
+
+class ReportGenerationViewSet(viewsets.ViewSet):
+    """Reports are built by the job worker; this queues one and lets the caller poll for it"""
+    permission_classes = [IsAuthenticated, IsRegionManagerOrHigher]
+    throttle_scope = 'reports'
+
+    def create(self, request):
+        serializer = ReportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        payload = {'generated_by_id': request.user.id}
+        if data['report'] == 'payments_collected':
+            payload['start_date'] = data['start_date'].isoformat()
+            payload['end_date'] = data['end_date'].isoformat()
+
+        job = queue.enqueue(f"reports.{data['report']}", payload, priority=5)
+        return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    def retrieve(self, request, pk=None):
+        job = get_object_or_404(Job, pk=pk, name__startswith='reports.')
+        return Response(ReportJobSerializer(job).data)
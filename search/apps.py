@@ -0,0 +1,22 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def repair_search_index(sender, using, **kwargs):
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    from .index import install
+
+    connection = connections[using]
+    if ('search', '0001_initial') not in MigrationRecorder(connection).applied_migrations():
+        return
+    with connection.schema_editor() as schema_editor:
+        install(schema_editor)
+
+
+class SearchConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'search'
+
+    def ready(self):
+        post_migrate.connect(repair_search_index, sender=self)
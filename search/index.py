@@ -0,0 +1,193 @@
+import re
+
+from django.apps import apps
+from django.db import connection, connections, router
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+# Table, indexed columns and FTS table for every searchable model. Column
+# order matters on SQLite: it is the column order of the FTS5 table.
+INDEXES = {
+    'users.User': {
+        'table': 'users_user',
+        'columns': ['first_name', 'last_name', 'email', 'nrc_number', 'phone_number'],
+        'trigram': ['nrc_number', 'phone_number'],
+        'fts': 'search_user_fts',
+    },
+    'core.IndividualLoan': {
+        'table': 'core_individualloan',
+        'columns': ['first_name', 'last_name'],
+        'trigram': [],
+        'fts': 'search_individualloan_fts',
+    },
+    'core.GroupLoan': {
+        'table': 'core_grouploan',
+        'columns': ['group_name'],
+        'trigram': [],
+        'fts': 'search_grouploan_fts',
+    },
+}
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text or '')
+
+
+def is_identifier(text):
+    """One word with a digit in it, such as an NRC or phone number."""
+    return not any(char.isspace() for char in text) and any(char.isdigit() for char in text)
+
+
+def install(schema_editor=None):
+    """
+    Create (or repair) the full-text index for the current backend. Safe to run
+    repeatedly: it is called from the search migration and again after every
+    `migrate`, because SQLite table rebuilds in later migrations drop the
+    triggers that keep the FTS tables in sync.
+    """
+    conn = schema_editor.connection if schema_editor else connection
+    if conn.vendor == 'sqlite':
+        _install_sqlite(conn)
+    elif conn.vendor == 'postgresql':
+        _install_postgresql(conn)
+
+
+def _specs(conn):
+    """The INDEXES entries whose tables are on the database, as loans alone are on a shard."""
+    return [spec for label, spec in INDEXES.items() if router.allow_migrate_model(conn.alias, apps.get_model(label))]
+
+
+def _sqlite_tables(spec):
+    """FTS5 tables per model: word-prefix index, plus a trigram index for identifier infixes."""
+    tables = [(spec['fts'], spec['columns'], "prefix='2 3 4'")]
+    if spec['trigram']:
+        tables.append((f"{spec['fts']}_trgm", spec['trigram'], "tokenize='trigram'"))
+    return tables
+
+
+def _install_sqlite(conn):
+    with conn.cursor() as cursor:
+        for spec in _specs(conn):
+            table = spec['table']
+            for fts, columns, options in _sqlite_tables(spec):
+                cols = ', '.join(columns)
+                new_cols = ', '.join(f'new.{c}' for c in columns)
+                old_cols = ', '.join(f'old.{c}' for c in columns)
+
+                cursor.execute(
+                    f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                    f"AND name IN ('{fts}_ai', '{fts}_ad', '{fts}_au')"
+                )
+                triggers_present = cursor.fetchone()[0] == 3
+
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"{cols}, content='{table}', content_rowid='id', {options})"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+                    f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+                )
+
+                # Rows written while the triggers were missing are not in the index yet
+                if not triggers_present:
+                    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _tsvector(columns, table=None):
+    prefix = f'{table}.' if table else ''
+    return "to_tsvector('simple', " + " || ' ' || ".join(f"coalesce({prefix}{c}, '')" for c in columns) + ")"
+
+
+def _install_postgresql(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for spec in _specs(conn):
+            table = spec['table']
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} "
+                f"USING gin ({_tsvector(spec['columns'])})"
+            )
+            for column in spec['trigram']:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_{column}_trgm_idx ON {table} "
+                    f"USING gin ({column} gin_trgm_ops)"
+                )
+
+
+def uninstall(schema_editor):
+    conn = schema_editor.connection
+    with conn.cursor() as cursor:
+        for spec in _specs(conn):
+            if conn.vendor == 'sqlite':
+                for fts, columns, options in _sqlite_tables(spec):
+                    for suffix in ('ai', 'ad', 'au'):
+                        cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+                    cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+            elif conn.vendor == 'postgresql':
+                cursor.execute(f"DROP INDEX IF EXISTS {spec['table']}_search_idx")
+                for column in spec['trigram']:
+                    cursor.execute(f"DROP INDEX IF EXISTS {spec['table']}_{column}_trgm_idx")
+
+
+def search(queryset, text):
+    """
+    Narrow `queryset` to rows matching every word of `text` as a prefix
+    (an identifier anywhere in NRC and phone numbers), best matches first.
+    The caller's filters (role scoping) stay in the same SQL statement, so
+    the index does the matching and the database does the scoping in one
+    pass.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return queryset.none()
+
+    model = queryset.model
+    spec = INDEXES[model._meta.label]
+    table = spec['table']
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'sqlite':
+        relation, match = 'search_match', ' '.join(f'"{token}"*' for token in tokens)
+        identifier = text.strip()
+        if spec['trigram'] and len(identifier) >= 3 and is_identifier(identifier):
+            # NRC and phone numbers are matched anywhere in the string
+            relation, match = 'search_trigram_match', '"{}"'.format(identifier.replace('"', '""'))
+        # One MATCH, joined to the rows on rowid, with its bm25 rank to order by
+        return queryset.filter(**{f'{relation}__document__match': match}).annotate(
+            search_rank=F(f'{relation}__rank')
+        ).order_by('search_rank')
+
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        vector = _tsvector(spec['columns'])
+        where = f"{vector} @@ to_tsquery('simple', %s)"
+        params = [tsquery]
+        # Identifiers such as NRC and phone numbers are also matched anywhere in the string
+        for column in spec['trigram']:
+            where += f" OR {column} ILIKE %s"
+            params.append(f"%{text.strip()}%")
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT id FROM {table} WHERE {where}", params)
+        ).annotate(
+            search_rank=RawSQL(
+                f"ts_rank({_tsvector(spec['columns'], table)}, to_tsquery('simple', %s))", [tsquery]
+            )
+        ).order_by('-search_rank')
+
+    condition = Q()
+    for token in tokens:
+        token_q = Q()
+        for column in spec['columns']:
+            token_q |= Q(**{f'{column}__istartswith': token})
+        condition &= token_q
+    return queryset.filter(condition)
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from search.index import install
+    install(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    from search.index import uninstall
+    uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('users', '0003_alter_user_role'),
+        ('core', '0012_collateral_rejected_review_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
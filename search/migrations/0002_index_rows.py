@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:39
+
+import django.db.models.deletion
+import search.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_shard_foreign_keys'),
+        ('search', '0001_initial'),
+        ('users', '0003_alter_user_role'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupLoanMatch',
+            fields=[
+                ('rank', models.FloatField()),
+                ('loan', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_match', serialize=False, to='core.grouploan')),
+                ('document', search.models.MatchField(db_column='search_grouploan_fts')),
+            ],
+            options={
+                'db_table': 'search_grouploan_fts',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='IndividualLoanMatch',
+            fields=[
+                ('rank', models.FloatField()),
+                ('loan', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_match', serialize=False, to='core.individualloan')),
+                ('document', search.models.MatchField(db_column='search_individualloan_fts')),
+            ],
+            options={
+                'db_table': 'search_individualloan_fts',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserMatch',
+            fields=[
+                ('rank', models.FloatField()),
+                ('user', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_match', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('document', search.models.MatchField(db_column='search_user_fts')),
+            ],
+            options={
+                'db_table': 'search_user_fts',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTrigramMatch',
+            fields=[
+                ('rank', models.FloatField()),
+                ('user', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_trigram_match', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('document', search.models.MatchField(db_column='search_user_fts_trgm')),
+            ],
+            options={
+                'db_table': 'search_user_fts_trgm',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+    ]
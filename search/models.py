@@ -0,0 +1,69 @@
+"""
+The SQLite FTS5 tables as unmanaged models, so that a search is an
+ordinary join: `<row>__search_match__document__match=<query>` joins the
+index once on rowid and leaves `rank` (bm25) to order by. The tables are
+created by index.install(), not by migrations; PostgreSQL has none.
+"""
+from django.db import models
+
+
+class MatchField(models.TextField):
+    """An FTS5 table's hidden column named after the table: `__match` is a MATCH against the whole row."""
+
+
+@MatchField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class IndexRow(models.Model):
+    rank = models.FloatField()
+
+    class Meta:
+        abstract = True
+        managed = False
+
+
+class UserMatch(IndexRow):
+    user = models.OneToOneField(
+        'users.User', on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_match'
+    )
+    document = MatchField(db_column='search_user_fts')
+
+    class Meta(IndexRow.Meta):
+        db_table = 'search_user_fts'
+
+
+class UserTrigramMatch(IndexRow):
+    user = models.OneToOneField(
+        'users.User', on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_trigram_match'
+    )
+    document = MatchField(db_column='search_user_fts_trgm')
+
+    class Meta(IndexRow.Meta):
+        db_table = 'search_user_fts_trgm'
+
+
+class IndividualLoanMatch(IndexRow):
+    loan = models.OneToOneField(
+        'core.IndividualLoan', on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_match'
+    )
+    document = MatchField(db_column='search_individualloan_fts')
+
+    class Meta(IndexRow.Meta):
+        db_table = 'search_individualloan_fts'
+
+
+class GroupLoanMatch(IndexRow):
+    loan = models.OneToOneField(
+        'core.GroupLoan', on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_match'
+    )
+    document = MatchField(db_column='search_grouploan_fts')
+
+    class Meta(IndexRow.Meta):
+        db_table = 'search_grouploan_fts'
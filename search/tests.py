@@ -0,0 +1,44 @@
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from core.tests import API, make_individual_loan, make_user
+from users.models import User
+from .index import search
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class SearchTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.banda = make_user(first_name='Mwila', last_name='Banda', phone_number='+260977123456')
+        self.bwalya = make_user(first_name='Bwalya', last_name='Mwanza', phone_number='+260966000111')
+        self.manager = make_user('manager', first_name='Grace', last_name='Phiri')
+
+    def ids(self, queryset, text):
+        return list(search(queryset, text).values_list('id', flat=True))
+
+    def test_every_word_matches_as_a_prefix(self):
+        self.assertEqual(self.ids(User.objects.all(), 'mw ban'), [self.banda.pk])
+        self.assertEqual(set(self.ids(User.objects.all(), 'mw')), {self.banda.pk, self.bwalya.pk})
+        self.assertEqual(self.ids(User.objects.all(), 'nobody'), [])
+
+    def test_identifiers_match_anywhere(self):
+        self.assertEqual(self.ids(User.objects.all(), '7712345'), [self.banda.pk])
+        self.assertEqual(self.ids(User.objects.all(), self.bwalya.nrc_number), [self.bwalya.pk])
+
+    def test_best_match_first(self):
+        other = make_user(first_name='Banda', last_name='Banda')
+        self.assertEqual(self.ids(User.objects.all(), 'banda')[0], other.pk)
+
+    def test_keeps_the_caller_scope(self):
+        self.assertEqual(self.ids(User.objects.exclude(pk=self.banda.pk), 'mw'), [self.bwalya.pk])
+
+    def test_search_endpoint(self):
+        officer = make_user('loan_officer')
+        loan = make_individual_loan(officer, self.banda)
+        make_individual_loan(make_user('loan_officer'), self.bwalya)
+        client = APIClient()
+        client.force_authenticate(officer)
+        results = client.get(API + 'search/', {'q': 'mwila ban', 'type': 'individual'}).json()['results']
+        self.assertEqual([row['id'] for row in results['individual_loans']], [loan.pk])
@@ -0,0 +1,86 @@
+from django.db.models import Q
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from core.models import GroupLoan, IndividualLoan
+from mifi import sharding
+from users.models import User
+from .index import search
+
+MAX_RESULTS = 50
+
+
+class SearchViewSet(sharding.ShardedViewMixin, viewsets.ViewSet):
+    """
+    Prefix search over clients, individual loans and groups, e.g.
+    `?q=ban mwa&type=clients,groups`. Each result set is limited to what
+    the caller could already see through the list endpoints; loan searches
+    by managers and clients run on every shard and are merged best match
+    first.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def scoped_users(self, user):
+        queryset = User.objects.all()
+        if user.role in ['superuser', 'manager']:
+            return queryset
+        elif user.role == 'region_manager':
+            return queryset.filter(region=user.region)
+        elif user.role == 'loan_officer':
+            return queryset.filter(Q(role='clients') | Q(id=user.id))
+        return queryset.filter(id=user.id)
+
+    def scoped_individual_loans(self, user):
+        queryset = IndividualLoan.objects.all()
+        if user.role in ['superuser', 'manager', 'region_manager']:
+            return queryset
+        elif user.role == 'loan_officer':
+            return queryset.filter(loan_officer=user)
+        return queryset.filter(Q(loan_officer=user) | Q(recipient=user))
+
+    def scoped_group_loans(self, user):
+        queryset = GroupLoan.objects.all()
+        if user.role in ['superuser', 'manager', 'region_manager']:
+            return queryset
+        elif user.role == 'loan_officer':
+            return queryset.filter(loan_officer=user)
+        return queryset.filter(members=user)
+
+    def search_loans(self, queryset, text, fields, limit):
+        if not sharding.reads_every_shard(self.request.user):
+            return list(search(queryset, text).values(*fields)[:limit])
+        found = [search(queryset.using(alias), text) for alias in sharding.shards()]
+        # merged() sorts by the rank, so it is read along with the fields
+        rank = ['search_rank'] if 'search_rank' in found[0].query.annotations else []
+        rows = sharding.merged([matches.values(*fields, *rank)[:limit] for matches in found])[:limit]
+        for row in rows:
+            row.pop('search_rank', None)
+        return rows
+
+    def list(self, request):
+        text = request.query_params.get('q', '').strip()
+        types = set(filter(None, request.query_params.get('type', 'clients,individual,groups').split(',')))
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), MAX_RESULTS)
+        except ValueError:
+            limit = 20
+
+        results = {}
+        if 'clients' in types:
+            results['clients'] = list(
+                search(self.scoped_users(request.user), text).values(
+                    'id', 'first_name', 'last_name', 'email', 'nrc_number', 'phone_number', 'role', 'region'
+                )[:limit]
+            )
+        if 'individual' in types:
+            results['individual_loans'] = self.search_loans(
+                self.scoped_individual_loans(request.user), text,
+                ['id', 'first_name', 'last_name', 'recipient_id', 'amount', 'status', 'start_date', 'end_date'], limit
+            )
+        if 'groups' in types:
+            results['group_loans'] = self.search_loans(
+                self.scoped_group_loans(request.user), text,
+                ['id', 'group_name', 'frequency_letter', 'amount', 'status', 'start_date', 'end_date'], limit
+            )
+
+        return Response({'query': text, 'results': results})
@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+
+from mifi.large_admin import THIS_MODEL, LargeTableAdmin
 from .models import User
 
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(LargeTableAdmin, UserAdmin):
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         ('Personal info', {'fields': ('first_name', 'last_name', 'phone_number', 'address', 'region')}),
@@ -19,7 +21,19 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
     list_display = ('email', 'first_name', 'last_name', 'role', 'is_staff')
-    search_fields = ('email', 'first_name', 'last_name')
+    search_fields = ('^email', '^first_name', '^last_name')
+    search_index = (THIS_MODEL,)
     ordering = ('email',)
+    actions = ['activate_users', 'deactivate_users']
+
+    @admin.action(description="Activate selected users")
+    def activate_users(self, request, queryset):
+        updated = queryset.update(is_active=True)
+        self.message_user(request, f"{updated} users activated.")
+
+    @admin.action(description="Deactivate selected users")
+    def deactivate_users(self, request, queryset):
+        updated = queryset.exclude(pk=request.user.pk).update(is_active=False)
+        self.message_user(request, f"{updated} users deactivated.")
 
 admin.site.register(User, CustomUserAdmin)
\ No newline at end of file
@@ -1,8 +1,10 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 import re
 
+from outbox import events
+
 def user_directory_path(instance, filename):
     # Replace spaces and special characters with underscores
     safe_name = re.sub(r'[^a-zA-Z0-9_]', '_', instance.first_name)
@@ -72,5 +74,12 @@ class User(AbstractUser):
             if not all([self.first_name, self.last_name, self.date_of_birth]):
                 raise ValidationError("Clients must have first name, last name, and date of birth.")
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if creating:
+                events.users_created([self])
+
     def __str__(self):
         return f"{self.email} ({self.get_role_display()})"
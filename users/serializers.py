@@ -1,10 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from mifi.sparse import SparseSerializerMixin
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
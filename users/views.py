@@ -1,12 +1,18 @@
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import get_user_model
-from .serializers import UserSerializer
+from mifi.sparse import SparseQuerysetMixin
+from .serializers import CustomTokenObtainPairSerializer, UserSerializer
 from .permissions import CanCreateClient, IsManagerOrHigher, IsRegionManagerOrHigher
 
 User = get_user_model()
 
-class UserViewSet(viewsets.ModelViewSet):
+class TokenObtainView(TokenObtainPairView):
+    serializer_class = CustomTokenObtainPairSerializer
+    throttle_scope = 'login'
+
+class UserViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, CanCreateClient]